@@ -0,0 +1,149 @@
+import os
+import subprocess
+import sys
+import pandas as pd
+from record_linkage.bloom import BloomConfig, benchmark_encoding
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Benchmarks of the protocol steps.
+# Run from the root directory of the project: python -m evaluation.benchmark
+
+
+def benchmark_bloom_encoding(data_path, num_values=2000):
+    """
+    Measure the per-value encoding cost of each hash family on real identifier values.
+    :param data_path: original dataset of a data holder
+    :param num_values: number of identifier values to be encoded per config
+    :return: list of (config, seconds per value)
+    """
+    df = pd.read_csv(data_path, usecols=['given_name', 'surname', 'address_2', 'suburb'])
+    values = df.astype(str).values.ravel().tolist()[:num_values]
+    configs = [BloomConfig(size=500, num_hash=10, hash_family='hmac'),
+               BloomConfig(size=500, num_hash=10, hash_family='blake2b'),
+               BloomConfig(size=500, num_hash=10, ngram_size=3, hash_family='blake2b')]
+    print(f'Encoding {len(values)} identifier values')
+    return benchmark_encoding(values, configs)
+
+
+def encode_all_records(holder_name, data_path, holder_dir, bloom_config, hierarchy_file_dir_path='dataset/hierarchy/'):
+    """
+    encode the identifiers of every record of a dataset, like evaluation.experiment_grid.encode_task
+    :return: FilterStore of the encoded identifiers
+    """
+    from run import participant
+    from record_linkage.filter_store import open_filter_store
+    from evaluation.experiment_grid import QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTES, IDENTIFIER
+    os.makedirs(holder_dir, exist_ok=True)
+    data_holder = participant.DataHolder(holder_name, data_path, holder_dir, hierarchy_file_dir_path,
+                                         QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTES, IDENTIFIER, bloom_config=bloom_config)
+    pd.read_csv(data_path, usecols=['index'])['index'].to_csv(data_holder.candidate_records_index_file_path,
+                                                              index=False, header=False)
+    return open_filter_store(data_holder.send_encode_identifiers_in_bloom_filter())
+
+
+def benchmark_compact_filters(data_path_A, data_path_B, output_dir, configs=None, threshold=0.8, repeat=3):
+    """
+    Size, comparison throughput and matching quality of XOR-folded and bit-sampled bloom filters.
+    All records of A and B are encoded with each config and all pairs are compared like Classifier2.compare_links
+    (gather of the packed filters of each link), then matched like Classifier2.identify_record_linkage.
+    :param output_dir: directory of the encodings and matched links of each config, ends with /
+    :param configs: list of BloomConfig, the first one is the baseline of the gains
+    :param threshold: pairs with Dice-coefficient > threshold at every field are matched
+    :param repeat: the best of repeat comparisons is reported
+    :return: DataFrame, one row per config
+    """
+    import time
+    import numpy as np
+    from record_linkage.filter_store import compare_with_stores
+    from evaluation.evaluation import evaluate_match_result
+    if configs is None:
+        configs = [BloomConfig(size=1000, num_hash=10),
+                   BloomConfig(size=1000, num_hash=10, fold=1),
+                   BloomConfig(size=1000, num_hash=10, fold=2),
+                   BloomConfig(size=1000, num_hash=10, sample_size=250),
+                   BloomConfig(size=1000, num_hash=10, fold=1, sample_size=250)]
+    rows = []
+    for i, config in enumerate(configs):
+        config_dir = f'{output_dir}config_{i}/'
+        store_A = encode_all_records('A', data_path_A, f'{config_dir}A/', config)
+        store_B = encode_all_records('B', data_path_B, f'{config_dir}B/', config)
+        # all pairs as candidate links
+        keys_A = np.repeat(store_A.keys, len(store_B))
+        keys_B = np.tile(store_B.keys, len(store_A))
+        best = float('inf')
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            similarities = compare_with_stores(store_A, store_B, keys_A, keys_B)
+            best = min(best, time.perf_counter() - start_time)
+        df_compare = pd.DataFrame(similarities, index=pd.MultiIndex.from_arrays([keys_A, keys_B],
+                                                                               names=['index', 'index']))
+        matched_links_path = f'{config_dir}matched_links.csv'
+        df_compare[(df_compare.T > threshold).all()].to_csv(matched_links_path)
+        precision, recall, f_score, _ = evaluate_match_result(matched_links_path, data_path_A, data_path_B)
+        bytes_per_record = sum((num_bits + 7) // 8 for num_bits in store_A.num_bits.values())
+        rows.append((repr(config), config.output_size, bytes_per_record, len(keys_A) / best, precision, recall,
+                     f_score))
+    df = pd.DataFrame(rows, columns=['config', 'bits_per_field', 'bytes_per_record', 'links_per_second',
+                                     'precision', 'recall', 'f_score'])
+    df['size_gain'] = df['bytes_per_record'].iloc[0] / df['bytes_per_record']
+    df['throughput_gain'] = df['links_per_second'] / df['links_per_second'].iloc[0]
+    df['f_score_change'] = df['f_score'] - df['f_score'].iloc[0]
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.max_colwidth', 80):
+        print(df)
+    return df
+
+
+def benchmark_import_time(statement, forbidden_modules=(), repeat=3):
+    """
+    Measure the import time of a statement in a fresh interpreter, and check which heavy modules it loaded.
+    :param statement: import statement, e.g. 'from run import participant'
+    :param forbidden_modules: modules which must not be loaded by the statement, e.g. ['recordlinkage']
+    :param repeat: the best of repeat runs is reported
+    :return: (seconds, list of forbidden modules that were loaded)
+    """
+    code = (f'import sys, time\n'
+            f'start_time = time.perf_counter()\n'
+            f'{statement}\n'
+            f'print(time.perf_counter() - start_time)\n'
+            f'print(",".join(m for m in {list(forbidden_modules)!r} if m in sys.modules))\n')
+    best = float('inf')
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], cwd=PROJECT_ROOT, capture_output=True, text=True,
+                                check=True).stdout.splitlines()
+        best = min(best, float(output[0]))
+        loaded = [m for m in output[1].split(',') if m]
+    print(f'{statement!r}: {best * 1000:.1f} ms' + (f', loaded {loaded}' if loaded else ''))
+    return best, loaded
+
+
+def benchmark_participant_imports():
+    """
+    Import time of the participant entry points.
+    A data holder that only encodes must never load recordlinkage or matplotlib.
+    :return: list of (statement, seconds, loaded forbidden modules)
+    """
+    heavy_modules = ['recordlinkage', 'matplotlib', 'pandas', 'numpy']
+    statements = ['import run.cli',
+                  'from run import participant',
+                  # everything the holder-encode role imports when it runs
+                  'from run import participant; import run.cli; import pandas; import record_linkage.bloom',
+                  'import evaluation.evaluation']
+    results = []
+    for statement in statements:
+        seconds, loaded = benchmark_import_time(statement, heavy_modules)
+        results.append((statement, seconds, loaded))
+    encode_loaded = results[2][2]
+    if 'recordlinkage' in encode_loaded or 'matplotlib' in encode_loaded:
+        print(f'WARNING: encoding data holder loads {encode_loaded}')
+    return results
+
+
+if __name__ == '__main__':
+    print("Benchmark of record linkage steps")
+    benchmark_participant_imports()
+    benchmark_bloom_encoding('dataset/dataset_A/dataset_A.csv')
+    benchmark_compact_filters('dataset/dataset_A/dataset_A.csv', 'dataset/dataset_B/dataset_B.csv',
+                              'evaluation/test_dataset/compact_filters/')
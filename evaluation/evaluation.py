@@ -1,11 +1,7 @@
-import os
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import recordlinkage as rl
-from recordlinkage.index import Full
-
-from run import participant
+from helper.dataset_reader import read_csv_columns
+# matplotlib is only imported by the plotting functions, computing the metrics doesn't need it.
 
 
 # Evaluate the results of record linkage matching.
@@ -23,8 +19,9 @@ from run import participant
 
 def evaluate_match_result(matched_links_path, dataset_A_path, dataset_B_path):
     df_links = pd.read_csv(matched_links_path)  # identified links
-    dataset_A = pd.read_csv(dataset_A_path)
-    dataset_B = pd.read_csv(dataset_B_path)
+    # only the record ids are compared
+    dataset_A = read_csv_columns(dataset_A_path, ['index', 'ID'])
+    dataset_B = read_csv_columns(dataset_B_path, ['index', 'ID'])
 
     columns_list = df_links.columns.tolist()
     columns_list[0] = 'index_a'
@@ -70,6 +67,7 @@ def plot_result_one_curve(measure_list, title):
     :param title:
     :return:
     """
+    import matplotlib.pyplot as plt
     measure_list = np.array(measure_list)
     # plot the f_score
     plt.plot(measure_list[:, 0], measure_list[:, 3])
@@ -93,6 +91,7 @@ def plot_result_multiple_curves(measure_lists, curve_titles, image_title):
     :param image_title: title of the plot
     :return:
     """
+    import matplotlib.pyplot as plt
     # plot the f_score
     cnt1=0
     for measure_list, curve_title in zip(measure_lists, curve_titles):
@@ -125,6 +124,37 @@ def plot_result_multiple_curves(measure_lists, curve_titles, image_title):
     plt.show()
 
 
+def measure_lists_from_metrics(df_metrics, curve_column, fixed=None):
+    """
+    Measure lists for plot_result_multiple_curves from the consolidated metrics table of evaluation.experiment_grid
+    :param df_metrics: metrics table, one row per configuration and threshold
+    :param curve_column: one curve per value of this column, e.g. 'k'
+    :param fixed: dict of the values of the other columns, e.g. {'data_size': 1500, 'num_hash': 10}
+    :return: (measure lists, curve titles)
+    """
+    df = df_metrics
+    for column, value in (fixed or {}).items():
+        df = df[df[column] == value]
+    measure_lists = []
+    curve_titles = []
+    for value, df_curve in df.sort_values('threshold').groupby(curve_column):
+        measure_lists.append(df_curve[['threshold', 'precision', 'recall', 'f_score',
+                                       'all_possible_matches_count']].values.tolist())
+        if curve_column == 'k':
+            curve_titles.append(f'k={value} without anonymization' if value == 0 else f'k={value} with anonymization')
+        else:
+            curve_titles.append(f'{curve_column}={value}')
+    return measure_lists, curve_titles
+
+
+def plot_metrics(df_metrics, curve_column, fixed, image_title):
+    """
+    Plot the F-Score and PR curves of one dimension of the metrics table, the other dimensions fixed
+    """
+    measure_lists, curve_titles = measure_lists_from_metrics(df_metrics, curve_column, fixed)
+    plot_result_multiple_curves(measure_lists, curve_titles, image_title)
+
+
 
 if __name__ == '__main__':
     print("Evaluation of record linkage matching results")
@@ -0,0 +1,211 @@
+import os
+import time
+import pandas as pd
+
+# Parallel runner of the evaluation grid: k x dataset size x number of hash functions x threshold.
+# The grid is expanded into a DAG of tasks that run in a process pool (run.orchestrator.ProtocolDAG).
+# Intermediate artifacts are shared by all configurations that have them in common:
+#   dataset:{size}                    the datasets A and B of a size, with modified records. Shared by all k and hashes
+#   anonymize:{size}:{k}              the anonymized datasets. Shared by all numbers of hash functions and thresholds
+#   block:{size}:{k}                  the candidate links of classifier 1. Shared by all hashes and thresholds
+#   encode:{size}:{num_hash}          the bloom filters of all records of A and B. Shared by all k and thresholds
+#   compare:{size}:{k}:{num_hash}     compared links, then matched links and metrics for every threshold
+#   no_anonymization:{size}:{num_hash}  all-pairs baseline without blocking (k = 0 in the metrics table)
+# The metrics of all configurations are collected in one table (metrics.csv), see evaluation.plot_metrics.
+#
+# Run from the root directory of the project: python -m evaluation.experiment_grid
+
+QUASI_IDENTIFIERS = ['sex', 'age', 'race', 'marital-status', 'education', 'native-country', 'workclass', 'occupation']
+SENSITIVE_ATTRIBUTES = ['salary-class']
+IDENTIFIER = ['given_name', 'surname', 'street_number', 'address_1', 'address_2', 'suburb', 'postcode', 'state',
+              'soc_sec_id']
+COLS_TO_MODIFY = ['given_name', 'surname', 'address_1', 'address_2', 'suburb', 'state']
+METRIC_COLUMNS = ['data_size', 'k', 'num_hash', 'threshold', 'precision', 'recall', 'f_score',
+                  'all_possible_matches_count', 'num_compared_links', 'seconds']
+
+
+class ExperimentGrid:
+    """
+    Configuration space of the evaluation
+    """
+
+    def __init__(self, output_dir, data_sizes=((1500, 200),), k_list=(5,), num_hash_list=(10,),
+                 thresholds=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1), no_anonymization=True,
+                 source_data_path='dataset/dataset.csv', hierarchy_file_dir_path='dataset/hierarchy/', num_bits=500,
+                 seed=0):
+        """
+        :param output_dir: directory of all artifacts and of metrics.csv, ends with /
+        :param data_sizes: (dataset size, intersection size) pairs, see generate_test_data.generate_dataset_diff_size
+        :param no_anonymization: also run the all-pairs baseline without anonymization and blocking
+        :param seed: seed of the random modification of the records
+        """
+        self.output_dir = output_dir
+        self.data_sizes = list(data_sizes)
+        self.k_list = list(k_list)
+        self.num_hash_list = list(num_hash_list)
+        self.thresholds = list(thresholds)
+        self.no_anonymization = no_anonymization
+        self.source_data_path = source_data_path
+        self.hierarchy_file_dir_path = hierarchy_file_dir_path
+        self.num_bits = num_bits
+        self.seed = seed
+
+    def size_dir(self, data_size):
+        return f'{self.output_dir}data_size_{data_size}/'
+
+    def to_dag(self):
+        from run.orchestrator import ProtocolDAG
+        dag = ProtocolDAG()
+        for data_size, intersection_size in self.data_sizes:
+            size_dir = self.size_dir(data_size)
+            dag.add_step(f'dataset:{data_size}', dataset_task,
+                         (self.source_data_path, size_dir, intersection_size, data_size, self.seed))
+            for k in self.k_list:
+                dag.add_step(f'anonymize:{data_size}:{k}', anonymize_task,
+                             (size_dir, k, self.hierarchy_file_dir_path), [f'dataset:{data_size}'])
+                dag.add_step(f'block:{data_size}:{k}', block_task, (size_dir, k, self.hierarchy_file_dir_path),
+                             [f'anonymize:{data_size}:{k}'])
+            for num_hash in self.num_hash_list:
+                dag.add_step(f'encode:{data_size}:{num_hash}', encode_task,
+                             (size_dir, num_hash, self.num_bits, self.hierarchy_file_dir_path), [f'dataset:{data_size}'])
+                for k in self.k_list:
+                    dag.add_step(f'compare:{data_size}:{k}:{num_hash}', compare_task,
+                                 (size_dir, data_size, k, num_hash, self.thresholds),
+                                 [f'block:{data_size}:{k}', f'encode:{data_size}:{num_hash}'])
+                if self.no_anonymization:
+                    dag.add_step(f'no_anonymization:{data_size}:{num_hash}', no_anonymization_task,
+                                 (size_dir, data_size, num_hash, self.thresholds), [f'encode:{data_size}:{num_hash}'])
+        return dag
+
+    def run(self, max_workers=None):
+        """
+        run all tasks and save the consolidated metrics table at {output_dir}metrics.csv
+        :return: DataFrame of the metrics, one row per configuration and threshold
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        dag = self.to_dag()
+        results = dag.run(max_workers=max_workers or os.cpu_count())
+        dag.report()
+        rows = [row for name, result in results.items()
+                if name.startswith(('compare:', 'no_anonymization:')) for row in result]
+        df_metrics = pd.DataFrame(rows, columns=METRIC_COLUMNS).sort_values(
+            ['data_size', 'k', 'num_hash', 'threshold']).reset_index(drop=True)
+        df_metrics.to_csv(f'{self.output_dir}metrics.csv', index=False)
+        print(f'{len(df_metrics)} rows of metrics saved at {self.output_dir}metrics.csv')
+        return df_metrics
+
+
+def dataset_task(source_data_path, size_dir, intersection_size, data_size, seed):
+    import random
+    from evaluation.generate_test_data import generate_dataset_diff_size
+    from helper.preprocess_dataset import random_modify_data
+    os.makedirs(size_dir, exist_ok=True)
+    generate_dataset_diff_size(source_data_path, size_dir, intersection_size, data_size)
+    random.seed(seed)
+    random_modify_data(size_dir + 'dataset_A.csv', COLS_TO_MODIFY, portion_row_to_modify=0.2, num_col_to_modify=3)
+    random_modify_data(size_dir + 'dataset_B.csv', COLS_TO_MODIFY, portion_row_to_modify=0.2, num_col_to_modify=3)
+    return size_dir + 'dataset_A.csv', size_dir + 'dataset_B.csv'
+
+
+def anonymize_task(size_dir, k, hierarchy_file_dir_path, datasets):
+    from run import participant
+    anonymized_data_paths = []
+    for holder_name, data_path in zip('AB', datasets):
+        holder_dir = f'{size_dir}k_{k}/{holder_name}/'
+        os.makedirs(holder_dir, exist_ok=True)
+        data_holder = participant.DataHolder(holder_name, data_path, holder_dir, hierarchy_file_dir_path,
+                                             QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTES, IDENTIFIER, k=k,
+                                             publish_class_table=True)
+        anonymized_data_paths.append((data_holder.send_anonymized_data(), data_holder.get_class_table_path()))
+    return anonymized_data_paths
+
+
+def block_task(size_dir, k, hierarchy_file_dir_path, anonymized):
+    from run import participant
+    (anonymized_path_A, class_table_path_A), (anonymized_path_B, class_table_path_B) = anonymized
+    classifier1 = participant.Classifier1(anonymized_path_A, anonymized_path_B, f'{size_dir}k_{k}/',
+                                          hierarchy_file_dir_path, QUASI_IDENTIFIERS,
+                                          class_table_path_A=class_table_path_A, class_table_path_B=class_table_path_B)
+    return classifier1.send_candidate_links()[0]
+
+
+def encode_task(size_dir, num_hash, num_bits, hierarchy_file_dir_path, datasets):
+    """
+    encode all records, so the encodings are shared by every k.
+    The filter stores are built here too, before the compare tasks of all k values open them at the same time.
+    """
+    from run import participant
+    from record_linkage.bloom import BloomConfig
+    from record_linkage.filter_store import open_filter_store
+    encoded_paths = []
+    for holder_name, data_path in zip('AB', datasets):
+        holder_dir = f'{size_dir}num_hash_{num_hash}/{holder_name}/'
+        os.makedirs(holder_dir, exist_ok=True)
+        data_holder = participant.DataHolder(holder_name, data_path, holder_dir, hierarchy_file_dir_path,
+                                             QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTES, IDENTIFIER,
+                                             bloom_config=BloomConfig(size=num_bits, num_hash=num_hash))
+        # every record is a candidate record
+        pd.read_csv(data_path, usecols=['index'])['index'].to_csv(data_holder.candidate_records_index_file_path,
+                                                                  index=False, header=False)
+        encoded_path = data_holder.send_encode_identifiers_in_bloom_filter()
+        open_filter_store(encoded_path)
+        encoded_paths.append(encoded_path)
+    return encoded_paths
+
+
+def threshold_metrics(df_compare, config_dir, datasets, thresholds):
+    """
+    matched links of each threshold, saved like the existing results at
+    {config_dir}matched_links_differ_threshold/matched_links_threshold_{int(threshold * 10)}.csv
+    :return: list of (threshold, precision, recall, f_score, all_possible_matches_count)
+    """
+    from evaluation.evaluation import evaluate_match_result
+    matched_dir = f'{config_dir}matched_links_differ_threshold/'
+    os.makedirs(matched_dir, exist_ok=True)
+    measures = []
+    for threshold in thresholds:
+        matched_links_path = f'{matched_dir}matched_links_threshold_{int(threshold * 10)}.csv'
+        df_compare[(df_compare.T > threshold).all()].to_csv(matched_links_path)
+        measures.append((threshold, *evaluate_match_result(matched_links_path, *datasets)))
+    return measures
+
+
+def compare_task(size_dir, data_size, k, num_hash, thresholds, candidate_links_path, encoded_paths):
+    from run import participant
+    start_time = time.time()
+    config_dir = f'{size_dir}k_{k}/num_hash_{num_hash}/'
+    os.makedirs(config_dir, exist_ok=True)
+    classifier2 = participant.Classifier2(encoded_paths[0], encoded_paths[1], candidate_links_path,
+                                          f'{config_dir}compared_links.zip', f'{config_dir}matched_links.csv')
+    df_compare = pd.read_csv(classifier2.compare_links(), index_col=[0, 1])
+    datasets = (f'{size_dir}dataset_A.csv', f'{size_dir}dataset_B.csv')
+    measures = threshold_metrics(df_compare, config_dir, datasets, thresholds)
+    seconds = time.time() - start_time
+    return [(data_size, k, num_hash, *measure, len(df_compare), seconds) for measure in measures]
+
+
+def no_anonymization_task(size_dir, data_size, num_hash, thresholds, encoded_paths):
+    from record_linkage.all_pairs import all_pairs_dice
+    from record_linkage.filter_store import open_filter_store
+    start_time = time.time()
+    config_dir = f'{size_dir}no_anonymization/num_hash_{num_hash}/'
+    os.makedirs(config_dir, exist_ok=True)
+    store_A = open_filter_store(encoded_paths[0])
+    store_B = open_filter_store(encoded_paths[1])
+    # only the pairs above the lowest threshold are needed for any threshold
+    df_compare = all_pairs_dice(store_A, store_B, min(thresholds))
+    datasets = (f'{size_dir}dataset_A.csv', f'{size_dir}dataset_B.csv')
+    measures = threshold_metrics(df_compare, config_dir, datasets, thresholds)
+    seconds = time.time() - start_time
+    num_compared_links = len(store_A) * len(store_B)
+    return [(data_size, 0, num_hash, *measure, num_compared_links, seconds) for measure in measures]
+
+
+if __name__ == '__main__':
+    from evaluation.evaluation import plot_metrics
+    grid = ExperimentGrid('evaluation/test_dataset/grid/', data_sizes=[(1500, 200), (2500, 400)],
+                          k_list=[5, 10, 15, 20], num_hash_list=[10, 20])
+    df_metrics = grid.run()
+    plot_metrics(df_metrics, 'k', {'data_size': 1500, 'num_hash': 10}, 'different k-Anonymity')
+    plot_metrics(df_metrics, 'num_hash', {'data_size': 1500, 'k': 5}, 'different number of hash functions')
+    plot_metrics(df_metrics, 'data_size', {'k': 5, 'num_hash': 10}, 'different data size')
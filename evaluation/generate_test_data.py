@@ -1,7 +1,5 @@
 import os
 import pandas as pd
-import recordlinkage as rl
-from recordlinkage.index import Full
 from helper.preprocess_dataset import random_modify_data
 from k_anonymize import mondrian
 from record_linkage.bloom import encode_bloom
@@ -41,6 +39,22 @@ def generate_dataset_diff_k(qi_list, sa_list, ident_list, original_data_path, hi
     df.to_csv(anonymized_data_path, index=False)
 
 
+def generate_dataset_multi_k(qi_list, sa_list, ident_list, original_data_path, hierarchy_file_dir_path, k_list,
+                             anonymized_data_path_pattern):
+    """
+    Like generate_dataset_diff_k for all k values at once, with the same anonymized data per k.
+    The dataset is read and mapped once and each partition of the recursion is sorted once for all k values.
+    :param k_list: the k values, e.g. range(5, 21, 5)
+    :param anonymized_data_path_pattern: path of the anonymized dataset with a {k} placeholder,
+    e.g. 'test_dataset/change_k/k_{k}/k_{k}_anonymized_dataset_A_no_sa_ident.csv'
+    """
+    df_dict = mondrian.run_anonymize_multi_k(qi_list, sa_list, ident_list, original_data_path,
+                                             hierarchy_file_dir_path, list(k_list))
+    for k, df in df_dict.items():
+        df = df.drop(columns=ident_list + sa_list + ['ID'])
+        df.to_csv(anonymized_data_path_pattern.format(k=k), index=False)
+
+
 def encode_identifiers_for_diff_data_size(org_file_path, encoded_file_path, num_hash=10, num_bits=1000):
     df = pd.read_csv(org_file_path)
     df['address_1_num'] = df['address_1'] + df['street_number'].astype(str)
@@ -63,6 +77,8 @@ def generate_all_record_pairs(data_path_A, data_path_B, all_record_pairs_path):
     :param all_record_pairs_path:
     :return:
     """
+    import recordlinkage as rl
+    from recordlinkage.index import Full
     df1 = pd.read_csv(data_path_A, index_col="index")
     df2 = pd.read_csv(data_path_B, index_col="index")
     indexer = rl.Index()
@@ -74,6 +90,17 @@ def generate_all_record_pairs(data_path_A, data_path_B, all_record_pairs_path):
     df.to_csv(all_record_pairs_path, index=False, compression='zip')
 
 
+def identify_links_without_blocking(encoded_identifiers_file_path_A, encoded_identifiers_file_path_B,
+                                    matched_links_file_path, threshold=0.8):
+    """
+    No-blocking baseline with the tiled all-pairs engine, instead of generate_all_record_pairs and Classifier2.
+    Only the matched links are written.
+    """
+    classifier2 = participant.Classifier2(encoded_identifiers_file_path_A, encoded_identifiers_file_path_B,
+                                          None, None, matched_links_file_path, threshold=threshold)
+    return classifier2.identify_all_pairs()
+
+
 def find_candidate_links_for_change_k(anonymized_path_A, anonymized_path_B, candidate_links_dir_path, hierarchies_dir_path):
     qs_list = ['sex', 'age', 'race', 'marital-status', 'education', 'native-country', 'workclass', 'occupation']
     classifier1 = participant.Classifier1(anonymized_path_A, anonymized_path_B, candidate_links_dir_path, hierarchies_dir_path, qs_list)
@@ -125,6 +152,11 @@ if __name__ == '__main__':
     #                             k, f'test_dataset/change_k/k_{k}/k_{k}_anonymized_dataset_A_no_sa_ident.csv')
     #     generate_dataset_diff_k(quasi_identifiers, sensitive_attributes, identifier, original_data_path_B, hierarchy_file_dir_path,
     #                             k, f'test_dataset/change_k/k_{k}/k_{k}_anonymized_dataset_B_no_sa_ident.csv')
+    # # or all k values in one run:
+    # generate_dataset_multi_k(quasi_identifiers, sensitive_attributes, identifier, original_data_path_A, hierarchy_file_dir_path,
+    #                          range(5, 21, 5), 'test_dataset/change_k/k_{k}/k_{k}_anonymized_dataset_A_no_sa_ident.csv')
+    # generate_dataset_multi_k(quasi_identifiers, sensitive_attributes, identifier, original_data_path_B, hierarchy_file_dir_path,
+    #                          range(5, 21, 5), 'test_dataset/change_k/k_{k}/k_{k}_anonymized_dataset_B_no_sa_ident.csv')
 
 
     # # 3. Find candidate links for change_k
@@ -154,6 +186,10 @@ if __name__ == '__main__':
 
     # # generate_all_record_pairs('test_dataset/change_k/dataset_A.csv', 'test_dataset/change_k/dataset_B.csv',
     # #                           'test_dataset/change_k/no_anonymization/candidate_links.zip')
+    # # or without the n x n candidate links file:
+    # identify_links_without_blocking(f'test_dataset/encoded_data/data_size_{datasize}/encoded_identifiers_A.zip',
+    #                                 f'test_dataset/encoded_data/data_size_{datasize}/encoded_identifiers_B.zip',
+    #                                 f'test_dataset/change_data_size/data_size_{datasize}/no_anonymization/matched_links.csv')
 
 
     datasize = 4500
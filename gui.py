@@ -1,21 +1,282 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 import pandas as pd
 from run import participant
+from run.artifact_cache import META_FILE_NAME, ArtifactCache
+
+# Results of the pipeline steps are cached on disk, keyed by a content hash of the step inputs
+# (uploaded dataset, k, results of the previous steps). Streamlit reruns this script on every interaction,
+# so without the cache e.g. changing the threshold would anonymize and block the datasets again.
+# The step directories have the layout of run.artifact_cache ({step}/{key}/meta.json), so the least recently used
+# steps and uploads are evicted by ArtifactCache.evict when the cache is larger than GUI_CACHE_MAX_BYTES.
+GUI_CACHE_DIR = 'dataset/gui_cache/'
+GUI_CACHE_MAX_BYTES = 2 * 1024 ** 3
+PREVIEW_PAGE_SIZE = 100
+# granularity of the progress bars of the encode and compare steps
+ENCODE_BATCH_SIZE = 500
+COMPARE_CHUNK_SIZE = 20000
 
 
 def init_session_state():
-    if 'anonymized_df_A' not in st.session_state:
-        st.session_state['anonymized_df_A'] = None
-    if 'anonymized_df_B' not in st.session_state:
-        st.session_state['anonymized_df_B'] = None
-    if 'encoded_df_A' not in st.session_state:
-        st.session_state['encoded_df_A'] = None
-    if 'encoded_df_B' not in st.session_state:
-        st.session_state['encoded_df_B'] = None
-    if 'candidate_links_df' not in st.session_state:
-        st.session_state['candidate_links_df'] = None
-    if 'identified_links_df' not in st.session_state:
-        st.session_state['identified_links_df'] = None
+    if 'jobs' not in st.session_state:
+        st.session_state['jobs'] = {}  # keys are step names, values are background jobs
+    if 'results' not in st.session_state:
+        st.session_state['results'] = {}  # keys are step names, values are results of the finished steps
+
+
+def content_hash(*parts):
+    """
+    sha256 of the given parts. Each part is bytes or json serializable.
+    :return: hex digest
+    """
+    sha = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = json.dumps(part, sort_keys=True).encode('utf-8')
+        sha.update(part)
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def commit_cache_entry(entry_dir, step_name):
+    """
+    write the meta file of a finished step directory, which makes it an entry of the cache, and evict the least
+    recently used entries. A directory without meta file (a running step) is never evicted.
+    """
+    with open(f'{entry_dir}{META_FILE_NAME}.tmp', 'w', encoding='utf-8') as meta_file:
+        json.dump({'step': step_name, 'files': sorted(os.listdir(entry_dir)), 'size': directory_size(entry_dir),
+                   'created': time.time()}, meta_file)
+    os.replace(f'{entry_dir}{META_FILE_NAME}.tmp', f'{entry_dir}{META_FILE_NAME}')
+    ArtifactCache(GUI_CACHE_DIR, GUI_CACHE_MAX_BYTES).evict()
+
+
+def touch_cache_entry(entry_dir):
+    # the modification time of the meta file is the last use of the entry, for the eviction
+    try:
+        os.utime(f'{entry_dir}{META_FILE_NAME}')
+    except FileNotFoundError:
+        pass
+
+
+def cached_step(step_name, key, func):
+    """
+    Run a pipeline step once per key. The result (a dict of artifact paths) is saved in the step directory,
+    so the step is skipped when it runs again with the same inputs, also after the GUI restarts.
+    :param step_name: name of the step, e.g. 'anonymize_A'
+    :param key: content hash of the step inputs
+    :param func: func(step_dir) runs the step, writes its artifacts into step_dir and returns the result dict
+    :return: result dict
+    """
+    step_dir = f'{GUI_CACHE_DIR}{step_name}/{key[:16]}/'
+    result_path = f'{step_dir}result.json'
+    if os.path.isfile(result_path):
+        touch_cache_entry(step_dir)
+        with open(result_path, 'r', encoding='utf-8') as result_file:
+            return json.load(result_file)
+    os.makedirs(step_dir, exist_ok=True)
+    result = func(step_dir)
+    result['key'] = key
+    result['step_dir'] = step_dir
+    with open(f'{result_path}.tmp', 'w', encoding='utf-8') as result_file:
+        json.dump(result, result_file)
+    os.replace(f'{result_path}.tmp', result_path)
+    commit_cache_entry(step_dir, step_name)
+    return result
+
+
+def save_uploaded_dataset(uploaded_file):
+    """
+    save the uploaded dataset under its content hash, so the same upload is never saved or processed twice
+    :return: (data_path, data_hash)
+    """
+    data = uploaded_file.getvalue()
+    data_hash = content_hash(data)
+    upload_dir = f'{GUI_CACHE_DIR}upload/{data_hash[:16]}/'
+    data_path = f'{upload_dir}dataset.csv'
+    if os.path.isfile(data_path):
+        touch_cache_entry(upload_dir)
+    else:
+        # saved again if it has been evicted
+        os.makedirs(upload_dir, exist_ok=True)
+        with open(f'{data_path}.tmp', 'wb') as data_file:
+            data_file.write(data)
+        os.replace(f'{data_path}.tmp', data_path)
+        commit_cache_entry(upload_dir, 'upload')
+    return data_path, data_hash
+
+
+# Pipeline steps. They run in a background worker, so they must not call streamlit.
+# progress is a dict with 'fraction' and 'message', which is shown by the GUI while the step runs.
+# The participants report the fraction through their progress callbacks, see report_fraction.
+
+def report_fraction(progress):
+    """
+    :return: progress callback of the participant methods, progress(fraction)
+    """
+    def report(fraction):
+        progress['fraction'] = min(max(fraction, 0.0), 1.0)
+    return report
+
+
+def anonymize_step(progress, holder_name, data_path, data_hash, k, config):
+    key = content_hash('anonymize', holder_name, data_hash, k, config['quasi_identifiers'],
+                       config['sensitive_attributes'], config['identifier'])
+
+    def run(step_dir):
+        progress['message'] = f'Anonymizing dataset_{holder_name} with k={k}'
+        data_holder = participant.DataHolder(holder_name, data_path, step_dir, config['hierarchy_file_dir_path'],
+                                             config['quasi_identifiers'], config['sensitive_attributes'],
+                                             config['identifier'], k=k)
+        return {'anonymized_path': data_holder.send_anonymized_data(progress=report_fraction(progress))}
+
+    return cached_step(f'anonymize_{holder_name}', key, run)
+
+
+def block_step(progress, anonymized_result_A, anonymized_result_B, config):
+    key = content_hash('block', anonymized_result_A['key'], anonymized_result_B['key'])
+
+    def run(step_dir):
+        progress['message'] = 'Classifier 1 is matching the anonymized datasets'
+        # Classifier1 writes the candidate records of each data holder next to its anonymized dataset
+        anonymized_paths = []
+        for holder_name, result in [('A', anonymized_result_A), ('B', anonymized_result_B)]:
+            os.makedirs(f'{step_dir}{holder_name}/', exist_ok=True)
+            anonymized_path = f'{step_dir}{holder_name}/{os.path.basename(result["anonymized_path"])}'
+            shutil.copyfile(result['anonymized_path'], anonymized_path)
+            anonymized_paths.append(anonymized_path)
+        classifier1 = participant.Classifier1(anonymized_paths[0], anonymized_paths[1], step_dir,
+                                              config['hierarchy_file_dir_path'], config['quasi_identifiers'])
+        (candidate_links_path,
+         candidate_record_set_path_A,
+         candidate_record_set_path_B) = classifier1.send_candidate_links(progress=report_fraction(progress))
+        return {'candidate_links_path': candidate_links_path,
+                'candidate_record_set_path_A': candidate_record_set_path_A,
+                'candidate_record_set_path_B': candidate_record_set_path_B}
+
+    return cached_step('block', key, run)
+
+
+def encode_step(progress, holder_name, data_path, data_hash, k, block_result, config):
+    key = content_hash('encode', holder_name, data_hash, block_result['key'])
+
+    def run(step_dir):
+        progress['message'] = f'Encrypting and encoding identifiers of dataset_{holder_name}'
+        # the data holder reads the candidate records sent by classifier 1 from its own directory
+        shutil.copyfile(block_result[f'candidate_record_set_path_{holder_name}'],
+                        f'{step_dir}candidate_records_index_{holder_name}.csv')
+        data_holder = participant.DataHolder(holder_name, data_path, step_dir, config['hierarchy_file_dir_path'],
+                                             config['quasi_identifiers'], config['sensitive_attributes'],
+                                             config['identifier'], k=k)
+        # small batches, so the progress bar moves while the identifiers are encoded
+        encoded_path = data_holder.send_encode_identifiers_in_bloom_filter(progress=report_fraction(progress),
+                                                                           batch_size=ENCODE_BATCH_SIZE)
+        return {'encoded_path': encoded_path}
+
+    return cached_step(f'encode_{holder_name}', key, run)
+
+
+def compare_step(progress, encoded_result_A, encoded_result_B, block_result):
+    # comparing doesn't depend on the threshold, so changing the threshold never compares again
+    key = content_hash('compare', encoded_result_A['key'], encoded_result_B['key'], block_result['key'])
+
+    def run(step_dir):
+        progress['message'] = 'Classifier 2 is comparing the bloom filters of the candidate links'
+        classifier2 = participant.Classifier2(encoded_result_A['encoded_path'], encoded_result_B['encoded_path'],
+                                              block_result['candidate_links_path'], f'{step_dir}compared_links.zip',
+                                              f'{step_dir}matched_links.csv')
+        compared_path = classifier2.compare_links(chunk_size=COMPARE_CHUNK_SIZE, progress=report_fraction(progress))
+        return {'compared_path': compared_path}
+
+    return cached_step('compare', key, run)
+
+
+def identify_links(compare_result, threshold):
+    """
+    Identify the matched links for a threshold. Fast, so it runs in the GUI thread. One file per threshold.
+    :return: path of the matched links
+    """
+    matched_links_file_path = f'{compare_result["step_dir"]}matched_links_threshold_{threshold}.csv'
+    if not os.path.isfile(matched_links_file_path):
+        classifier2 = participant.Classifier2(None, None, None, compare_result['compared_path'],
+                                              matched_links_file_path, threshold=threshold)
+        classifier2.identify_record_linkage()
+    return matched_links_file_path
+
+
+@st.cache_resource
+def get_executor():
+    # shared by all sessions. Two workers, so both data holders can run their steps at the same time.
+    return ThreadPoolExecutor(max_workers=2)
+
+
+def submit_job(step_name, func, *args):
+    progress = {'fraction': 0.0, 'message': 'Waiting for a worker'}
+
+    def run():
+        result = func(progress, *args)
+        progress['fraction'] = 1.0
+        return result
+
+    st.session_state['jobs'][step_name] = {'future': get_executor().submit(run), 'progress': progress}
+
+
+def collect_jobs():
+    """
+    Move the results of finished background jobs into the session state
+    """
+    for step_name, job in list(st.session_state['jobs'].items()):
+        future = job['future']
+        if not future.done():
+            continue
+        del st.session_state['jobs'][step_name]
+        if future.exception() is not None:
+            st.error(f'{step_name} failed: {future.exception()}')
+        else:
+            st.session_state['results'][step_name] = future.result()
+
+
+def show_job_progress():
+    for step_name, job in st.session_state['jobs'].items():
+        st.progress(job['progress']['fraction'], text=job['progress']['message'])
+
+
+def get_result(step_name):
+    """
+    :return: result of a finished step, None if the step has not run or its directory has been evicted
+    """
+    result = st.session_state['results'].get(step_name)
+    if result is not None and not os.path.isdir(result['step_dir']):
+        del st.session_state['results'][step_name]
+        return None
+    return result
+
+
+@st.cache_data
+def read_preview(path, page, page_size, signature):
+    """
+    Read one page of a csv file (also zipped csv) or of a link store without loading the whole file.
+    :param signature: size and modification time of the file, so a changed file is read again
+    """
+    if os.path.isdir(path):
+        from record_linkage.link_store import LinkStore
+        return LinkStore(path).read_links(page * page_size, (page + 1) * page_size)
+    return pd.read_csv(path, skiprows=range(1, 1 + page * page_size), nrows=page_size)
+
+
+def show_preview(title, path, preview_key, height):
+    st.write(title)
+    page = st.number_input('Page', min_value=1, value=1, step=1, key=f'page_{preview_key}')
+    stat = os.stat(os.path.join(path, 'meta.json') if os.path.isdir(path) else path)
+    st.dataframe(read_preview(path, page - 1, PREVIEW_PAGE_SIZE, (stat.st_size, stat.st_mtime_ns)), height=height)
 
 
 if __name__ == '__main__':
@@ -36,6 +297,7 @@ if __name__ == '__main__':
         """)
 
     init_session_state()
+    collect_jobs()
 
     # Sidebar for k-Anonymity selection
     k = st.sidebar.selectbox('Select k for k-Anonymity(default k=5)', options=['Select', 3, 5, 10, 15, 20])
@@ -47,136 +309,113 @@ if __name__ == '__main__':
     # change dice_coefficient to float. If dice_coefficient is not 'Select', set dice_coefficient to 0.8 as default
     threshold = float(threshold) if threshold != 'Select' else 0.8
 
-    date_file_path_A = 'dataset/dataset_A/dataset_A.csv'
-    date_file_path_B = 'dataset/dataset_B/dataset_B.csv'
-    classifier_data_dir_path = 'dataset/classifier_data/'
-    anonymized_file_dir_path_A = 'dataset/dataset_A/'
-    anonymized_file_dir_path_B = 'dataset/dataset_B/'
-    hierarchy_file_dir_path = 'dataset/hierarchy/'
-    anonymized_data_no_sa_ident_path_A = f'dataset/dataset_A/k_{k}_anonymized_dataset_A_no_sa_ident.csv'
-    anonymized_data_no_sa_ident_path_B = f'dataset/dataset_B/k_{k}_anonymized_dataset_B_no_sa_ident.csv'
-    encoded_identifiers_file_path_A = 'dataset/dataset_A/encoded_identifiers_A.zip'
-    encoded_identifiers_file_path_B = 'dataset/dataset_B/encoded_identifiers_B.zip'
-    candidate_links_path = 'dataset/classifier_data/candidate_links.zip'
-    compared_links_file_path = 'dataset/compared_links.zip'
-    matched_links_file_path = 'dataset/matched_links.csv'
-    quasi_identifiers = ['sex', 'age', 'race', 'marital-status', 'education', 'native-country', 'workclass',
-                         'occupation']
-    sensitive_attributes = ['salary-class']
-    identifier = ['given_name', 'surname', 'street_number', 'address_1', 'address_2', 'suburb', 'postcode', 'state',
-                  'soc_sec_id']
+    step_config = {
+        'hierarchy_file_dir_path': 'dataset/hierarchy/',
+        'quasi_identifiers': ['sex', 'age', 'race', 'marital-status', 'education', 'native-country', 'workclass',
+                              'occupation'],
+        'sensitive_attributes': ['salary-class'],
+        'identifier': ['given_name', 'surname', 'street_number', 'address_1', 'address_2', 'suburb', 'postcode',
+                       'state', 'soc_sec_id'],
+    }
 
     # Split the page into two columns for buttons and displaying data
     left_column, right_column = st.columns(2)
 
+    uploaded_datasets = {}
     # Use the left column for input and buttons
     with left_column:
-        # Dataholder A input
-        st.subheader('Dataholder A')
-        org_dataset_A = st.file_uploader('Upload original dataset for dataholder A', type=['csv'], key='org_dataset_A')
-        if org_dataset_A is not None:
-            data_holder_A = participant.DataHolder('A', date_file_path_A, anonymized_file_dir_path_A,
-                                                   hierarchy_file_dir_path,
-                                                   quasi_identifiers, sensitive_attributes, identifier, k=k)
-            st.write('Original dataset_A uploaded successfully')
-        # Anonymize data button
-        if st.button('Anonymize data', key='anonymized_dataset_A'):
-            anonymized_data_no_sa_ident_path_A = data_holder_A.send_anonymized_data()
-            st.session_state['anonymized_df_A'] = pd.read_csv(anonymized_data_no_sa_ident_path_A)
-            st.write('Original dataset_A anonymized successfully')
-        # Encrypt and encode identifiers button
-        if st.button('Encrypt and encode identifiers', key='encrypt_dataset_A'):
-            encoded_identifiers_file_path_A = data_holder_A.send_encode_identifiers_in_bloom_filter()
-            st.session_state['encoded_df_A'] = pd.read_csv(encoded_identifiers_file_path_A)
-            st.write('Identifiers of dataset_A encrypted and encoded successfully')
-
-        # Dataholder B input
-        st.subheader('Dataholder B')
-        org_dataset_B = st.file_uploader('Upload original dataset for dataholder B', type=['csv'], key='org_dataset_B')
-        if org_dataset_B is not None:
-            data_holder_B = participant.DataHolder('B', date_file_path_B, anonymized_file_dir_path_B,
-                                                   hierarchy_file_dir_path,
-                                                   quasi_identifiers, sensitive_attributes, identifier, k=k)
-            st.write('Original dataset_B uploaded successfully')
-        # Anonymize data button
-        if st.button('Anonymize data', key='anonymized_dataset_B'):
-            anonymized_data_no_sa_ident_path_B = data_holder_B.send_anonymized_data()
-            st.session_state['anonymized_df_B'] = pd.read_csv(anonymized_data_no_sa_ident_path_B)
-            st.write('Original dataset_B anonymized successfully')
-        # Encrypt and encode identifiers button
-        if st.button('Encrypt and encode identifiers', key='encrypt_dataset_B'):
-            encoded_identifiers_file_path_B = data_holder_B.send_encode_identifiers_in_bloom_filter()
-            st.session_state['encoded_df_B'] = pd.read_csv(encoded_identifiers_file_path_B)
-            st.write('Identifiers of dataset_B encrypted and encoded successfully')
+        for holder_name in ['A', 'B']:
+            st.subheader(f'Dataholder {holder_name}')
+            org_dataset = st.file_uploader(f'Upload original dataset for dataholder {holder_name}', type=['csv'],
+                                           key=f'org_dataset_{holder_name}')
+            if org_dataset is not None:
+                uploaded_datasets[holder_name] = save_uploaded_dataset(org_dataset)
+                st.write(f'Original dataset_{holder_name} uploaded successfully')
+            # Anonymize data button
+            if st.button('Anonymize data', key=f'anonymized_dataset_{holder_name}'):
+                if holder_name not in uploaded_datasets:
+                    st.warning(f'Upload original dataset for dataholder {holder_name} first')
+                else:
+                    data_path, data_hash = uploaded_datasets[holder_name]
+                    submit_job(f'anonymize_{holder_name}', anonymize_step, holder_name, data_path, data_hash, k,
+                               step_config)
+            # Encrypt and encode identifiers button
+            if st.button('Encrypt and encode identifiers', key=f'encrypt_dataset_{holder_name}'):
+                if holder_name not in uploaded_datasets or get_result('block') is None:
+                    st.warning('Upload the original dataset and match anonymized data by Classifier 1 first')
+                else:
+                    data_path, data_hash = uploaded_datasets[holder_name]
+                    submit_job(f'encode_{holder_name}', encode_step, holder_name, data_path, data_hash, k,
+                               get_result('block'), step_config)
+            if get_result(f'anonymize_{holder_name}') is not None:
+                st.write(f'Original dataset_{holder_name} anonymized successfully')
+            if get_result(f'encode_{holder_name}') is not None:
+                st.write(f'Identifiers of dataset_{holder_name} encrypted and encoded successfully')
 
         # Classifier 1
         st.subheader('Classifier 1')
         if st.button('Match anonymized data'):
-            classifier1 = participant.Classifier1(anonymized_data_no_sa_ident_path_A,
-                                                  anonymized_data_no_sa_ident_path_B, classifier_data_dir_path,
-                                                  hierarchy_file_dir_path, quasi_identifiers)
-            candidate_links_path, candidate_record_set_path_A, candidate_record_set_path_B = classifier1.send_candidate_links()
-            st.session_state['candidate_links_df'] = pd.read_csv(candidate_links_path)
+            if get_result('anonymize_A') is None or get_result('anonymize_B') is None:
+                st.warning('Anonymize both datasets first')
+            else:
+                submit_job('block', block_step, get_result('anonymize_A'), get_result('anonymize_B'), step_config)
+        if get_result('block') is not None:
             st.write('2 anonymized datasets matched by Classifier 1')
 
         # Classifier 2
         st.subheader('Classifier 2')
         if st.button('Identify record linkages'):
-            classifier2 = participant.Classifier2(encoded_identifiers_file_path_A, encoded_identifiers_file_path_B,
-                                                  candidate_links_path, compared_links_file_path,
-                                                  matched_links_file_path, threshold=threshold)
-            classifier2.compare_links()
-            matched_links_file_path = classifier2.identify_record_linkage()
-            st.session_state['identified_links_df'] = pd.read_csv(matched_links_file_path)
+            if get_result('encode_A') is None or get_result('encode_B') is None:
+                st.warning('Encrypt and encode the identifiers of both datasets first')
+            else:
+                submit_job('compare', compare_step, get_result('encode_A'), get_result('encode_B'),
+                           get_result('block'))
+        matched_links_file_path = None
+        if get_result('compare') is not None:
+            # only this cheap step depends on the threshold
+            matched_links_file_path = identify_links(get_result('compare'), threshold)
             st.write('Record linkages identified by Classifier 2')
 
+        show_job_progress()
+
     # Use the right column to display CSV data
     with right_column:
         st.subheader('Data Preview')
         dataframe_height = 200
         # Display original CSV file content if uploaded
-        if org_dataset_A is not None:
-            st.write('Original dataset_A Preview:')
-            df_a = pd.read_csv(org_dataset_A)
-            st.dataframe(df_a, height=dataframe_height)
-        if org_dataset_B is not None:
-            st.write('Original dataset_B Preview:')
-            df_b = pd.read_csv(org_dataset_B)
-            st.dataframe(df_b, height=dataframe_height)
+        for holder_name, (data_path, _) in uploaded_datasets.items():
+            show_preview(f'Original dataset_{holder_name} Preview:', data_path, f'org_{holder_name}',
+                         dataframe_height)
         # Display the anonymized data if available
-        if st.session_state['anonymized_df_A'] is not None:
-            st.write('Anonymized dataset_A Preview:')
-            df_anonymized_A = pd.read_csv(anonymized_data_no_sa_ident_path_A)
-            st.dataframe(df_anonymized_A, height=dataframe_height)
-        if st.session_state['anonymized_df_B'] is not None:
-            st.write('Anonymized dataset_B Preview:')
-            df_anonymized_B = pd.read_csv(anonymized_data_no_sa_ident_path_B)
-            st.dataframe(df_anonymized_B, height=dataframe_height)
+        for holder_name in ['A', 'B']:
+            if get_result(f'anonymize_{holder_name}') is not None:
+                show_preview(f'Anonymized dataset_{holder_name} Preview:',
+                             get_result(f'anonymize_{holder_name}')['anonymized_path'],
+                             f'anonymized_{holder_name}', dataframe_height)
         # Display the candidate links if available
-        if st.session_state['candidate_links_df'] is not None:
-            st.write('Candidate Links Preview:')
-            df_candidate_links = pd.read_csv(candidate_links_path)
-            st.dataframe(df_candidate_links, height=dataframe_height)
+        if get_result('block') is not None:
+            show_preview('Candidate Links Preview:', get_result('block')['candidate_links_path'],
+                         'candidate_links', dataframe_height)
         # Display the encrypted and encoded data if available
-        if st.session_state['encoded_df_A'] is not None:
-            st.write('Encrypted and Encoded dataset_A Preview:')
-            df_encoded_A = pd.read_csv(encoded_identifiers_file_path_A)
-            st.dataframe(df_encoded_A, height=dataframe_height)
-        if st.session_state['encoded_df_B'] is not None:
-            st.write('Encrypted and Encoded dataset_B Preview:')
-            df_encoded_B = pd.read_csv(encoded_identifiers_file_path_B)
-            st.dataframe(df_encoded_B, height=dataframe_height)
+        for holder_name in ['A', 'B']:
+            if get_result(f'encode_{holder_name}') is not None:
+                show_preview(f'Encrypted and Encoded dataset_{holder_name} Preview:',
+                             get_result(f'encode_{holder_name}')['encoded_path'],
+                             f'encoded_{holder_name}', dataframe_height)
         # Display the matched links if available
-        if st.session_state['identified_links_df'] is not None:
-            st.write('Identified Links Preview:')
-            df_identified_links = pd.read_csv(matched_links_file_path)
-            st.dataframe(df_identified_links, height=dataframe_height)
-        # Download record linkage button
-        if st.session_state['identified_links_df'] is not None:
-            st.download_button(
-                label="Download Record Linkage",
-                data=st.session_state['identified_links_df'].to_csv().encode('utf-8'),
-                file_name='matched_links.csv',
-                mime='text/csv',
-                key='download_matched_links'
-            )
+        if matched_links_file_path is not None:
+            show_preview('Identified Links Preview:', matched_links_file_path, 'identified_links', dataframe_height)
+            # Download record linkage button
+            with open(matched_links_file_path, 'rb') as matched_links_file:
+                st.download_button(
+                    label="Download Record Linkage",
+                    data=matched_links_file.read(),
+                    file_name='matched_links.csv',
+                    mime='text/csv',
+                    key='download_matched_links'
+                )
+
+    # poll the background jobs until they are finished
+    if st.session_state['jobs']:
+        time.sleep(0.5)
+        st.rerun()
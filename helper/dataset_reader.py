@@ -0,0 +1,73 @@
+import importlib.util
+import numpy as np
+import pandas as pd
+
+# Typed, low-memory reading of the data holder datasets.
+# With default dtypes every text cell of a dataset is its own Python string object. The readers here
+#   - read only the columns a step needs (usecols),
+#   - read the quasi-identifiers as categoricals: one small integer code per cell and each distinct value once,
+#   - read the text identifiers as Arrow strings (one contiguous buffer per column) if pyarrow is installed,
+#   - use the multithreaded pyarrow csv parser if pyarrow is installed.
+# Numeric columns keep their inferred dtypes, so e.g. postcode is parsed as before and the encoded identifiers and
+# anonymized datasets do not change.
+
+# text columns of the original datasets, by kind
+QUASI_IDENTIFIER_COLUMNS = ['sex', 'age', 'race', 'marital-status', 'education', 'native-country', 'workclass',
+                            'occupation']
+TEXT_IDENTIFIER_COLUMNS = ['given_name', 'surname', 'address_1', 'address_2', 'suburb', 'state']
+
+
+def has_pyarrow():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def string_dtype():
+    """
+    Arrow strings if pyarrow is installed, otherwise Python strings
+    """
+    return 'string[pyarrow]' if has_pyarrow() else object
+
+
+def read_csv_columns(file_path, columns=None, categorical_columns=(), string_columns=(), index_col=None):
+    """
+    read selected columns of a csv with compact dtypes
+    :param file_path: csv file
+    :param columns: the columns to be read, default all columns
+    :param categorical_columns: columns read as categoricals
+    :param string_columns: columns read as Arrow strings (Python strings without pyarrow)
+    :param index_col: column used as index
+    :return: DataFrame with the columns in the order of the file
+    """
+    if columns is not None:
+        columns = list(columns)
+        wanted = set(columns) | ({index_col} if index_col is not None else set())
+        usecols = [column for column in pd.read_csv(file_path, nrows=0).columns if column in wanted]
+    else:
+        usecols = None
+    selected = set(usecols) if usecols is not None else None
+    dtype = {column: 'category' for column in categorical_columns if selected is None or column in selected}
+    dtype.update({column: string_dtype() for column in string_columns if selected is None or column in selected})
+    kwargs = {'usecols': usecols, 'dtype': dtype or None}
+    if has_pyarrow():
+        kwargs['engine'] = 'pyarrow'
+    df = pd.read_csv(file_path, **kwargs)
+    if has_pyarrow():
+        # the pyarrow parser reads a missing value of an object column (e.g. postcode) as None, the C parser as nan.
+        # With None astype(str) gives 'None' instead of 'nan' and the encoded identifiers would change
+        object_columns = df.select_dtypes(object).columns
+        df[object_columns] = df[object_columns].fillna(np.nan)
+    if index_col is not None:
+        df = df.set_index(index_col)
+    return df
+
+
+def read_holder_dataset(file_path, columns=None, categorical_quasi_identifiers=True, index_col=None):
+    """
+    read a (original or anonymized) dataset of a data holder with the quasi-identifiers as categoricals
+    and the text identifiers as Arrow strings
+    :param columns: the columns to be read, default all columns
+    :param categorical_quasi_identifiers: False to read the quasi-identifiers with the default dtypes,
+                                          e.g. for the serial Mondrian that computes on them
+    """
+    categorical_columns = QUASI_IDENTIFIER_COLUMNS if categorical_quasi_identifiers else ()
+    return read_csv_columns(file_path, columns, categorical_columns, TEXT_IDENTIFIER_COLUMNS, index_col)
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+# columns of the class table published by a data holder, and of the per-record class id in its anonymized data
+CLASS_ID_COLUMN = 'class_id'
+COUNT_COLUMN = 'count'
+
+
+class EquivalenceClasses:
+    """
+    Equivalence classes of an anonymized dataset: records with the same values at all quasi-identifiers.
+    Computed in one vectorized pass instead of iterating df.groupby(qi_list) in python.
+    """
+
+    def __init__(self, class_ids, qi_list):
+        self.qi_list = qi_list
+        self.class_ids = class_ids  # class id of each record (position in df). ids in order of first appearance
+        self.class_sizes = np.bincount(class_ids) if len(class_ids) > 0 else np.zeros(0, dtype=np.int64)
+        # position of the first record of each class. Since the ids are in order of first appearance, it is sorted.
+        self.first_positions = np.unique(class_ids, return_index=True)[1]
+        self.num_classes = len(self.class_sizes)
+
+    def is_k_anonymous(self, k):
+        return self.num_classes == 0 or int(self.class_sizes.min()) >= k
+
+    def discernibility(self):
+        """
+        discernibility metric: each record is penalized by the size of its class, i.e. sum of squared class sizes
+        """
+        return int(np.sum(self.class_sizes.astype(np.int64) ** 2))
+
+    def summary(self):
+        if self.num_classes == 0:
+            return {'num_classes': 0, 'min_class_size': 0, 'mean_class_size': 0.0, 'max_class_size': 0,
+                    'discernibility': 0}
+        return {'num_classes': self.num_classes,
+                'min_class_size': int(self.class_sizes.min()),
+                'mean_class_size': float(self.class_sizes.mean()),
+                'max_class_size': int(self.class_sizes.max()),
+                'discernibility': self.discernibility()}
+
+    def member_positions(self):
+        """
+        positions of the records of each class
+        :return: list of int numpy arrays, one per class id
+        """
+        order = np.argsort(self.class_ids, kind='stable')
+        return np.split(order, np.cumsum(self.class_sizes)[:-1])
+
+    def class_table(self, df):
+        """
+        compact class table: class id, generalized quasi-identifier tuple and number of members of each class.
+        n/k rows instead of n.
+        :param df: the anonymized data frame the classes were computed on
+        :return: DataFrame
+        """
+        table = df[self.qi_list].iloc[self.first_positions].reset_index(drop=True)
+        table.insert(0, CLASS_ID_COLUMN, np.arange(self.num_classes))
+        table[COUNT_COLUMN] = self.class_sizes
+        return table
+
+
+def compute_equivalence_classes(df, qi_list):
+    """
+    factorize each quasi-identifier into integer codes and combine the codes into one class id per record
+    :param df: the anonymized data frame
+    :param qi_list: the quasi-identifiers to be used
+    :return: EquivalenceClasses
+    """
+    class_ids = np.zeros(len(df), dtype=np.int64)
+    for qi in qi_list:
+        codes, uniques = pd.factorize(df[qi], use_na_sentinel=False)
+        # mixed radix combination. factorize again after each column, so the ids never overflow
+        class_ids, _ = pd.factorize(class_ids * len(uniques) + codes)
+    return EquivalenceClasses(class_ids.astype(np.int64), qi_list)
+
+
+def classes_from_class_ids(class_ids, qi_list):
+    """
+    EquivalenceClasses from a published per-record class id column, without grouping the records again
+    :param class_ids: class id of each record, ids are 0, 1, ..., number of classes - 1
+    """
+    return EquivalenceClasses(np.asarray(class_ids, dtype=np.int64), qi_list)
+
+
+def load_class_table(class_table_path, qi_list):
+    """
+    read a published class table
+    :return: DataFrame indexed by class id, with the generalized quasi-identifiers (as text) and the member count
+    """
+    table = pd.read_csv(class_table_path, dtype={qi: str for qi in qi_list})
+    return table.set_index(CLASS_ID_COLUMN).sort_index()
@@ -1,5 +1,6 @@
 import glob
 import os
+import numpy as np
 import pandas as pd
 
 
@@ -29,6 +30,7 @@ class HierarchyTree:
         self.root = self.node_dict['*']
         self.leaf_id_dict = self.build_leaf_id_dict()  # keys are leaf_id, values are HierarchyTreeNode(leaves only)
         self.save_covered_subtree_nodes()
+        self.compatibility = None  # (node ids, compatibility matrix), built on first use
 
     def find_node(self, value):
         """
@@ -70,6 +72,22 @@ class HierarchyTree:
         else:
             return False
 
+    def get_compatibility_matrix(self):
+        """
+        boolean matrix over node ids. True if the two nodes are equal or one of them covers the other,
+        i.e. check_node_covered in both directions for all pairs of nodes at once
+        :return: (dict. keys are values of nodes, values are node ids; numpy bool matrix)
+        """
+        if self.compatibility is None:
+            node_ids = {value: i for i, value in enumerate(self.node_dict)}
+            matrix = np.eye(len(node_ids), dtype=bool)
+            for value, node in self.node_dict.items():
+                covered_ids = [node_ids[covered_node.value] for covered_node in node.covered_subtree_nodes]
+                matrix[node_ids[value], covered_ids] = True
+                matrix[covered_ids, node_ids[value]] = True
+            self.compatibility = (node_ids, matrix)
+        return self.compatibility
+
     def find_common_ancestor(self, leaf1_id, leaf2_id):
         """
         find the common ancestor of leaf1 and leaf2, which can help to find the generalization level
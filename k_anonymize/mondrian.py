@@ -1,8 +1,11 @@
 # Multi-Dimensional Mondrian for k-anonymity
 import glob
 import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import k_anonymize.hierarchy_tree as h_tree
+from k_anonymize.equivalence_class import compute_equivalence_classes
+from helper.dataset_reader import read_holder_dataset
 
 
 def summarized(partition, dim, qi_list):
@@ -61,6 +64,46 @@ def mondrian(partition, qi_list, k):
     return anonymize(partition, ranks, k, qi_list)
 
 
+def mondrian_parallel(partition, qi_list, k, n_jobs, tasks_per_job=4):
+    """
+    mondrian() with the independent subtrees of the recursion in n_jobs worker processes.
+    The top of the recursion tree is split in the main process exactly like anonymize() does, until there are
+    about n_jobs * tasks_per_job subtrees. Each subtree is anonymized by anonymize() in a worker, and the results
+    are concatenated in the order of the recursion, so the output is the same as the output of mondrian().
+    :return: the anonymized data frame
+    """
+    ranks = {}
+    for qi in qi_list:
+        ranks[qi] = len(partition[qi].unique())
+    ranks = [(key, value) for key, value in sorted(ranks.items(), key=lambda item: item[1], reverse=True)]
+    dim = ranks[0][0]
+    # parts in the order of the recursion. (True, partition): subtree still to be anonymized, (False, df): summarized
+    parts = [(True, partition)]
+    while sum(todo for todo, _ in parts) < n_jobs * tasks_per_job:
+        expanded = []
+        for todo, part in parts:
+            if not todo:
+                expanded.append((todo, part))
+                continue
+            # same split as anonymize()
+            part = part.sort_values(by=dim)
+            mid = part[dim].count() // 2
+            left_partition = part[:mid]
+            right_partition = part[mid:]
+            if len(left_partition) >= k and len(right_partition) >= k:
+                expanded.extend([(True, left_partition), (True, right_partition)])
+            else:
+                expanded.append((False, summarized(part, dim, qi_list)))
+        if len(expanded) == len(parts):
+            break  # no subtree can be split any more
+        parts = expanded
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [executor.submit(anonymize, part, ranks, k, qi_list) if todo else None for todo, part in parts]
+        results = [future.result() if future is not None else part
+                   for future, (_, part) in zip(futures, parts)]
+    return pd.concat(results)
+
+
 def map_text_to_num(df, qi_list, hierarchy_tree_dict):
     """
     the data frame with text values mapped to leaf_id(number). It would help to anonymize using mondrian algorithm
@@ -118,17 +161,18 @@ def check_k_anonymity(df, qi_list, k):
     :param k: the k value for k-anonymity
     :return: True if all partitions are k-anonymous, False otherwise
     """
-    partition_list = df.groupby(qi_list)  # pandas groupby() time: O(n*log(n))
-    check_k_anonymity_flag = True
-    for partition_key, partition in partition_list:
-        if len(partition) < k:
-            check_k_anonymity_flag = False
-    return check_k_anonymity_flag
+    # factorize the quasi-identifiers into one class id per record and count the records per class. time: O(n*m)
+    return compute_equivalence_classes(df, qi_list).is_k_anonymous(k)
 
 
-def run_anonymize(qi_list, sensitive_attributes, identifier, date_file, hierarchy_file_dir, k=5):
+def run_anonymize(qi_list, sensitive_attributes, identifier, date_file, hierarchy_file_dir, k=5, n_jobs=1,
+                  return_classes=False, parallel_min_rows=100000):
     # suppose n records(num of rows). k-anonymity. m quasi-identifiers. Calculate time complexity
-    df = pd.read_csv(date_file)
+    # if return_classes, the EquivalenceClasses of the anonymized DataFrame are returned too: (df, classes)
+    # n_jobs > 1 runs the subtrees of the recursion on n_jobs cores (see mondrian_parallel), with the same result.
+    # datasets smaller than parallel_min_rows are anonymized in the main process, the workers don't pay off
+    # map_text_to_num rewrites the quasi-identifiers in place, so they are read with the default dtypes
+    df = read_holder_dataset(date_file, categorical_quasi_identifiers=False)
 
     hierarchy_tree_dict = h_tree.build_all_hierarchy_tree(hierarchy_file_dir)
 
@@ -139,17 +183,84 @@ def run_anonymize(qi_list, sensitive_attributes, identifier, date_file, hierarch
     # anonymize. Recursively calls itself on the two halves of the data. time: O(n*log(n))
     # summarized. time: O(n)
     # total time complexity of mondrian: O(n*m + m*log(m) + n*log(n) + n) = O(n*m + n*log(n)) = (m<<n) = O(n*log(n))
-    df = mondrian(df, qi_list, k)
-
-    if not check_k_anonymity(df, qi_list, k):  # time: O(n*log(n))
-        raise Exception("Not all partitions are k-anonymous")
+    if n_jobs > 1 and len(df) >= parallel_min_rows:
+        df = mondrian_parallel(df, qi_list, k, n_jobs)
+    else:
+        df = mondrian(df, qi_list, k)
 
     df = map_num_to_text(df, qi_list, hierarchy_tree_dict)  # time: O(n*m) = (m<<n) = O(n)
+
+    # equivalence classes and k-anonymity check in one vectorized pass. time: O(n*m)
+    classes = compute_equivalence_classes(df, qi_list)
+    if not classes.is_k_anonymous(k):
+        raise Exception("Not all partitions are k-anonymous")
     # total time complexity: O(n*log(n))
 
+    if return_classes:
+        return df, classes
     return df
 
 
+# Mondrian for many k values in one pass.
+# A partition of n records is split iff both halves have at least k records, so the recursion of a larger k is the
+# recursion of a smaller k with the subtrees cut off higher up. anonymize_multi_k walks the recursion once for all k
+# values, with exactly the sorts and splits of anonymize(), so each k gets the result of run_anonymize.
+
+def anonymize_multi_k(partition, ranks, k_list, qi_list):
+    """
+    anonymize() for many k values in one pass over the recursion. A partition is split for every k with both halves
+    of at least k records, and the halves are the same for all of them, so the recursion of a larger k stops at a
+    partition that the recursion of a smaller k splits further. Every partition is sorted once for all k values.
+    :param k_list: the k values
+    :return: dict. keys are the k values, values are the summarized partitions in the order of anonymize()
+    """
+    dim = ranks[0][0]
+
+    partition = partition.sort_values(by=dim)
+    si = partition[dim].count()
+    mid = si // 2
+    left_partition = partition[:mid]
+    right_partition = partition[mid:]
+    split_k_list = [k for k in k_list if len(left_partition) >= k and len(right_partition) >= k]
+    parts = {}
+    if len(split_k_list) < len(k_list):
+        summarized_partition = summarized(partition, dim, qi_list)
+        parts = {k: [summarized_partition] for k in k_list if k not in split_k_list}
+    if split_k_list:
+        left_parts = anonymize_multi_k(left_partition, ranks, split_k_list, qi_list)
+        right_parts = anonymize_multi_k(right_partition, ranks, split_k_list, qi_list)
+        for k in split_k_list:
+            parts[k] = left_parts[k] + right_parts[k]
+    return parts
+
+
+def run_anonymize_multi_k(qi_list, sensitive_attributes, identifier, date_file, hierarchy_file_dir, k_list):
+    """
+    anonymize one dataset for many k values, reading and mapping the data and sorting each partition only once.
+    The result for each k is the same as the result of run_anonymize for that k.
+    :param k_list: the k values, e.g. [3, 5, 7, 9]
+    :return: dict. keys are the k values, values are the anonymized DataFrames
+    """
+    df = read_holder_dataset(date_file, categorical_quasi_identifiers=False)
+    hierarchy_tree_dict = h_tree.build_all_hierarchy_tree(hierarchy_file_dir)
+    df = map_text_to_num(df, qi_list, hierarchy_tree_dict)
+
+    # same ranks as mondrian()
+    ranks = {}
+    for qi in qi_list:
+        ranks[qi] = len(df[qi].unique())
+    ranks = [(key, value) for key, value in sorted(ranks.items(), key=lambda item: item[1], reverse=True)]
+    parts = anonymize_multi_k(df, ranks, list(k_list), qi_list)
+
+    results = {}
+    for k in k_list:
+        df_k = map_num_to_text(pd.concat(parts[k]), qi_list, hierarchy_tree_dict)
+        if not check_k_anonymity(df_k, qi_list, k):
+            raise Exception(f"Not all partitions are k-anonymous for k={k}")
+        results[k] = df_k
+    return results
+
+
 if __name__ == '__main__':
     print("Test mode: Running mondrian.py")
     # k = 5
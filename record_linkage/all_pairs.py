@@ -0,0 +1,70 @@
+import time
+import numpy as np
+import pandas as pd
+from record_linkage.filter_store import compared_fields
+
+# All-pairs comparison without blocking (the no-anonymization baseline).
+# The intersection counts of all pairs of bloom filters are a matrix product of 0/1 matrices: A @ B.T.
+# The filters are unpacked tile by tile and multiplied with BLAS in float32 (exact for filters of less than
+# 2^24 bits), the Dice-coefficients follow from the precomputed number of bits set of each record.
+# Only the pairs above the threshold at every field are kept, so no n x n candidate links file is written.
+
+
+def unpack_tile(packed, num_bits, dtype):
+    """
+    packed bloom filters of a tile as a 0/1 matrix for the matrix product
+    """
+    return np.unpackbits(packed, axis=1, count=num_bits).astype(dtype)
+
+
+def all_pairs_dice(store_A, store_B, threshold=0.8, tile_size=2048, dtype=np.float32):
+    """
+    Dice-coefficients of all pairs of records of two filter stores, keeping the pairs above the threshold.
+    A pair is matched if its Dice-coefficient is above the threshold at every field, like
+    Classifier2.identify_record_linkage.
+    :param store_A: FilterStore of data holder A, encoded identifiers of all records
+    :param store_B: FilterStore of data holder B
+    :param threshold: pairs with Dice-coefficient > threshold at every field are kept
+    :param tile_size: number of records of A and of B per tile. A tile needs about tile_size^2 * 4 bytes per field
+    :param dtype: float32 (BLAS sgemm) or float64
+    :return: DataFrame of the matched pairs, indexed by (index, index), one column of Dice-coefficients per field
+    """
+    start_time = time.time()
+    fields = compared_fields(store_A, store_B)
+    keys_A = []
+    keys_B = []
+    similarities = {field: [] for field in fields}
+    for start_B in range(0, len(store_B), tile_size):
+        rows_B = np.arange(start_B, min(start_B + tile_size, len(store_B)))
+        tiles_B = {field: unpack_tile(store_B.filters[field][rows_B], store_B.num_bits[field], dtype)
+                   for field in fields}
+        for start_A in range(0, len(store_A), tile_size):
+            rows_A = np.arange(start_A, min(start_A + tile_size, len(store_A)))
+            tile_similarities = {}
+            candidates = None  # positions in the tile that are above the threshold at all fields so far
+            for field in fields:
+                tile_A = unpack_tile(store_A.filters[field][rows_A], store_A.num_bits[field], dtype)
+                intersections = tile_A @ tiles_B[field].T
+                totals = (store_A.popcounts[field][rows_A][:, None].astype(dtype) +
+                          store_B.popcounts[field][rows_B][None, :].astype(dtype))
+                dice = np.divide(2 * intersections, totals, out=np.zeros_like(intersections), where=totals > 0)
+                above = dice > threshold
+                candidates = above if candidates is None else candidates & above
+                tile_similarities[field] = dice
+                if not candidates.any():
+                    break
+            if not candidates.any():
+                continue
+            positions_A, positions_B = np.nonzero(candidates)
+            keys_A.append(store_A.keys[rows_A[positions_A]])
+            keys_B.append(store_B.keys[rows_B[positions_B]])
+            for field in fields:
+                similarities[field].append(tile_similarities[field][positions_A, positions_B].astype(np.float64))
+    if len(keys_A) == 0:
+        index = pd.MultiIndex.from_arrays([[], []], names=['index', 'index'])
+        return pd.DataFrame({field: [] for field in fields}, index=index)
+    index = pd.MultiIndex.from_arrays([np.concatenate(keys_A), np.concatenate(keys_B)], names=['index', 'index'])
+    df_matched = pd.DataFrame({field: np.concatenate(values) for field, values in similarities.items()}, index=index)
+    print(f'{len(store_A)} x {len(store_B)} pairs compared in {time.time() - start_time} seconds, '
+          f'{len(df_matched)} above threshold {threshold}')
+    return df_matched
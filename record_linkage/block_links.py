@@ -1,9 +1,27 @@
 import time
+import numpy as np
 import pandas as pd
-import recordlinkage as rl
-from recordlinkage.base import BaseIndexAlgorithm
-from recordlinkage.index import Block
 import k_anonymize.hierarchy_tree as h_tree
+from record_linkage.compatibility import CompatibilityCache
+from record_linkage.planner import plan_candidate_links
+from helper.dataset_reader import read_csv_columns
+from k_anonymize.equivalence_class import (CLASS_ID_COLUMN, compute_equivalence_classes, classes_from_class_ids,
+                                           load_class_table)
+
+# 'matrix' checks all class pairs with vectorized boolean matrices, 'pairwise' checks each class pair with the
+# memoized lookups of the compatibility cache
+BLOCKING_MODES = ('matrix', 'pairwise')
+
+
+def check_blocking_mode(blocking_mode):
+    if blocking_mode not in BLOCKING_MODES:
+        raise ValueError(f'Unknown blocking mode {blocking_mode!r}, expected one of {", ".join(BLOCKING_MODES)}')
+
+
+def print_compatibility_cache_stats(compatibility_cache, blocking_mode):
+    # only the pairwise mode looks up the class pairs in the memoized cache, the matrix mode never touches it
+    if blocking_mode == 'pairwise':
+        print(f'Compatibility cache: {compatibility_cache.hits} hits, {compatibility_cache.misses} misses')
 
 
 def find_candidate_links(partitions_A, partitions_B, hierarchy_trees, qi_list):
@@ -28,69 +46,287 @@ def find_candidate_links(partitions_A, partitions_B, hierarchy_trees, qi_list):
     # h is the height of the hierarchy tree.
     # h, q, k << n
     # O(n/k * n/k * q * h) = O(n^2/k^2)
-    candidate_links = []
-    for index_a, partition_a in partitions_A.items():
-        for index_b, partition_b in partitions_B.items():
-            link = True
-            # Use the first record of each partition for comparison because the records in same partition are the totally same.
-            row_a = partition_a.iloc[0]
-            row_b = partition_b.iloc[0]
-            for attribute in qi_list:
-                value_a = str(row_a[attribute])
-                value_b = str(row_b[attribute])
-                if not (hierarchy_trees[attribute].check_node_covered(value_a, value_b) or
-                        hierarchy_trees[attribute].check_node_covered(value_b, value_a) or
-                        value_a == value_b):
-                    link = False
-                    break
-            if link:
-                # If a link is found, add a candidate link for each record in the partitions
-                for record_a in partition_a.index:
-                    for record_b in partition_b.index:
-                        candidate_links.append((record_a, record_b))
-    return pd.MultiIndex.from_tuples(candidate_links, names=['index_a', 'index_b'])
-    # return candidate_links
-
-
-def split_data_to_partitions(df, qi_list):
+    representatives_A = [partition.iloc[0] for partition in partitions_A.values()]
+    representatives_B = [partition.iloc[0] for partition in partitions_B.values()]
+    members_A = [partition.index.to_numpy() for partition in partitions_A.values()]
+    members_B = [partition.index.to_numpy() for partition in partitions_B.values()]
+    return find_candidate_links_for_classes(representatives_A, members_A, representatives_B, members_B,
+                                            hierarchy_trees, qi_list)
+
+
+_compatibility_caches = {}  # CompatibilityCache per (hierarchy_file_dir, quasi-identifiers), reused across runs
+
+
+def get_compatibility_cache(hierarchy_file_dir, qi_list):
+    """
+    the hierarchy trees and their compatibility cache are built once per process,
+    so k-sweeps and repeated linkage runs reuse the matrices and the tuple pair results
+    """
+    cache_key = (hierarchy_file_dir, tuple(qi_list))
+    if cache_key not in _compatibility_caches:
+        hierarchy_tree_dict = h_tree.build_all_hierarchy_tree(hierarchy_file_dir)
+        _compatibility_caches[cache_key] = CompatibilityCache(hierarchy_tree_dict, qi_list)
+    return _compatibility_caches[cache_key]
+
+
+def find_candidate_links_for_classes(representatives_A, members_A, representatives_B, members_B, hierarchy_trees,
+                                     qi_list, compatibility_cache=None, blocking_mode='matrix'):
+    """
+    find_candidate_links on equivalence classes.
+    :param representatives_A: the quasi-identifier values of each class in A (dict-like, indexed by attribute)
+    :param members_A: the record indices of each class in A
+    :param representatives_B: the quasi-identifier values of each class in B
+    :param members_B: the record indices of each class in B
+    :param hierarchy_trees:
+    :param qi_list:
+    :param compatibility_cache: CompatibilityCache of hierarchy_trees, e.g. from get_compatibility_cache.
+    Built from hierarchy_trees if None.
+    :param blocking_mode: 'matrix' checks all class pairs with vectorized boolean matrices,
+    'pairwise' checks each class pair with the memoized lookups. Both find the same links in the same order.
+    :return: candidate_links
+    """
+    if compatibility_cache is None:
+        compatibility_cache = CompatibilityCache(hierarchy_trees, qi_list)
+    pairs_A, pairs_B = find_candidate_class_pairs(representatives_A, representatives_B, compatibility_cache, qi_list,
+                                                  blocking_mode)
+    # If a link is found, add a candidate link for each record in the partitions
+    return ClassPairLinks(pairs_A, pairs_B, members_A, members_B).to_multi_index()
+
+
+def find_candidate_class_pairs(representatives_A, representatives_B, compatibility_cache, qi_list,
+                               blocking_mode='matrix'):
+    """
+    the linked pairs of classes, without expanding them to record links
+    :return: (class positions in A, class positions in B), in row-major order
+    """
+    check_blocking_mode(blocking_mode)
+    # Use the first record of each partition for comparison because the records in same partition are the totally same.
+    ids_A = compatibility_cache.encode(representatives_A)
+    ids_B = compatibility_cache.encode(representatives_B)
+    if blocking_mode == 'matrix':
+        # all class pairs at once as boolean matrix products over the quasi-identifiers
+        return compatibility_cache.compatible_class_pairs(ids_A, ids_B)
+    keys_A = [tuple(str(row[attribute]) for attribute in qi_list) for row in representatives_A]
+    keys_B = [tuple(str(row[attribute]) for attribute in qi_list) for row in representatives_B]
+    pairs_A = []
+    pairs_B = []
+    for i, (key_a, class_ids_a) in enumerate(zip(keys_A, ids_A)):
+        for j, (key_b, class_ids_b) in enumerate(zip(keys_B, ids_B)):
+            # equal or covered relationship at every attribute, looked up in the compatibility matrices
+            if compatibility_cache.compatible(key_a, key_b, class_ids_a, class_ids_b):
+                pairs_A.append(i)
+                pairs_B.append(j)
+    return np.asarray(pairs_A, dtype=np.int64), np.asarray(pairs_B, dtype=np.int64)
+
+
+class ClassPairLinks:
+    """
+    Candidate links as products of the linked class pairs. Every member of class a is linked with every member
+    of class b. The links are numbered in the order of np.repeat(records_a, len(records_b)) and
+    np.tile(records_b, len(records_a)) per pair, and only expanded to record indices on demand.
+    """
+
+    def __init__(self, pairs_A, pairs_B, members_A, members_B):
+        """
+        :param pairs_A: class positions in A of the linked pairs
+        :param pairs_B: class positions in B of the linked pairs
+        :param members_A: the record indices of each class in A
+        :param members_B: the record indices of each class in B
+        """
+        self.pairs_A = pairs_A
+        self.pairs_B = pairs_B
+        self.members_A = members_A
+        self.members_B = members_B
+        self.records_A = np.concatenate(members_A) if len(members_A) > 0 else np.array([], dtype=object)
+        self.records_B = np.concatenate(members_B) if len(members_B) > 0 else np.array([], dtype=object)
+        self.sizes_A = np.array([len(records) for records in members_A], dtype=np.int64)
+        self.sizes_B = np.array([len(records) for records in members_B], dtype=np.int64)
+        self.starts_A = np.cumsum(self.sizes_A) - self.sizes_A
+        self.starts_B = np.cumsum(self.sizes_B) - self.sizes_B
+        # the exact number of links, from the class size products
+        self.links_per_pair = self.sizes_A[pairs_A] * self.sizes_B[pairs_B]
+        self.pair_ends = np.cumsum(self.links_per_pair)
+        self.num_links = int(self.pair_ends[-1]) if len(self.pair_ends) > 0 else 0
+        self.candidate_classes_A = np.unique(pairs_A)
+        self.candidate_classes_B = np.unique(pairs_B)
+        self.num_candidate_records_A = int(self.sizes_A[self.candidate_classes_A].sum())
+        self.num_candidate_records_B = int(self.sizes_B[self.candidate_classes_B].sum())
+
+    def __len__(self):
+        return self.num_links
+
+    def expand_positions(self, start=0, end=None):
+        """
+        integer record ids of the links start, ..., end - 1: positions in records_A and records_B
+        :return: (record ids in A, record ids in B)
+        """
+        end = self.num_links if end is None else min(end, self.num_links)
+        link_positions = np.arange(start, end, dtype=np.int64)
+        pair_of_link = np.searchsorted(self.pair_ends, link_positions, side='right')
+        position_in_pair = link_positions - (self.pair_ends - self.links_per_pair)[pair_of_link]
+        size_b = self.sizes_B[self.pairs_B[pair_of_link]]
+        ids_A = self.starts_A[self.pairs_A[pair_of_link]] + position_in_pair // size_b
+        ids_B = self.starts_B[self.pairs_B[pair_of_link]] + position_in_pair % size_b
+        return ids_A, ids_B
+
+    def expand(self, start=0, end=None):
+        """
+        record indices of the links start, ..., end - 1
+        :return: (record indices in A, record indices in B)
+        """
+        ids_A, ids_B = self.expand_positions(start, end)
+        return self.records_A[ids_A], self.records_B[ids_B]
+
+    def iter_position_chunks(self, chunk_size):
+        """
+        the record ids of the links in bounded batches of at most chunk_size links
+        :return: iterator of (record ids in A, record ids in B)
+        """
+        for start in range(0, self.num_links, chunk_size):
+            yield self.expand_positions(start, start + chunk_size)
+
+    def iter_chunks(self, chunk_size):
+        """
+        the links in bounded batches of at most chunk_size links
+        :return: iterator of (record indices in A, record indices in B)
+        """
+        for ids_A, ids_B in self.iter_position_chunks(chunk_size):
+            yield self.records_A[ids_A], self.records_B[ids_B]
+
+    def to_multi_index(self):
+        links_A, links_B = self.expand()
+        return pd.MultiIndex.from_arrays([links_A, links_B], names=['index_a', 'index_b'])
+
+    def candidate_records(self, side):
+        """
+        record indices of the candidate records of A or B, i.e. the members of the linked classes
+        :param side: 'A' or 'B'
+        """
+        if side == 'A':
+            members, candidate_classes = self.members_A, self.candidate_classes_A
+        else:
+            members, candidate_classes = self.members_B, self.candidate_classes_B
+        if len(candidate_classes) == 0:
+            return np.array([], dtype=object)
+        return np.concatenate([members[i] for i in candidate_classes])
+
+
+class SelfClassPairLinks(ClassPairLinks):
+    """
+    Candidate links of a dataset with itself (deduplication), only the pairs of records i < j.
+    A linked pair of different classes a < b links every member of a with every member of b, a class linked with
+    itself links each pair of its members once, in the order of np.triu_indices(size, 1). Self-pairs and mirrored
+    pairs are never generated, so there are about half as many links as when the dataset is linked with a copy.
+    """
+
+    def __init__(self, pairs, pairs_other, members):
+        """
+        :param pairs: class positions of the linked pairs, pairs <= pairs_other
+        :param pairs_other: class positions of the other class of the linked pairs
+        :param members: the record indices of each class
+        """
+        super().__init__(pairs, pairs_other, members, members)
+        same_class = pairs == pairs_other
+        sizes = self.sizes_A[pairs]
+        self.links_per_pair = np.where(same_class, sizes * (sizes - 1) // 2, self.links_per_pair)
+        self.pair_ends = np.cumsum(self.links_per_pair)
+        self.num_links = int(self.pair_ends[-1]) if len(self.pair_ends) > 0 else 0
+        # a class of one record linked only with itself has no link
+        linked = self.links_per_pair > 0
+        candidate_classes = np.unique(np.concatenate([pairs[linked], pairs_other[linked]]))
+        self.candidate_classes_A = self.candidate_classes_B = candidate_classes
+        self.num_candidate_records_A = self.num_candidate_records_B = int(self.sizes_A[candidate_classes].sum())
+
+    def expand_positions(self, start=0, end=None):
+        end = self.num_links if end is None else min(end, self.num_links)
+        link_positions = np.arange(start, end, dtype=np.int64)
+        pair_of_link = np.searchsorted(self.pair_ends, link_positions, side='right')
+        position_in_pair = link_positions - (self.pair_ends - self.links_per_pair)[pair_of_link]
+        class_a = self.pairs_A[pair_of_link]
+        class_b = self.pairs_B[pair_of_link]
+        size_b = self.sizes_B[class_b]
+        offsets_a = position_in_pair // size_b
+        offsets_b = position_in_pair % size_b
+        # position k of the upper triangle of a class of size n, row by row
+        same_class = class_a == class_b
+        n = size_b[same_class]
+        k = position_in_pair[same_class]
+        rows = n - 2 - np.floor(np.sqrt(-8 * k + 4 * n * (n - 1) - 7) / 2 - 0.5).astype(np.int64)
+        offsets_a[same_class] = rows
+        offsets_b[same_class] = k + rows + 1 - n * (n - 1) // 2 + (n - rows) * (n - rows - 1) // 2
+        return self.starts_A[class_a] + offsets_a, self.starts_B[class_b] + offsets_b
+
+
+def split_data_to_partitions(df, qi_list, classes=None):
     """
     Split the dataframe into partitions. Each records in each partition are the totally same. (Because of k-anonymity)
     And extract the first record of each partition as the representative record of this partition.
     :param df: the dataframe to be split.
     :param qi_list: the quasi-identifiers to be used.
+    :param classes: EquivalenceClasses of df, e.g. emitted by the anonymizer. Computed if None.
     :return: a dict of partitions, and a list of representative records.
     """
-    partition_list = df.groupby(qi_list)
-    # partition_list to partition_dict: keys are the index of first record in each partition, values are the partition.
+    if classes is None:
+        classes = compute_equivalence_classes(df, qi_list)
+    # partition_dict: keys are the index of first record in each partition, values are the partition.
     partition_dict = {}
-    for partition_key, partition in partition_list:
-        # get the index of the first record in this partition.
-        partition_dict[partition.iloc[0].name] = partition
+    for first_position, positions in zip(classes.first_positions, classes.member_positions()):
+        partition_dict[df.index[first_position]] = df.iloc[positions]
     return partition_dict
 
 
-def block_data(anonymized_data_path_A, anonymized_data_path_B, hierarchy_file_dir, qi_list):
+def load_classes(anonymized_data_path, qi_list, classes=None, class_table_path=None):
     """
-    Block the data. Find candidate links.
+    representative quasi-identifier values and member record indices of each equivalence class of a dataset.
+    With a published class table only the 'index' and 'class_id' columns of the anonymized data are read,
+    the generalized values come from the n/k rows of the class table.
+    :param anonymized_data_path: anonymized dataset without sensitive attributes and identifiers
+    :param qi_list: the quasi-identifiers to be used
+    :param classes: EquivalenceClasses emitted by the anonymizer (optional)
+    :param class_table_path: class table published by the data holder (optional)
+    :return: (representatives, members)
+    """
+    if class_table_path is not None:
+        class_table = load_class_table(class_table_path, qi_list)
+        df = pd.read_csv(anonymized_data_path, usecols=['index', CLASS_ID_COLUMN], index_col='index')
+        classes = classes_from_class_ids(df[CLASS_ID_COLUMN].to_numpy(), qi_list)
+        representatives = class_table[qi_list].to_dict('records')
+    else:
+        df = read_csv_columns(anonymized_data_path, qi_list, categorical_columns=qi_list, index_col='index')
+        if classes is None:
+            classes = compute_equivalence_classes(df, qi_list)
+        representatives = df[qi_list].iloc[classes.first_positions].to_dict('records')
+    record_index = df.index.to_numpy()
+    members = [record_index[positions] for positions in classes.member_positions()]
+    return representatives, members
+
+
+def find_class_pair_links(anonymized_data_path_A, anonymized_data_path_B, hierarchy_file_dir, qi_list, classes_A=None,
+                          classes_B=None, class_table_path_A=None, class_table_path_B=None, blocking_mode='matrix'):
+    """
+    Block the data on the equivalence classes. The linked class pairs are not expanded to record links yet.
     :param anonymized_data_path_A:
     :param anonymized_data_path_B:
     :param hierarchy_file_dir:
     :param qi_list:
-    :return: candidate_links, candidate_record_set_A, candidate_record_set_B
+    :param classes_A: EquivalenceClasses of the anonymized dataset A emitted by the anonymizer (optional).
+    The class ids are the positions of the records in the anonymized file.
+    :param classes_B: EquivalenceClasses of the anonymized dataset B emitted by the anonymizer (optional).
+    :param class_table_path_A: class table published by data holder A (optional).
+    The anonymized dataset A must have the class_id column then.
+    :param class_table_path_B: class table published by data holder B (optional).
+    :param blocking_mode: 'matrix' or 'pairwise', see find_candidate_links_for_classes
+    :return: ClassPairLinks
     """
-    start_time = time.time()
-    print(f'Start finding candidate links for {anonymized_data_path_A} and {anonymized_data_path_B}')
-    df_a = pd.read_csv(anonymized_data_path_A, index_col='index')
-    df_b = pd.read_csv(anonymized_data_path_B, index_col='index')
-
-    # split df_a and df_b into partitions. partition_dict_A and partition_dict_B are the dict of partitions.
+    # split df_a and df_b into partitions (equivalence classes). Unless the data holders have already sent them
+    # (class tables or classes emitted by the anonymizer), the classes are computed in one vectorized pass.
     # Since each record in each partition are the totally same,
     # we can extract the first record of each partition as the representative record of this partition.
     # in this way, we can reduce the number of records to be compared.
-    partition_dict_A = split_data_to_partitions(df_a, qi_list)
-    partition_dict_B = split_data_to_partitions(df_b, qi_list)
-    print(f'{len(partition_dict_A)} partitions in dataset A')
-    print(f'{len(partition_dict_B)} partitions in dataset B')
+    representatives_A, members_A = load_classes(anonymized_data_path_A, qi_list, classes_A, class_table_path_A)
+    representatives_B, members_B = load_classes(anonymized_data_path_B, qi_list, classes_B, class_table_path_B)
+    print(f'{len(representatives_A)} partitions in dataset A')
+    print(f'{len(representatives_B)} partitions in dataset B')
 
     # Find candidate links.
     # If two records have the same value in each attribute, or have a covered relationship in each attribute, then they are candidate link.
@@ -100,11 +336,125 @@ def block_data(anonymized_data_path_A, anonymized_data_path_B, hierarchy_file_di
     # e.g. if record_A's age is [21-30], record_B's age is [21-25], then record_A and record_B have a covered relationship at attribute age.
     # e.g. if record_A's education is Professional Education, record_B's education is higher education, then record_A and record_B have a covered relationship at attribute education.
     # e.g. if record_A's age is 17, record_B's age is [21-25], then record_A and record_B don't have a covered relationship.
-    hierarchy_tree_dict = h_tree.build_all_hierarchy_tree(hierarchy_file_dir)
-    candidate_links = find_candidate_links(partition_dict_A, partition_dict_B, hierarchy_tree_dict,
-                                           qi_list)  # O(n^2/k^2)
-    candidate_record_set_A = set(candidate_links.get_level_values('index_a'))
-    candidate_record_set_B = set(candidate_links.get_level_values('index_b'))
+    compatibility_cache = get_compatibility_cache(hierarchy_file_dir, qi_list)
+    pairs_A, pairs_B = find_candidate_class_pairs(representatives_A, representatives_B, compatibility_cache, qi_list,
+                                                  blocking_mode)  # O(n^2/k^2)
+    print_compatibility_cache_stats(compatibility_cache, blocking_mode)
+    return ClassPairLinks(pairs_A, pairs_B, members_A, members_B)
+
+
+def find_self_class_pair_links(anonymized_data_path, hierarchy_file_dir, qi_list, classes=None, class_table_path=None,
+                               blocking_mode='matrix'):
+    """
+    Block a dataset against itself for deduplication. The classes are loaded once and only the class pairs a <= b
+    are kept, see SelfClassPairLinks.
+    :return: SelfClassPairLinks
+    """
+    representatives, members = load_classes(anonymized_data_path, qi_list, classes, class_table_path)
+    print(f'{len(representatives)} partitions in dataset {anonymized_data_path}')
+    compatibility_cache = get_compatibility_cache(hierarchy_file_dir, qi_list)
+    # the compatibility of two classes is symmetric
+    pairs, pairs_other = find_candidate_class_pairs(representatives, representatives, compatibility_cache, qi_list,
+                                                    blocking_mode)
+    upper = pairs <= pairs_other
+    return SelfClassPairLinks(pairs[upper], pairs_other[upper], members)
+
+
+def find_multi_party_class_pair_links(anonymized_data_paths, hierarchy_file_dir, qi_list, classes=None,
+                                      class_table_paths=None, blocking_mode='matrix'):
+    """
+    Block the data of N data holders in one pass. The classes of all holders are loaded once and encoded into one
+    shared class index over the hierarchy nodes, and the classes of each holder are checked against the classes of
+    all later holders at once, instead of N(N-1)/2 separate block_data runs that regroup each dataset N-1 times.
+    :param anonymized_data_paths: dict. keys are holder names, values are anonymized datasets
+    :param classes: dict of EquivalenceClasses per holder name (optional)
+    :param class_table_paths: dict of class tables per holder name (optional)
+    :param blocking_mode: 'matrix' or 'pairwise', see find_candidate_links_for_classes
+    :return: dict. keys are (holder name, later holder name) in the order of anonymized_data_paths,
+             values are ClassPairLinks
+    """
+    check_blocking_mode(blocking_mode)
+    classes = classes or {}
+    class_table_paths = class_table_paths or {}
+    names = list(anonymized_data_paths)
+    representatives = {}
+    members = {}
+    for name in names:
+        representatives[name], members[name] = load_classes(anonymized_data_paths[name], qi_list, classes.get(name),
+                                                            class_table_paths.get(name))
+        print(f'{len(representatives[name])} partitions in dataset {name}')
+    compatibility_cache = get_compatibility_cache(hierarchy_file_dir, qi_list)
+    # shared class index: the classes of all holders one after the other
+    all_representatives = [row for name in names for row in representatives[name]]
+    node_ids = compatibility_cache.encode(all_representatives)
+    offsets = np.cumsum([0] + [len(representatives[name]) for name in names])
+    class_pair_links = {}
+    for i, name in enumerate(names[:-1]):
+        if blocking_mode == 'matrix':
+            pairs, pairs_later = compatibility_cache.compatible_class_pairs(node_ids[offsets[i]:offsets[i + 1]],
+                                                                            node_ids[offsets[i + 1]:])
+        else:
+            pairs, pairs_later = find_candidate_class_pairs(representatives[name],
+                                                            all_representatives[offsets[i + 1]:],
+                                                            compatibility_cache, qi_list, blocking_mode)
+        # split the linked classes of the later holders by holder, keeping the row-major order
+        pairs_later = pairs_later + offsets[i + 1]
+        holders_later = np.searchsorted(offsets, pairs_later, side='right') - 1
+        for j in range(i + 1, len(names)):
+            selected = holders_later == j
+            class_pair_links[(name, names[j])] = ClassPairLinks(pairs[selected], pairs_later[selected] - offsets[j],
+                                                                members[name], members[names[j]])
+    print_compatibility_cache_stats(compatibility_cache, blocking_mode)
+    return class_pair_links
+
+
+def plan_blocking(anonymized_data_path_A, anonymized_data_path_B, hierarchy_file_dir, qi_list, classes_A=None,
+                  classes_B=None, class_table_path_A=None, class_table_path_B=None, blocking_mode='matrix',
+                  num_fields=6, memory_budget_bytes=None):
+    """
+    Dry run of block_data: the exact number of candidate links, the estimated cost and the strategy,
+    without materializing any link
+    :return: CandidatePlan
+    """
+    class_pair_links = find_class_pair_links(anonymized_data_path_A, anonymized_data_path_B, hierarchy_file_dir,
+                                             qi_list, classes_A, classes_B, class_table_path_A, class_table_path_B,
+                                             blocking_mode)
+    return plan_candidate_links(class_pair_links, num_fields, memory_budget_bytes)
+
+
+def block_data(anonymized_data_path_A, anonymized_data_path_B, hierarchy_file_dir, qi_list, classes_A=None,
+               classes_B=None, class_table_path_A=None, class_table_path_B=None, blocking_mode='matrix',
+               memory_budget_bytes=None):
+    """
+    Block the data. Find candidate links.
+    :param anonymized_data_path_A:
+    :param anonymized_data_path_B:
+    :param hierarchy_file_dir:
+    :param qi_list:
+    :param classes_A: EquivalenceClasses of the anonymized dataset A emitted by the anonymizer (optional).
+    The class ids are the positions of the records in the anonymized file.
+    :param classes_B: EquivalenceClasses of the anonymized dataset B emitted by the anonymizer (optional).
+    :param class_table_path_A: class table published by data holder A (optional).
+    The anonymized dataset A must have the class_id column then.
+    :param class_table_path_B: class table published by data holder B (optional).
+    :param blocking_mode: 'matrix' or 'pairwise', see find_candidate_links_for_classes
+    :param memory_budget_bytes: memory for the candidate links. Default is half of the available memory.
+    The links are only materialized if the plan fits in memory.
+    :return: candidate_links, candidate_record_set_A, candidate_record_set_B
+    """
+    start_time = time.time()
+    print(f'Start finding candidate links for {anonymized_data_path_A} and {anonymized_data_path_B}')
+    class_pair_links = find_class_pair_links(anonymized_data_path_A, anonymized_data_path_B, hierarchy_file_dir,
+                                             qi_list, classes_A, classes_B, class_table_path_A, class_table_path_B,
+                                             blocking_mode)
+    # count the links before expanding them
+    plan = plan_candidate_links(class_pair_links, memory_budget_bytes=memory_budget_bytes)
+    print(plan)
+    if plan.strategy != 'in_memory':
+        raise Exception(f'Candidate links do not fit in memory: {plan.advice}')
+    candidate_links = class_pair_links.to_multi_index()
+    candidate_record_set_A = set(class_pair_links.candidate_records('A'))
+    candidate_record_set_B = set(class_pair_links.candidate_records('B'))
 
     print(f'Candidate links found for {anonymized_data_path_A} and {anonymized_data_path_B}')
     print(candidate_links)
@@ -1,31 +1,319 @@
+import functools
 import hashlib
 import hmac
+import time
+from collections import OrderedDict
 import numpy as np
 
+# hmac: keyed sha1 and keyed md5, one digest per double hashing seed.
+# blake2b: keyed blake2b, both double hashing seeds are taken from one 16 byte digest.
+HASH_FAMILIES = ('hmac', 'blake2b')
+
+
+class BloomConfig:
+    """
+    Parameters of the bloom filter encoder
+    """
+
+    def __init__(self, size=500, num_hash=10, ngram_size=2, hash_family='hmac', secret_key="secret_key", fold=0,
+                 sample_size=None):
+        """
+        :param fold: number of times the bloom filter is XOR-folded in half, see compact_bits
+        :param sample_size: number of bits kept by the keyed bit sampling after folding, None keeps all bits
+        """
+        if hash_family not in HASH_FAMILIES:
+            raise Exception(f"Unknown hash family {hash_family}. Use one of {HASH_FAMILIES}")
+        if ngram_size < 1:
+            raise Exception("ngram_size must be at least 1")
+        if fold < 0 or size % (2 ** fold) != 0:
+            raise Exception(f"size {size} can't be folded {fold} times, it must be divisible by {2 ** fold}")
+        if sample_size is not None and not 0 < sample_size <= size // (2 ** fold):
+            raise Exception(f"sample_size must be between 1 and the folded size {size // (2 ** fold)}")
+        self.size = size  # length of bit sequence
+        self.num_hash = num_hash  # number of hash functions
+        self.ngram_size = ngram_size  # n of the ngrams the value is split into
+        self.hash_family = hash_family
+        self.secret_key = secret_key
+        self.fold = fold
+        self.sample_size = sample_size
+
+    @property
+    def output_size(self):
+        """
+        length of the encoded bit sequence after folding and sampling
+        """
+        return self.compact_size(self.size)
+
+    def compact_size(self, size):
+        if self.sample_size is not None:
+            return self.sample_size
+        return size // (2 ** self.fold)
+
+    def compact(self, bit_seq):
+        return compact_bits(bit_seq, self.fold, self.sample_size, self.secret_key)
+
+    def params_key(self):
+        """
+        all parameters of the encoding, including the secret key. Equal keys give equal bloom filters.
+        """
+        return (self.size, self.num_hash, self.ngram_size, self.hash_family, self.secret_key, self.fold,
+                self.sample_size)
+
+    def public_params(self):
+        """
+        parameters of the encoding with the secret key replaced by its sha256 digest,
+        e.g. for keys of caches that are written to disk
+        """
+        params = dict(vars(self))
+        params['secret_key'] = hashlib.sha256(bytes(self.secret_key, 'utf-8')).hexdigest()
+        return params
+
+    def encode(self, value):
+        return encode_bloom(value, config=self)
+
+    def __repr__(self):
+        compaction = ''
+        if self.fold:
+            compaction += f', fold={self.fold}'
+        if self.sample_size is not None:
+            compaction += f', sample_size={self.sample_size}'
+        return (f'BloomConfig(size={self.size}, num_hash={self.num_hash}, ngram_size={self.ngram_size}, '
+                f'hash_family={self.hash_family}{compaction})')
+
 
 def split_ngrams(value, n=2):
     """
-    Split string into ngrams
+    Split string into ngrams. The string is padded with n-1 spaces at both ends,
+    so the first and last characters are part of n ngrams like the other characters.
     :param value: string to be split
     :param n: ngram size
     :return: list of ngrams
     """
-    padded_str = ' ' + value + ' '
-    ngrams = [padded_str[i:i + 2] for i in range(len(padded_str) - 1)]
+    padding = ' ' * (n - 1)
+    padded_str = padding + value + padding
+    ngrams = [padded_str[i:i + n] for i in range(len(padded_str) - n + 1)]
     return ngrams
 
 
-def encode_bloom(value, size=200, num_hash=5):
+def bits_to_string(bit_seq):
+    """
+    Convert a boolean bit sequence to a string of '0' and '1'
+    :param bit_seq: boolean numpy array
+    :return: bit string
+    """
+    return (bit_seq.astype(np.uint8) + ord('0')).tobytes().decode('ascii')
+
+
+def xor_fold(bit_seq, fold=1):
+    """
+    XOR-fold a bloom filter: the second half is XORed onto the first half, fold times.
+    Each fold halves the length. Set bits of the two halves that collide cancel each other,
+    so the Dice-coefficient of folded filters approximates the one of the full filters.
+    :param bit_seq: boolean numpy array, its length must be divisible by 2 ** fold
+    :return: boolean numpy array of length len(bit_seq) / 2 ** fold
+    """
+    if len(bit_seq) % (2 ** fold) != 0:
+        raise Exception(f"A bit sequence of length {len(bit_seq)} can't be folded {fold} times")
+    for _ in range(fold):
+        half = len(bit_seq) // 2
+        bit_seq = bit_seq[:half] ^ bit_seq[half:]
+    return bit_seq
+
+
+@functools.lru_cache(maxsize=64)
+def sample_positions(size, sample_size, secret_key):
+    """
+    Fixed keyed bit sampling projection: sample_size distinct positions of a bit sequence of length size,
+    drawn with a seed derived from the secret key. Both data holders use the same key, so they keep the same bits.
+    :return: sorted int numpy array of positions
+    """
+    seed_digest = hmac.new(bytes(secret_key, 'utf-8'), f'bit-sampling:{size}:{sample_size}'.encode('utf-8'),
+                           hashlib.sha256).digest()
+    rng = np.random.default_rng(int.from_bytes(seed_digest[:8], 'big'))
+    positions = np.sort(rng.choice(size, size=sample_size, replace=False))
+    positions.setflags(write=False)
+    return positions
+
+
+def compact_bits(bit_seq, fold=0, sample_size=None, secret_key="secret_key"):
+    """
+    Compact form of a bloom filter: XOR-folded fold times, then sample_size bits kept by the keyed bit sampling.
+    The compact filters are compared like full filters, with the Dice-coefficient.
+    :param bit_seq: boolean numpy array
+    :return: boolean numpy array
+    """
+    if fold:
+        bit_seq = xor_fold(bit_seq, fold)
+    if sample_size is not None:
+        if sample_size > len(bit_seq):
+            raise Exception(f"Can't sample {sample_size} bits of a bit sequence of length {len(bit_seq)}")
+        bit_seq = bit_seq[sample_positions(len(bit_seq), sample_size, secret_key)]
+    return bit_seq
+
+
+def encode_bloom(value, size=200, num_hash=5, config=None):
     """
     Encode string in bloom filter
-    :return:
+    :param value: string to be encoded
+    :param size: length of bit sequence. Ignored if config is given
+    :param num_hash: number of hash functions. Ignored if config is given
+    :param config: BloomConfig. If None, bigrams and the hmac hash family are used
+    :return: bit string of the bloom filter
     """
-    ngrams = split_ngrams(value)
-    bf = BloomFilter(size=size, num_hash=num_hash)
+    if config is None:
+        config = BloomConfig(size=size, num_hash=num_hash)
+    ngrams = split_ngrams(value, config.ngram_size)
+    bf = BloomFilter(size=config.size, num_hash=config.num_hash, hash_family=config.hash_family)
     for ngram in ngrams:
-        bf.add(ngram)
-    bit_string = ''.join(map(lambda x: '1' if x else '0', bf.get_bit_seq()))
-    return bit_string
+        bf.add(ngram, config.secret_key)
+    return bits_to_string(config.compact(bf.get_bit_seq()))
+
+
+def encode_clk(values, size=1000, num_hash_dict=None, default_num_hash=5, config=None):
+    """
+    Encode all identifier values of one record into a single record-level bloom filter,
+    i.e. a cryptographic long-term key (CLK).
+    Every field is hashed into the same bit sequence, each field with its own number of hash functions,
+    so fields that are more discriminating (e.g. names) can be given more weight.
+    :param values: dict. keys are field names, values are the strings to be encoded
+    :param size: length of bit sequence
+    :param num_hash_dict: dict. keys are field names, values are the number of hash functions for this field
+    :param default_num_hash: number of hash functions for fields not in num_hash_dict
+    :param config: BloomConfig. Only its ngram size, hash family, secret key and compaction (fold, sample_size)
+                   are used here
+    :return: bit string of the record-level bloom filter
+    """
+    if num_hash_dict is None:
+        num_hash_dict = {}
+    if config is None:
+        config = BloomConfig()
+    bf = BloomFilter(size=size, num_hash=default_num_hash, hash_family=config.hash_family)
+    for field, value in values.items():
+        num_hash = num_hash_dict.get(field, default_num_hash)
+        for ngram in split_ngrams(value, config.ngram_size):
+            bf.add(ngram, config.secret_key, num_hash=num_hash)
+    return bits_to_string(config.compact(bf.get_bit_seq()))
+
+
+class EncodingCache:
+    """
+    Bounded LRU cache of bloom filters keyed by (value, parameters of the encoding).
+    One cache can be shared by all identifier columns, batches and data holders of a process:
+    a value is encoded once per BloomConfig, whichever column it occurs in.
+    """
+
+    def __init__(self, max_size=65536):
+        """
+        :param max_size: maximum number of cached bloom filters, the least recently used ones are dropped
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def encode(self, value, config):
+        key = (value, config.params_key())
+        bit_string = self.entries.get(key)
+        if bit_string is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return bit_string
+        self.misses += 1
+        bit_string = encode_bloom(value, config=config)
+        self.entries[key] = bit_string
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return bit_string
+
+    def __repr__(self):
+        return f'EncodingCache({len(self.entries)}/{self.max_size} entries, {self.hits} hits, {self.misses} misses)'
+
+
+def encode_bloom_column(values, config, cache=None):
+    """
+    Encode a column of identifier values. Identifier columns are repetitive (e.g. suburbs, states, common names),
+    so the column is factorized, only the distinct values are encoded and the bloom filters are broadcast back
+    by code.
+    :param values: pandas Series of strings
+    :param config: BloomConfig
+    :param cache: EncodingCache shared across columns and calls (optional)
+    :return: object numpy array of bit strings, in the order of values
+    """
+    import pandas as pd
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    if cache is None:
+        encoded = [encode_bloom(value, config=config) for value in uniques]
+    else:
+        encoded = [cache.encode(value, config) for value in uniques]
+    return np.array(encoded, dtype=object)[codes]
+
+
+def bit_strings_to_array(bit_strings):
+    """
+    Convert bit strings of equal length into one contiguous boolean matrix
+    :param bit_strings: iterable of bit strings, e.g. a column of encoded identifiers
+    :return: boolean numpy array of shape (number of bit strings, length of bit string)
+    """
+    bit_strings = list(bit_strings)
+    if len(bit_strings) == 0:
+        return np.zeros((0, 0), dtype=np.bool_)
+    buffer = np.frombuffer(''.join(bit_strings).encode('ascii'), dtype=np.uint8)
+    return buffer.reshape(len(bit_strings), -1) == ord('1')
+
+
+def dice_coefficient(bit_array_A, bit_array_B):
+    """
+    Row-wise Dice-coefficient of two boolean matrices of the same shape
+    :param bit_array_A: boolean matrix, one bloom filter per row
+    :param bit_array_B: boolean matrix, one bloom filter per row
+    :return: numpy array of Dice-coefficients, 0 if both bloom filters are empty
+    """
+    intersections = np.count_nonzero(bit_array_A & bit_array_B, axis=1)
+    totals = np.count_nonzero(bit_array_A, axis=1) + np.count_nonzero(bit_array_B, axis=1)
+    return np.divide(2 * intersections, totals, out=np.zeros(len(totals), dtype=np.float64), where=totals > 0)
+
+
+# number of bits set in each byte value, used to count bits of packed bloom filters
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def pack_bit_strings(bit_strings):
+    """
+    Convert bit strings of equal length into packed bits, 8 bits per byte
+    :param bit_strings: iterable of bit strings
+    :return: uint8 numpy array of shape (number of bit strings, ceil(length of bit string / 8))
+    """
+    return np.packbits(bit_strings_to_array(bit_strings), axis=1)
+
+
+def popcount_packed(packed_array):
+    """
+    Number of bits set in each row of packed bits
+    :param packed_array: uint8 matrix, one packed bloom filter per row
+    :return: int32 numpy array
+    """
+    return POPCOUNT_TABLE[packed_array].sum(axis=1, dtype=np.int32)
+
+
+def dice_coefficient_packed(packed_A, packed_B, popcount_A=None, popcount_B=None):
+    """
+    Row-wise Dice-coefficient of two packed bit matrices of the same shape
+    :param packed_A: uint8 matrix, one packed bloom filter per row
+    :param packed_B: uint8 matrix, one packed bloom filter per row
+    :param popcount_A: precomputed number of bits set in each row of packed_A (optional)
+    :param popcount_B: precomputed number of bits set in each row of packed_B (optional)
+    :return: numpy array of Dice-coefficients, 0 if both bloom filters are empty
+    """
+    if popcount_A is None:
+        popcount_A = popcount_packed(packed_A)
+    if popcount_B is None:
+        popcount_B = popcount_packed(packed_B)
+    intersections = popcount_packed(packed_A & packed_B)
+    totals = popcount_A + popcount_B
+    return np.divide(2 * intersections, totals, out=np.zeros(len(totals), dtype=np.float64), where=totals > 0)
 
 
 def md5_hashing(value, secret_key):
@@ -38,7 +326,7 @@ def md5_hashing(value, secret_key):
     secret_key_bytes = bytes(secret_key, 'utf-8')
     value_bytes = bytes(value, 'utf-8')
     hmac_md5 = hmac.new(secret_key_bytes, value_bytes, hashlib.md5)
-    return int(hmac_md5.hexdigest(), 16)
+    return int.from_bytes(hmac_md5.digest(), 'big')
 
 def sha1_hashing(value, secret_key):
     """
@@ -50,29 +338,43 @@ def sha1_hashing(value, secret_key):
     secret_key_bytes = bytes(secret_key, 'utf-8')
     value_bytes = bytes(value, 'utf-8')
     hmac_sha1 = hmac.new(secret_key_bytes, value_bytes, hashlib.sha1)
-    return int(hmac_sha1.hexdigest(), 16)
+    return int.from_bytes(hmac_sha1.digest(), 'big')
+
+
+def blake2b_double_hashing_seeds(value, secret_key):
+    """
+    hash value with keyed blake2b, and split the 16 byte digest into the two seeds of double hashing
+    :param value: value to be hashed
+    :param secret_key: secret key, at most 64 bytes
+    :return: (h1, h2) in integer
+    """
+    digest = hashlib.blake2b(bytes(value, 'utf-8'), key=bytes(secret_key, 'utf-8'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big')
+
 
 class BloomFilter:
     """
     Bloom Filter using double hashing
     """
 
-    def __init__(self, size=1000, num_hash=3):
+    def __init__(self, size=1000, num_hash=3, hash_family='hmac'):
         self.size = size  # length of bit sequence
         self.num_hash = num_hash  # number of hash functions. gi(x) = (h1(x) + i*h2(x)) % size (i=0,1,2,...,num_hash-1)
+        self.hash_family = hash_family  # how h1 and h2 are computed, see HASH_FAMILIES
         self.bit_seq = np.zeros(self.size, dtype=np.bool_)
         self.num_element = 0
 
-    def add(self, value, secret_key="secret_key"):
+    def add(self, value, secret_key="secret_key", num_hash=None):
         """
         add value to the bloom filter using double hashing
-        hash_function1 is sha1, hash_function2 is md5
+        hash_function1 is sha1, hash_function2 is md5 (or both from blake2b, see HASH_FAMILIES)
 
         :param value:
         :param secret_key:
+        :param num_hash: number of hash functions for this value. Default is self.num_hash
         :return:
         """
-        pos_hash_values = self._double_hashing(value, secret_key)
+        pos_hash_values = self._double_hashing(value, secret_key, num_hash)
         for pos in pos_hash_values:
             self.bit_seq[pos] = True
         self.num_element += 1
@@ -111,19 +413,48 @@ class BloomFilter:
         else:
             return True
 
-    def _double_hashing(self, value, secret_key="secret_key"):
+    def _double_hashing(self, value, secret_key="secret_key", num_hash=None):
         if value is None:
             value = 0
-        h1_value = sha1_hashing(value, secret_key)
-        h2_value = md5_hashing(value, secret_key)
+        if num_hash is None:
+            num_hash = self.num_hash
+        if self.hash_family == 'blake2b':
+            h1_value, h2_value = blake2b_double_hashing_seeds(value, secret_key)
+        else:
+            h1_value = sha1_hashing(value, secret_key)
+            h2_value = md5_hashing(value, secret_key)
         pos_hash_values = []
-        for i in range(0, self.num_hash):
+        for i in range(0, num_hash):
             pos_hash_values.append((h1_value + i * h2_value) % self.size)
         return pos_hash_values
 
 
+def benchmark_encoding(values, configs, repeat=3):
+    """
+    Microbenchmark of the encoder. Encode all values with each config and measure the encoding cost per value.
+    :param values: list of strings to be encoded, e.g. an identifier column
+    :param configs: list of BloomConfig
+    :param repeat: the best of repeat runs is reported
+    :return: list of (config, seconds per value)
+    """
+    results = []
+    for config in configs:
+        best = float('inf')
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            for value in values:
+                encode_bloom(value, config=config)
+            best = min(best, time.perf_counter() - start_time)
+        seconds_per_value = best / max(len(values), 1)
+        results.append((config, seconds_per_value))
+        print(f'{config}: {seconds_per_value * 1e6:.2f} us per value')
+    return results
+
+
 if __name__ == "__main__":
     print("Testing Bloom Filter")
+    benchmark_values = ['riley', 'barlovic', 'ashley drive53', 'noaddresstwo', 'kallangur', 'wa6743'] * 200
+    benchmark_encoding(benchmark_values, [BloomConfig(hash_family='hmac'), BloomConfig(hash_family='blake2b')])
 
     # # generate random strings
     # import random
@@ -0,0 +1,93 @@
+import json
+import os
+import shutil
+import uuid
+
+# Checkpoints of a long-running comparison of candidate links.
+# Each scored chunk of links is committed as its own csv file: the file is written under a temporary name and renamed,
+# then the manifest is rewritten the same way. A chunk is committed once it is in the manifest, so a crash never
+# leaves a half written chunk behind, and a restarted run skips all committed chunks and resumes with the next one.
+# The final output is assembled from the chunk files without scoring anything again.
+#
+# Layout of a checkpoint directory:
+#   manifest.json: signature of the inputs, chunk size, and the file name and number of links of each committed chunk
+#   chunk-{i:05d}.csv: the scored links of chunk i, with header
+
+MANIFEST_FILE_NAME = 'manifest.json'
+
+
+def chunk_file_name(chunk):
+    return f'chunk-{chunk:05d}.csv'
+
+
+def write_atomically(file_path, write):
+    tmp_path = f'{file_path}.tmp-{uuid.uuid4().hex}'
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as file:
+        write(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, file_path)
+
+
+class ChunkCheckpoint:
+    """
+    Durable progress of a chunked job. Chunks have to be committed in order.
+    """
+
+    def __init__(self, checkpoint_dir, signature):
+        """
+        :param checkpoint_dir: directory of the chunk files and the manifest
+        :param signature: json serializable description of the inputs and the chunking. Committed chunks of a run
+                          with another signature are discarded.
+        """
+        self.checkpoint_dir = checkpoint_dir
+        self.signature = json.loads(json.dumps(signature))
+        self.chunks = []
+        manifest_path = os.path.join(checkpoint_dir, MANIFEST_FILE_NAME)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest['signature'] == self.signature:
+                self.chunks = manifest['chunks']
+            else:
+                print(f'Inputs have changed since the checkpoint at {checkpoint_dir}, starting over')
+                self.clear()
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    @property
+    def num_committed(self):
+        return len(self.chunks)
+
+    @property
+    def num_committed_links(self):
+        return sum(chunk['num_links'] for chunk in self.chunks)
+
+    def commit(self, chunk, df_chunk):
+        """
+        :param chunk: number of the chunk, the next uncommitted one
+        :param df_chunk: scored links of the chunk
+        """
+        if chunk != len(self.chunks):
+            raise Exception(f'Chunk {chunk} committed out of order, expected chunk {len(self.chunks)}')
+        file_name = chunk_file_name(chunk)
+        write_atomically(os.path.join(self.checkpoint_dir, file_name), lambda file: df_chunk.to_csv(file))
+        self.chunks.append({'file': file_name, 'num_links': len(df_chunk)})
+        manifest = {'signature': self.signature, 'chunks': self.chunks}
+        write_atomically(os.path.join(self.checkpoint_dir, MANIFEST_FILE_NAME),
+                         lambda file: json.dump(manifest, file))
+
+    def assemble(self, csv_file):
+        """
+        write the committed chunks one after the other into one csv, with the header of the first chunk only
+        :param csv_file: text stream, e.g. of link_store.open_zip_csv
+        """
+        for i, chunk in enumerate(self.chunks):
+            with open(os.path.join(self.checkpoint_dir, chunk['file']), 'r', encoding='utf-8', newline='') as file:
+                header = file.readline()
+                if i == 0:
+                    csv_file.write(header)
+                shutil.copyfileobj(file, csv_file)
+
+    def clear(self):
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        self.chunks = []
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+# Clusters of duplicate records from the matched links of a deduplication (a dataset linked with itself).
+# Matches are transitive within a cluster: if r1 matches r2 and r2 matches r3, all three are one entity.
+# The clusters are the connected components of the match graph, found with a union-find over integer record ids.
+
+
+class UnionFind:
+    """
+    Disjoint sets over the ids 0, ..., n - 1, with path halving and union by size
+    """
+
+    def __init__(self, n):
+        self.parents = np.arange(n, dtype=np.int64)
+        self.sizes = np.ones(n, dtype=np.int64)
+
+    def find(self, i):
+        parents = self.parents
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    def union(self, i, j):
+        root_i = self.find(i)
+        root_j = self.find(j)
+        if root_i == root_j:
+            return
+        if self.sizes[root_i] < self.sizes[root_j]:
+            root_i, root_j = root_j, root_i
+        self.parents[root_j] = root_i
+        self.sizes[root_i] += self.sizes[root_j]
+
+    def roots(self):
+        return np.array([self.find(i) for i in range(len(self.parents))], dtype=np.int64)
+
+
+def cluster_matches(keys_i, keys_j, records=None):
+    """
+    :param keys_i: record indices of the first record of each matched link
+    :param keys_j: record indices of the second record of each matched link
+    :param records: all record indices (optional). Records without any match become clusters of one record.
+    :return: DataFrame with the columns 'index' and 'cluster_id', clusters numbered by their first record
+    """
+    all_keys = np.concatenate([np.asarray(keys_i, dtype=object), np.asarray(keys_j, dtype=object)])
+    if records is not None:
+        all_keys = np.concatenate([np.asarray(records, dtype=object), all_keys])
+    ids, uniques = pd.factorize(all_keys)
+    union_find = UnionFind(len(uniques))
+    offset = len(all_keys) - 2 * len(keys_i)
+    for i, j in zip(ids[offset:offset + len(keys_i)], ids[offset + len(keys_i):]):
+        union_find.union(i, j)
+    cluster_ids, _ = pd.factorize(union_find.roots())
+    return pd.DataFrame({'index': uniques, 'cluster_id': cluster_ids})
@@ -0,0 +1,18 @@
+import pandas as pd
+from recordlinkage.base import BaseCompareFeature
+from record_linkage.bloom import bit_strings_to_array, dice_coefficient
+
+
+class CompareBitarray(BaseCompareFeature):
+    def __init__(self, left_on, right_on, threshold=0.7, *args, **kwargs):
+        super(CompareBitarray, self).__init__(left_on, right_on, *args, **kwargs)
+        self.threshold = threshold
+
+    def _compute_vectorized(self, s1, s2):
+        # sim = (s1 == s2).astype(float)
+        # return sim
+        # convert the bit strings into contiguous boolean matrices and compare all pairs at once
+        bit_array_1 = bit_strings_to_array(s1)
+        bit_array_2 = bit_strings_to_array(s2)
+        dice_coefficients = dice_coefficient(bit_array_1, bit_array_2)
+        return pd.Series(dice_coefficients)
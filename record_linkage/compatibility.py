@@ -0,0 +1,103 @@
+from collections import OrderedDict
+import numpy as np
+
+# Memoized compatibility of generalized quasi-identifier tuples for classifier 1.
+# Two generalized values of an attribute are compatible if they are equal or one covers the other in the
+# hierarchy tree. Instead of walking the hierarchy (check_node_covered) for every attribute of every class pair,
+# each hierarchy is turned once into a boolean matrix over node ids. The matrices of all quasi-identifiers are
+# flattened into one array, so a class pair is checked with one gather across all quasi-identifiers.
+# The results of tuple pairs are also kept in a bounded LRU, because the same generalized tuples recur across
+# k-sweeps and repeated linkage runs between the same data holders.
+
+
+class CompatibilityCache:
+    """
+    Compatibility of generalized quasi-identifier tuples, over node ids of the hierarchy trees
+    """
+
+    def __init__(self, hierarchy_trees, qi_list, max_cached_pairs=1000000):
+        """
+        :param hierarchy_trees: dict. keys are attributes, values are HierarchyTree
+        :param qi_list: the quasi-identifiers to be used
+        :param max_cached_pairs: maximum number of tuple pair results in the LRU
+        """
+        self.qi_list = qi_list
+        self.node_ids = []  # per quasi-identifier: dict. keys are values of nodes, values are node ids
+        self.matrices = []  # per quasi-identifier: compatibility matrix over node ids
+        for attribute in qi_list:
+            node_ids, matrix = hierarchy_trees[attribute].get_compatibility_matrix()
+            self.node_ids.append(node_ids)
+            self.matrices.append(matrix)
+        # the flattened matrices of all quasi-identifiers, one after another
+        self.flat_matrix = np.concatenate([matrix.ravel() for matrix in self.matrices])
+        self.offsets = np.cumsum([0] + [matrix.size for matrix in self.matrices[:-1]]).astype(np.int64)
+        self.num_nodes = np.array([len(node_ids) for node_ids in self.node_ids], dtype=np.int64)
+        self.max_cached_pairs = max_cached_pairs
+        self.pair_cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, representatives):
+        """
+        node ids of the generalized values of each class
+        :param representatives: the quasi-identifier values of each class (dict-like, indexed by attribute)
+        :return: int64 numpy array of shape (number of classes, number of quasi-identifiers)
+        """
+        ids = np.empty((len(representatives), len(self.qi_list)), dtype=np.int64)
+        for i, row in enumerate(representatives):
+            for j, attribute in enumerate(self.qi_list):
+                ids[i, j] = self.node_ids[j][str(row[attribute])]
+        return ids
+
+    def compatible_ids(self, ids_a, ids_b):
+        """
+        check all quasi-identifiers of a pair of classes with one gather
+        :param ids_a: node ids of class a, one per quasi-identifier
+        :param ids_b: node ids of class b
+        """
+        return bool(self.flat_matrix[self.offsets + ids_a * self.num_nodes + ids_b].all())
+
+    def compatible(self, key_a, key_b, ids_a, ids_b):
+        """
+        compatibility of a pair of generalized tuples, memoized in the LRU
+        :param key_a: generalized quasi-identifier tuple of class a
+        :param key_b: generalized quasi-identifier tuple of class b
+        :param ids_a: node ids of key_a
+        :param ids_b: node ids of key_b
+        """
+        pair = (key_a, key_b)
+        result = self.pair_cache.get(pair)
+        if result is not None:
+            self.hits += 1
+            self.pair_cache.move_to_end(pair)
+            return result
+        self.misses += 1
+        result = self.compatible_ids(ids_a, ids_b)
+        self.pair_cache[pair] = result
+        if len(self.pair_cache) > self.max_cached_pairs:
+            self.pair_cache.popitem(last=False)
+        return result
+
+    def compatible_class_pairs(self, ids_A, ids_B, max_cells=16000000):
+        """
+        all compatible pairs of classes at once: per quasi-identifier, gather a P_A x P_B boolean matrix
+        from the compatibility matrix and AND them. Chunked over the classes of A to bound memory.
+        :param ids_A: node ids of the classes of A, from encode
+        :param ids_B: node ids of the classes of B
+        :param max_cells: maximum number of cells of the boolean matrix of one chunk
+        :return: (class positions in A, class positions in B) of the compatible pairs, in row-major order
+        """
+        pairs_A = []
+        pairs_B = []
+        chunk_rows = max(1, max_cells // max(1, len(ids_B)))
+        for start in range(0, len(ids_A), chunk_rows):
+            chunk = ids_A[start:start + chunk_rows]
+            compatible = np.ones((len(chunk), len(ids_B)), dtype=bool)
+            for j, matrix in enumerate(self.matrices):
+                compatible &= matrix[np.ix_(chunk[:, j], ids_B[:, j])]
+            rows, columns = np.nonzero(compatible)
+            pairs_A.append(rows + start)
+            pairs_B.append(columns)
+        if len(pairs_A) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(pairs_A).astype(np.int64), np.concatenate(pairs_B).astype(np.int64)
@@ -0,0 +1,478 @@
+import contextlib
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+import numpy as np
+import pandas as pd
+from record_linkage.bloom import pack_bit_strings, popcount_packed, dice_coefficient_packed
+
+# Persistent store of encoded bloom filters.
+# The encoded identifiers file of a data holder (csv in zip, one bit string per field) is decoded only once.
+# Each field is saved as packed bits (.npy, 8 bits per byte) together with the number of bits set per record.
+# The .npy files are opened memory-mapped, so every process of a threshold or k sweep attaches to the same
+# pages of the operating system's file cache instead of parsing the csv again.
+#
+# Layout of a store directory:
+#   meta.json: fields, number of bits per field, signature of the encoded identifiers file
+#   keys.npy: record index (e.g. '1_a') of each row
+#   {field}.npy: packed bloom filters of the field, shape (num_records, num_bytes)
+#   {field}_popcount.npy: number of bits set in each bloom filter of the field
+
+META_FILE_NAME = 'meta.json'
+KEYS_FILE_NAME = 'keys.npy'
+# column order of the compared links, as written by the recordlinkage Compare of classifier 2.
+# the stores keep the column order of the encoded identifiers file, which differs.
+COMPARED_FIELD_ORDER = ['given_name', 'surname', 'address_1_num', 'address_2', 'suburb', 'state_postcode']
+
+
+def compared_fields(store_A, store_B):
+    """
+    fields of both stores, in COMPARED_FIELD_ORDER. Other fields (e.g. 'clk') follow in the order of store A
+    """
+    fields = [field for field in store_A.fields if field in store_B.fields]
+    return sorted(fields, key=lambda field: (COMPARED_FIELD_ORDER.index(field) if field in COMPARED_FIELD_ORDER
+                                             else len(COMPARED_FIELD_ORDER)))
+
+
+def default_store_dir(encoded_file_path):
+    """
+    e.g. dataset/dataset_A/encoded_identifiers_A.zip -> dataset/dataset_A/encoded_identifiers_A_store/
+    """
+    root, _ = os.path.splitext(encoded_file_path)
+    return f'{root}_store'
+
+
+def file_signature(file_path):
+    """
+    size and modification time of a file. The store is rebuilt if the encoded identifiers file changes.
+    """
+    stat = os.stat(file_path)
+    return {'path': os.path.abspath(file_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class FilterStore:
+    """
+    Memory-mapped packed bloom filters of one data holder, indexed by record index
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, META_FILE_NAME), 'r', encoding='utf-8') as meta_file:
+            self.meta = json.load(meta_file)
+        self.fields = self.meta['fields']
+        self.num_bits = self.meta['num_bits']
+        self.keys = np.load(os.path.join(store_dir, KEYS_FILE_NAME), allow_pickle=True)
+        self.key_index = pd.Index(self.keys)
+        self.filters = {}
+        self.popcounts = {}
+        for field in self.fields:
+            self.filters[field] = np.load(os.path.join(store_dir, f'{field}.npy'), mmap_mode='r')
+            self.popcounts[field] = np.load(os.path.join(store_dir, f'{field}_popcount.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.keys)
+
+    def positions(self, keys):
+        """
+        row positions of the given record indices in the store
+        :param keys: record indices, e.g. '1_a'
+        :return: int numpy array
+        """
+        positions = self.key_index.get_indexer(keys)
+        if (positions < 0).any():
+            missing = np.asarray(keys)[positions < 0]
+            raise Exception(f'{len(missing)} records are not encoded in {self.store_dir}, e.g. {missing[:5].tolist()}')
+        return positions
+
+    def get_packed(self, field, positions):
+        """
+        packed bloom filters and the number of bits set of the records at the given positions
+        :return: (uint8 matrix, int32 array)
+        """
+        return self.filters[field][positions], self.popcounts[field][positions]
+
+    def is_current(self, encoded_file_path):
+        return self.meta['source'] == file_signature(encoded_file_path)
+
+
+def lock_owner():
+    return f'{socket.gethostname()} {os.getpid()}'
+
+
+def is_dead_owner(owner, lock_path, stale_seconds):
+    """
+    True if the process that holds a lock has died. A process on this machine is checked by its PID. The owner of a
+    lock on another machine (a shared file system) refreshes the modification time of the lock file while it holds
+    the lock, so its lock is dead if it has not been refreshed for stale_seconds.
+    """
+    try:
+        host, pid = owner.rsplit(' ', 1)
+        pid = int(pid)
+    except ValueError:
+        # a lock file that its owner has not written yet
+        return time.time() - os.path.getmtime(lock_path) > stale_seconds
+    if host != socket.gethostname():
+        return time.time() - os.path.getmtime(lock_path) > stale_seconds
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass  # alive, owned by another user
+    return False
+
+
+def read_lock_owner(lock_path):
+    with open(lock_path, 'r', encoding='utf-8') as lock_file:
+        return lock_file.read()
+
+
+def break_dead_lock(lock_path, stale_seconds):
+    """
+    remove the lock file if its owner has died. Waiters break a lock one at a time (under {lock_path}.break, which is
+    only held for a moment), so a waiter never removes the new lock of another waiter that has broken it first.
+    """
+    break_path = f'{lock_path}.break'
+    try:
+        os.close(os.open(break_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        try:
+            if time.time() - os.path.getmtime(break_path) > 60:
+                os.remove(break_path)  # left over by a waiter that died while breaking
+        except FileNotFoundError:
+            pass
+        return
+    try:
+        owner = read_lock_owner(lock_path)
+        if is_dead_owner(owner, lock_path, stale_seconds):
+            os.remove(lock_path)
+            print(f'Removed the lock {lock_path} of the dead process {owner}')
+    except FileNotFoundError:
+        pass
+    finally:
+        os.remove(break_path)
+
+
+@contextlib.contextmanager
+def store_lock(store_dir, poll_interval=0.05, stale_seconds=600):
+    """
+    Exclusive lock of a store directory between processes, held while the store is built and installed.
+    The lock is a file created with O_EXCL that holds the host and PID of its owner. It is only removed by another
+    process if the owner has died (see is_dead_owner), however long the build takes. While the lock is held, its
+    modification time is refreshed, for waiters on other machines.
+    """
+    lock_path = f'{store_dir}.lock'
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            break_dead_lock(lock_path, stale_seconds)
+            time.sleep(poll_interval)
+            continue
+        with os.fdopen(fd, 'w', encoding='utf-8') as lock_file:
+            lock_file.write(lock_owner())
+        break
+    stop_heartbeat = threading.Event()
+
+    def heartbeat():
+        while not stop_heartbeat.wait(stale_seconds / 4):
+            try:
+                os.utime(lock_path)
+            except FileNotFoundError:
+                return
+
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+    try:
+        yield
+    finally:
+        stop_heartbeat.set()
+        heartbeat_thread.join()
+        os.remove(lock_path)
+
+
+def current_store(encoded_file_path, store_dir):
+    """
+    :return: the FilterStore at store_dir if it is built from the current encoded identifiers file, else None
+    """
+    try:
+        store = FilterStore(store_dir)
+    except FileNotFoundError:
+        # no store yet, or a stale store that is being replaced
+        return None
+    return store if store.is_current(encoded_file_path) else None
+
+
+def build_filter_store(encoded_file_path, store_dir=None):
+    """
+    Decode the encoded identifiers file once and save it as a filter store.
+    The store is written to a temporary directory first and then renamed, so other processes never see
+    a half written store. Builders of the same store take turns (store_lock), and a current store is never
+    replaced, so processes that are reading it are not disturbed. Only a stale store is moved aside and removed.
+    :param encoded_file_path: encoded identifiers file of a data holder, e.g. encoded_identifiers_A.zip
+    :param store_dir: directory of the store. Default is next to the encoded identifiers file
+    :return: store_dir
+    """
+    if store_dir is None:
+        store_dir = default_store_dir(encoded_file_path)
+    with store_lock(store_dir):
+        if current_store(encoded_file_path, store_dir) is None:
+            _build_and_install(encoded_file_path, store_dir)
+    return store_dir
+
+
+def _build_and_install(encoded_file_path, store_dir):
+    start_time = time.time()
+    source = file_signature(encoded_file_path)
+    df = pd.read_csv(encoded_file_path, index_col='index', dtype=str)
+
+    tmp_dir = f'{store_dir}.tmp-{uuid.uuid4().hex}'
+    os.makedirs(tmp_dir)
+    num_bits = {}
+    for field in df.columns:
+        packed = pack_bit_strings(df[field])
+        num_bits[field] = len(df[field].iloc[0]) if len(df) > 0 else 0
+        np.save(os.path.join(tmp_dir, f'{field}.npy'), packed)
+        np.save(os.path.join(tmp_dir, f'{field}_popcount.npy'), popcount_packed(packed))
+    np.save(os.path.join(tmp_dir, KEYS_FILE_NAME), df.index.to_numpy(dtype=object), allow_pickle=True)
+    with open(os.path.join(tmp_dir, META_FILE_NAME), 'w', encoding='utf-8') as meta_file:
+        json.dump({'fields': df.columns.tolist(), 'num_bits': num_bits, 'source': source}, meta_file)
+
+    stale_dir = None
+    if os.path.isdir(store_dir):
+        stale_dir = f'{store_dir}.stale-{uuid.uuid4().hex}'
+        os.replace(store_dir, stale_dir)
+    os.replace(tmp_dir, store_dir)
+    if stale_dir is not None:
+        shutil.rmtree(stale_dir, ignore_errors=True)
+    print(f'Filter store for {encoded_file_path} built at {store_dir} in {time.time() - start_time} seconds')
+
+
+def open_filter_store(encoded_file_path, store_dir=None):
+    """
+    Attach to the filter store of an encoded identifiers file. The store is built if it does not exist yet
+    or if the encoded identifiers file has changed since it was built.
+    :param encoded_file_path: encoded identifiers file of a data holder
+    :param store_dir: directory of the store. Default is next to the encoded identifiers file
+    :return: FilterStore
+    """
+    if store_dir is None:
+        store_dir = default_store_dir(encoded_file_path)
+    store = current_store(encoded_file_path, store_dir)
+    if store is not None:
+        return store
+    build_filter_store(encoded_file_path, store_dir)
+    return FilterStore(store_dir)
+
+
+def compare_with_stores(store_A, store_B, keys_A, keys_B, chunk_size=1000000):
+    """
+    Dice-coefficient of each field for each candidate link
+    :param store_A: FilterStore of data holder A
+    :param store_B: FilterStore of data holder B
+    :param keys_A: record indices in A of the candidate links
+    :param keys_B: record indices in B of the candidate links
+    :param chunk_size: number of links compared at once, bounds the memory of the gathered filters
+    :return: dict. keys are fields, values are numpy arrays of Dice-coefficients
+    """
+    positions_A = store_A.positions(keys_A)
+    positions_B = store_B.positions(keys_B)
+    fields = compared_fields(store_A, store_B)
+    for field in fields:
+        # e.g. one data holder folded or sampled its bloom filters and the other didn't
+        if store_A.num_bits[field] != store_B.num_bits[field]:
+            raise Exception(f'Bloom filters of field {field} have different lengths: {store_A.num_bits[field]} and '
+                            f'{store_B.num_bits[field]}. Both data holders must use the same BloomConfig')
+    similarities = {field: np.zeros(len(positions_A), dtype=np.float64) for field in fields}
+    for start in range(0, len(positions_A), chunk_size):
+        end = start + chunk_size
+        for field in fields:
+            packed_A, popcount_A = store_A.get_packed(field, positions_A[start:end])
+            packed_B, popcount_B = store_B.get_packed(field, positions_B[start:end])
+            similarities[field][start:end] = dice_coefficient_packed(packed_A, packed_B, popcount_A, popcount_B)
+    return similarities
+
+
+# Encoded identifiers published batch by batch, so classifier 2 can compare links before a data holder has
+# encoded all its candidate records.
+#
+# Layout of a batch directory:
+#   batch-{i:05d}.zip: encoded identifiers of batch i, same csv format as encoded_identifiers_{name}.zip
+#   DONE: number of batches, written after the last batch
+#   FAILED: error of the data holder, written instead of DONE if the encoding has failed
+
+DONE_FILE_NAME = 'DONE'
+FAILED_FILE_NAME = 'FAILED'
+
+
+class EncodedBatches:
+    """
+    Batch directory of the encoded identifiers of one data holder. Used by the data holder to publish the batches
+    and by classifier 2 to read the batches published so far.
+    """
+
+    def __init__(self, batch_dir):
+        self.batch_dir = batch_dir
+        self.num_published = 0
+        self.num_read = 0
+
+    def batch_path(self, batch):
+        return os.path.join(self.batch_dir, f'batch-{batch:05d}.zip')
+
+    def clear(self):
+        shutil.rmtree(self.batch_dir, ignore_errors=True)
+        os.makedirs(self.batch_dir)
+
+    def publish(self, df_encoded):
+        # written under a temporary name and renamed, so readers never see a half written batch
+        batch_path = self.batch_path(self.num_published)
+        df_encoded.to_csv(f'{batch_path}.tmp', index=False, compression='zip')
+        os.replace(f'{batch_path}.tmp', batch_path)
+        self.num_published += 1
+
+    def finish(self):
+        with open(os.path.join(self.batch_dir, f'{DONE_FILE_NAME}.tmp'), 'w', encoding='utf-8') as done_file:
+            done_file.write(str(self.num_published))
+        os.replace(os.path.join(self.batch_dir, f'{DONE_FILE_NAME}.tmp'), os.path.join(self.batch_dir, DONE_FILE_NAME))
+
+    def fail(self, error):
+        with open(os.path.join(self.batch_dir, f'{FAILED_FILE_NAME}.tmp'), 'w', encoding='utf-8') as failed_file:
+            failed_file.write(repr(error))
+        os.replace(os.path.join(self.batch_dir, f'{FAILED_FILE_NAME}.tmp'),
+                   os.path.join(self.batch_dir, FAILED_FILE_NAME))
+
+    def num_batches(self):
+        """
+        number of batches of the data holder, or None if it has not finished yet.
+        Raises an exception if the data holder has failed.
+        """
+        try:
+            with open(os.path.join(self.batch_dir, FAILED_FILE_NAME), 'r', encoding='utf-8') as failed_file:
+                raise Exception(f'Encoding of the batches at {self.batch_dir} has failed: {failed_file.read()}')
+        except FileNotFoundError:
+            pass
+        try:
+            with open(os.path.join(self.batch_dir, DONE_FILE_NAME), 'r', encoding='utf-8') as done_file:
+                return int(done_file.read())
+        except FileNotFoundError:
+            return None
+
+    def read_new(self):
+        """
+        the batches published since the last call, in order
+        :return: list of DataFrames
+        """
+        batches = []
+        while os.path.isfile(self.batch_path(self.num_read)):
+            batches.append(pd.read_csv(self.batch_path(self.num_read), dtype=str))
+            self.num_read += 1
+        return batches
+
+
+class IncrementalFilterStore:
+    """
+    Packed bloom filters of the encoded batches received so far, in order of arrival.
+    The arrays grow by doubling, so adding a batch does not copy all earlier batches.
+    """
+
+    def __init__(self):
+        self.fields = None
+        self.num_records = 0
+        self.keys = np.empty(0, dtype=object)
+        self.filters = {}
+        self.popcounts = {}
+
+    def _reserve(self, num_records):
+        capacity = len(self.keys)
+        if num_records <= capacity:
+            return
+        new_capacity = max(num_records, 2 * capacity, 1024)
+        self.keys = np.concatenate([self.keys, np.empty(new_capacity - capacity, dtype=object)])
+        for field in self.fields:
+            filters = self.filters[field]
+            self.filters[field] = np.concatenate(
+                [filters, np.zeros((new_capacity - capacity, filters.shape[1]), dtype=np.uint8)])
+            self.popcounts[field] = np.concatenate(
+                [self.popcounts[field], np.zeros(new_capacity - capacity, dtype=self.popcounts[field].dtype)])
+
+    def add_batch(self, df_encoded):
+        """
+        :param df_encoded: encoded identifiers of a batch, the 'index' column and one bit string column per field
+        :return: rows of the records of the batch in the store
+        """
+        packed_fields = {field: pack_bit_strings(df_encoded[field]) for field in df_encoded.columns[1:]}
+        if self.fields is None:
+            self.fields = df_encoded.columns[1:].tolist()
+            for field, packed in packed_fields.items():
+                self.filters[field] = np.zeros((0, packed.shape[1]), dtype=np.uint8)
+                self.popcounts[field] = np.zeros(0, dtype=popcount_packed(packed).dtype)
+        start = self.num_records
+        end = start + len(df_encoded)
+        self._reserve(end)
+        self.keys[start:end] = df_encoded['index'].to_numpy(dtype=object)
+        for field in self.fields:
+            self.filters[field][start:end] = packed_fields[field]
+            self.popcounts[field][start:end] = popcount_packed(packed_fields[field])
+        self.num_records = end
+        return np.arange(start, end)
+
+    def get_packed(self, field, rows):
+        return self.filters[field][rows], self.popcounts[field][rows]
+
+
+def compare_as_batches_arrive(keys_A, keys_B, batches_A, batches_B, poll_interval=0.1, timeout=None):
+    """
+    Compare the candidate links as soon as both of their records have arrived in the encoded batches.
+    :param keys_A: record indices in A of the candidate links
+    :param keys_B: record indices in B of the candidate links
+    :param batches_A: EncodedBatches of data holder A
+    :param batches_B: EncodedBatches of data holder B
+    :param poll_interval: seconds to wait for new batches
+    :param timeout: seconds without a new batch after which TimeoutError is raised, None waits forever
+    :return: iterator of (positions of the compared links in keys_A/keys_B, dict of Dice-coefficients per field)
+    """
+    keys_A = np.asarray(keys_A, dtype=object)
+    keys_B = np.asarray(keys_B, dtype=object)
+    link_codes_A, records_A = pd.factorize(keys_A)
+    link_codes_B, records_B = pd.factorize(keys_B)
+    record_index_A = pd.Index(records_A)
+    record_index_B = pd.Index(records_B)
+    # row in the incremental store of each record of the links, -1 until the record has arrived
+    rows_A = np.full(len(records_A), -1, dtype=np.int64)
+    rows_B = np.full(len(records_B), -1, dtype=np.int64)
+    store_A = IncrementalFilterStore()
+    store_B = IncrementalFilterStore()
+    pending = np.arange(len(link_codes_A))
+    last_batch_time = time.time()
+    while len(pending) > 0:
+        # check whether the data holders have finished (or failed) before reading, so no batch is missed
+        finished = batches_A.num_batches() is not None and batches_B.num_batches() is not None
+        for batches, store, record_index, rows in [(batches_A, store_A, record_index_A, rows_A),
+                                                   (batches_B, store_B, record_index_B, rows_B)]:
+            for df_encoded in batches.read_new():
+                last_batch_time = time.time()
+                batch_rows = store.add_batch(df_encoded)
+                positions = record_index.get_indexer(df_encoded['index'])
+                rows[positions[positions >= 0]] = batch_rows[positions >= 0]
+        ready = (rows_A[link_codes_A[pending]] >= 0) & (rows_B[link_codes_B[pending]] >= 0)
+        if ready.any():
+            compared = pending[ready]
+            pending = pending[~ready]
+            fields = compared_fields(store_A, store_B)
+            similarities = {}
+            for field in fields:
+                packed_A, popcount_A = store_A.get_packed(field, rows_A[link_codes_A[compared]])
+                packed_B, popcount_B = store_B.get_packed(field, rows_B[link_codes_B[compared]])
+                similarities[field] = dice_coefficient_packed(packed_A, packed_B, popcount_A, popcount_B)
+            yield compared, similarities
+        elif finished:
+            raise Exception(f'{len(pending)} candidate links have records that were never encoded, '
+                            f'e.g. {keys_A[pending[0]]} and {keys_B[pending[0]]}')
+        elif timeout is not None and time.time() - last_batch_time > timeout:
+            raise TimeoutError(f'No encoded batch for {timeout} seconds, {len(pending)} candidate links not compared')
+        else:
+            time.sleep(poll_interval)
@@ -0,0 +1,164 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import uuid
+import zipfile
+import numpy as np
+import pandas as pd
+
+# Partitioned binary store of candidate links, written by classifier 1 when the links do not fit in memory.
+# The linked class pairs are expanded in bounded batches, each batch is saved as one part file of integer record ids
+# (positions of the records in the anonymized data), so the links are never all in memory, neither when they are
+# written nor when classifier 2 reads them. The candidate record sets are accumulated as bitmaps over the record ids.
+#
+# Layout of a link store directory:
+#   meta.json: number of links, number of links of each part file
+#   records_A.npy, records_B.npy: record index (e.g. '1_a') of each record id
+#   part-{i:05d}.npy: record ids of the links of part i, shape (number of links, 2)
+#   candidates_A.npy, candidates_B.npy: packed bitmap of the candidate records over the record ids
+
+META_FILE_NAME = 'meta.json'
+
+
+def part_file_name(part):
+    return f'part-{part:05d}.npy'
+
+
+def write_link_store(class_pair_links, store_dir, chunk_size):
+    """
+    Expand the linked class pairs in batches of chunk_size links straight into the part files of a link store.
+    The store is written to a temporary directory first and then renamed, like the filter store.
+    :param class_pair_links: ClassPairLinks of the blocking
+    :param store_dir: directory of the link store
+    :param chunk_size: maximum number of links per part file
+    :return: store_dir
+    """
+    tmp_dir = f'{store_dir}.tmp-{uuid.uuid4().hex}'
+    os.makedirs(tmp_dir)
+    num_records_A = len(class_pair_links.records_A)
+    num_records_B = len(class_pair_links.records_B)
+    id_dtype = np.int32 if max(num_records_A, num_records_B) < 2 ** 31 else np.int64
+    candidates_A = np.zeros(num_records_A, dtype=bool)
+    candidates_B = np.zeros(num_records_B, dtype=bool)
+    part_sizes = []
+    for part, (ids_A, ids_B) in enumerate(class_pair_links.iter_position_chunks(chunk_size)):
+        np.save(os.path.join(tmp_dir, part_file_name(part)), np.column_stack([ids_A, ids_B]).astype(id_dtype))
+        candidates_A[ids_A] = True
+        candidates_B[ids_B] = True
+        part_sizes.append(len(ids_A))
+    np.save(os.path.join(tmp_dir, 'records_A.npy'), class_pair_links.records_A.astype(object), allow_pickle=True)
+    np.save(os.path.join(tmp_dir, 'records_B.npy'), class_pair_links.records_B.astype(object), allow_pickle=True)
+    np.save(os.path.join(tmp_dir, 'candidates_A.npy'), np.packbits(candidates_A))
+    np.save(os.path.join(tmp_dir, 'candidates_B.npy'), np.packbits(candidates_B))
+    with open(os.path.join(tmp_dir, META_FILE_NAME), 'w', encoding='utf-8') as meta_file:
+        json.dump({'num_links': int(sum(part_sizes)), 'part_sizes': part_sizes,
+                   'num_records_A': num_records_A, 'num_records_B': num_records_B}, meta_file)
+    if os.path.isdir(store_dir):
+        shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_dir, store_dir)
+    return store_dir
+
+
+def is_link_store(path):
+    return os.path.isfile(os.path.join(path, META_FILE_NAME))
+
+
+class LinkStore:
+    """
+    Candidate links of a link store, read part by part
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, META_FILE_NAME), 'r', encoding='utf-8') as meta_file:
+            self.meta = json.load(meta_file)
+        self.num_links = self.meta['num_links']
+        self.part_sizes = self.meta['part_sizes']
+        self.records_A = np.load(os.path.join(store_dir, 'records_A.npy'), allow_pickle=True)
+        self.records_B = np.load(os.path.join(store_dir, 'records_B.npy'), allow_pickle=True)
+
+    def __len__(self):
+        return self.num_links
+
+    def read_part(self, part):
+        """
+        record ids of the links of one part file
+        :return: (record ids in A, record ids in B)
+        """
+        ids = np.load(os.path.join(self.store_dir, part_file_name(part)), mmap_mode='r')
+        return np.asarray(ids[:, 0]), np.asarray(ids[:, 1])
+
+    def iter_chunks(self):
+        """
+        the candidate links part by part
+        :return: iterator of (record indices in A, record indices in B)
+        """
+        for part in range(len(self.part_sizes)):
+            ids_A, ids_B = self.read_part(part)
+            yield self.records_A[ids_A], self.records_B[ids_B]
+
+    def read_links(self, start, end):
+        """
+        the links start, ..., end - 1 as a data frame with the columns of candidate_links.zip, e.g. for previews
+        """
+        links_A = []
+        links_B = []
+        part_start = 0
+        for part, part_size in enumerate(self.part_sizes):
+            part_end = part_start + part_size
+            if part_end > start and part_start < end:
+                ids_A, ids_B = self.read_part(part)
+                selection = slice(max(start, part_start) - part_start, min(end, part_end) - part_start)
+                links_A.append(self.records_A[ids_A[selection]])
+                links_B.append(self.records_B[ids_B[selection]])
+            part_start = part_end
+        if len(links_A) == 0:
+            return pd.DataFrame({'index_A': [], 'index_B': []})
+        return pd.DataFrame({'index_A': np.concatenate(links_A), 'index_B': np.concatenate(links_B)})
+
+    def candidate_records(self, side):
+        """
+        record indices of the candidate records of A or B, from the bitmap
+        :param side: 'A' or 'B'
+        """
+        records = self.records_A if side == 'A' else self.records_B
+        bitmap = np.load(os.path.join(self.store_dir, f'candidates_{side}.npy'))
+        return records[np.unpackbits(bitmap, count=len(records)).astype(bool)]
+
+
+def iter_link_chunks(candidate_links_path, chunk_size=1000000):
+    """
+    candidate links of classifier 1 as an iterator of chunks, from a link store or from candidate_links.zip
+    :param candidate_links_path: link store directory or candidate links csv (also zipped)
+    :param chunk_size: number of links per chunk of the csv. A link store is read part by part.
+    :return: iterator of (record indices in A, record indices in B)
+    """
+    if os.path.isdir(candidate_links_path):
+        yield from LinkStore(candidate_links_path).iter_chunks()
+        return
+    for df_links in pd.read_csv(candidate_links_path, dtype=str, chunksize=chunk_size):
+        yield df_links.iloc[:, 0].values, df_links.iloc[:, 1].values
+
+
+def count_links(candidate_links_path, chunk_size=1000000):
+    """
+    number of candidate links, from the meta file of a link store or by counting the rows of candidate_links.zip
+    """
+    if os.path.isdir(candidate_links_path):
+        with open(os.path.join(candidate_links_path, META_FILE_NAME), 'r', encoding='utf-8') as meta_file:
+            return json.load(meta_file)['num_links']
+    return sum(len(df_links) for df_links in pd.read_csv(candidate_links_path, usecols=[0], dtype=str,
+                                                         chunksize=chunk_size))
+
+
+@contextlib.contextmanager
+def open_zip_csv(file_path, member_name):
+    """
+    text stream into a csv inside a new zip file, so a csv can be written chunk by chunk
+    """
+    with zipfile.ZipFile(file_path, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        with zip_file.open(member_name, 'w') as member:
+            with io.TextIOWrapper(member, encoding='utf-8', newline='') as csv_file:
+                yield csv_file
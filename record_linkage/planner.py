@@ -0,0 +1,115 @@
+import os
+
+# Planning step of classifier 1, before any candidate link is materialized.
+# The linked class pairs are known after blocking on the n/k classes. The exact number of candidate links is
+# the sum of the class size products of the linked pairs, so it is computed without expanding any pair.
+# From it the memory of the in-memory path and the runtime of classifier 2 are estimated,
+# and a strategy is picked: 'in_memory', 'chunked' (links spilled to disk in bounded batches)
+# or 'refuse' (with the advice to lower k or add quasi-identifiers: a larger k generalizes further, so the
+# equivalence classes get larger and more class pairs are compatible).
+
+# Default cost estimates, not exact figures. They were measured once on the sample datasets (k=5, 167757 candidate
+# links, 6 identifier fields) and depend on the machine, so plan_candidate_links takes them as parameters.
+BYTES_PER_LINK_IN_MEMORY = 140  # peak bytes per candidate link of block_data and the candidate links frame
+COMPARE_SECONDS_PER_LINK_FIELD = 4e-7  # Dice-coefficient of one field of one link with the filter stores
+WRITE_SECONDS_PER_LINK = 2e-5  # writing the compared link with its similarities
+# default limit of the estimated runtime of classifier 2 above which the plan is refused, a policy choice (one day)
+MAX_COMPARE_SECONDS = 86400
+
+STRATEGIES = ('in_memory', 'chunked', 'refuse')
+
+
+def available_memory_bytes(default=4 * 1024 ** 3):
+    """
+    available physical memory of the machine, or default if the platform does not tell
+    """
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, AttributeError, OSError):
+        return default
+
+
+class CandidatePlan:
+    """
+    exact candidate volume of the linked class pairs, the estimated cost and the chosen strategy
+    """
+
+    def __init__(self, num_class_pairs, num_links, num_candidate_records_A, num_candidate_records_B,
+                 max_pair_links, estimated_memory_bytes, estimated_compare_seconds, strategy, advice=''):
+        self.num_class_pairs = num_class_pairs
+        self.num_links = num_links
+        self.num_candidate_records_A = num_candidate_records_A
+        self.num_candidate_records_B = num_candidate_records_B
+        self.max_pair_links = max_pair_links  # links of the largest class pair
+        self.estimated_memory_bytes = estimated_memory_bytes
+        self.estimated_compare_seconds = estimated_compare_seconds
+        self.strategy = strategy
+        self.advice = advice
+
+    def summary(self):
+        return {'num_class_pairs': self.num_class_pairs,
+                'num_links': self.num_links,
+                'num_candidate_records_A': self.num_candidate_records_A,
+                'num_candidate_records_B': self.num_candidate_records_B,
+                'max_pair_links': self.max_pair_links,
+                'estimated_memory_bytes': self.estimated_memory_bytes,
+                'estimated_compare_seconds': self.estimated_compare_seconds,
+                'strategy': self.strategy,
+                'advice': self.advice}
+
+    def __repr__(self):
+        return (f'CandidatePlan(strategy={self.strategy}, links={self.num_links}, '
+                f'class_pairs={self.num_class_pairs}, '
+                f'memory={self.estimated_memory_bytes / 1024 ** 2:.1f} MiB, '
+                f'classifier2={self.estimated_compare_seconds:.1f} s)')
+
+
+def plan_candidate_links(class_pair_links, num_fields=6, memory_budget_bytes=None,
+                         max_compare_seconds=MAX_COMPARE_SECONDS, bytes_per_link=BYTES_PER_LINK_IN_MEMORY,
+                         compare_seconds_per_link_field=COMPARE_SECONDS_PER_LINK_FIELD,
+                         write_seconds_per_link=WRITE_SECONDS_PER_LINK):
+    """
+    count the candidate links of the linked class pairs exactly and pick a strategy.
+    The memory and the runtime are estimates from the per-link costs, which can be calibrated for the machine.
+    :param class_pair_links: ClassPairLinks of the blocking
+    :param num_fields: number of compared fields in classifier 2, 1 for the record-level bloom filter (clk)
+    :param memory_budget_bytes: memory for the in-memory path. Default is half of the available memory
+    :param max_compare_seconds: refuse if classifier 2 is estimated to run longer than this
+    :param bytes_per_link: estimated peak memory per candidate link of the in-memory path
+    :param compare_seconds_per_link_field: estimated time to compare one field of one link
+    :param write_seconds_per_link: estimated time to write one compared link
+    :return: CandidatePlan
+    """
+    if memory_budget_bytes is None:
+        memory_budget_bytes = available_memory_bytes() // 2
+    num_links = class_pair_links.num_links
+    links_per_pair = class_pair_links.links_per_pair
+    max_pair_links = int(links_per_pair.max()) if len(links_per_pair) > 0 else 0
+    estimated_memory_bytes = num_links * bytes_per_link
+    estimated_compare_seconds = num_links * (num_fields * compare_seconds_per_link_field + write_seconds_per_link)
+
+    advice = ''
+    if estimated_compare_seconds > max_compare_seconds:
+        strategy = 'refuse'
+        advice = (f'{num_links} candidate links would take classifier 2 an estimated {estimated_compare_seconds:.0f} '
+                  f'seconds (limit {max_compare_seconds} seconds). The largest class pair alone has {max_pair_links} '
+                  f'links. Lower k or add quasi-identifiers, so the equivalence classes are smaller.')
+    elif estimated_memory_bytes > memory_budget_bytes:
+        strategy = 'chunked'
+        advice = (f'about {estimated_memory_bytes / 1024 ** 2:.0f} MiB of candidate links exceed the memory budget of '
+                  f'{memory_budget_bytes / 1024 ** 2:.0f} MiB, the links are written to disk in chunks')
+    else:
+        strategy = 'in_memory'
+    return CandidatePlan(len(links_per_pair), num_links, class_pair_links.num_candidate_records_A,
+                         class_pair_links.num_candidate_records_B, max_pair_links, estimated_memory_bytes,
+                         estimated_compare_seconds, strategy, advice)
+
+
+def chunk_size_for_budget(memory_budget_bytes=None, max_chunk_links=5000000, bytes_per_link=BYTES_PER_LINK_IN_MEMORY):
+    """
+    number of links expanded at once in the chunked strategy
+    :param bytes_per_link: estimated peak memory per candidate link, see plan_candidate_links
+    """
+    if memory_budget_bytes is None:
+        memory_budget_bytes = available_memory_bytes() // 2
+    return int(max(1, min(max_chunk_links, memory_budget_bytes // (4 * bytes_per_link))))
@@ -0,0 +1,184 @@
+import numpy as np
+from record_linkage.bloom import dice_coefficient_packed, pack_bit_strings, popcount_packed
+
+# In-memory similarity index over the packed bloom filters of one data holder, for online queries.
+# Candidates are found with locality-sensitive hashing and then verified with the exact Dice-coefficient.
+#
+# Plain bit sampling does not separate bloom filters well: they are sparse, so most sampled positions are 0 in
+# every filter and the buckets become huge. The index therefore hashes the set bits: each record is the set of
+# positions of its set bits over all fields, and a MinHash signature of that set is split into bands.
+# Records that agree at all minimum hashes of at least one band are candidates. The probability that a pair
+# becomes a candidate is 1 - (1 - J^rows_per_band)^num_bands for the Jaccard similarity J = D / (2 - D)
+# of its Dice-coefficient D.
+# The search is approximate: a pair that agrees in no band is never compared. With the default 16 bands of
+# 4 rows, a pair with Dice-coefficient 0.8 (J = 0.67) is found with probability 1 - (1 - 0.67^4)^16, about 97%:
+# about 3% of the pairs at the default threshold are missed, more similar pairs less often. More bands or fewer rows per band raise the
+# recall at the cost of more candidates. ExactIndex compares every query with every record instead and finds
+# the same matches as Classifier2.compare_links for the same pairs.
+# A popcount filter drops candidates that cannot reach the threshold: Dice >= t needs
+# t / (2 - t) <= popcount_B / popcount_A <= (2 - t) / t at every field.
+
+
+def verify_candidates(store, fields, queries, rows, packed_fields, threshold):
+    """
+    exact Dice-coefficients of candidate pairs, the pairs above the threshold at every field are kept
+    :param queries: query position of each candidate pair
+    :param rows: record row in the store of each candidate pair
+    :param packed_fields: packed bloom filters of the queries, one uint8 matrix per field in the order of fields
+    :return: (query positions, record rows, dict of Dice-coefficients per field) of the matches
+    """
+    popcounts = [popcount_packed(packed) for packed in packed_fields]
+    # popcount filter, before the exact comparison
+    keep = np.ones(len(queries), dtype=bool)
+    low = threshold / (2 - threshold)
+    for field, popcount in zip(fields, popcounts):
+        ratio = (store.popcounts[field][rows] + 1e-9) / (popcount[queries] + 1e-9)
+        keep &= (ratio >= low) & (ratio <= 1 / low)
+    queries, rows = queries[keep], rows[keep]
+    similarities = {}
+    matched = np.ones(len(queries), dtype=bool)
+    for field, packed, popcount in zip(fields, packed_fields, popcounts):
+        packed_B, popcount_B = store.get_packed(field, rows)
+        similarities[field] = dice_coefficient_packed(packed[queries], packed_B, popcount[queries], popcount_B)
+        matched &= similarities[field] > threshold
+    return queries[matched], rows[matched], {field: values[matched] for field, values in similarities.items()}
+
+
+class MinHashIndex:
+    """
+    MinHash LSH index over the packed bloom filters of a FilterStore
+    """
+
+    def __init__(self, store, num_bands=16, rows_per_band=4, seed=0, chunk_size=1024):
+        """
+        :param store: FilterStore of the indexed data holder
+        :param num_bands: more bands find more candidates
+        :param rows_per_band: more rows per band find fewer, more similar candidates
+        :param seed: seed of the random permutations
+        :param chunk_size: number of records hashed at once when the index is built
+        """
+        self.store = store
+        self.fields = list(store.fields)
+        self.num_bands = num_bands
+        self.rows_per_band = rows_per_band
+        self.num_positions = sum(store.num_bits[field] for field in self.fields)
+        if self.num_positions ** rows_per_band >= 2 ** 63:
+            raise Exception(f'{rows_per_band} rows per band of {self.num_positions} positions overflow the band keys')
+        rng = np.random.default_rng(seed)
+        # rank of each bit position in each random permutation
+        self.ranks = np.stack([rng.permutation(self.num_positions).astype(np.int32)
+                               for _ in range(num_bands * rows_per_band)])
+        signatures = np.concatenate([self.signatures(self._packed_rows(np.arange(start, min(start + chunk_size,
+                                                                                             len(store)))))
+                                     for start in range(0, len(store), chunk_size)] or
+                                    [np.zeros((0, num_bands * rows_per_band), dtype=np.int64)])
+        band_keys = self.band_keys(signatures)
+        # per band: the band keys of the records in sorted order, and the records in that order
+        self.orders = [np.argsort(band_keys[:, band], kind='stable') for band in range(num_bands)]
+        self.sorted_keys = [band_keys[order, band] for band, order in enumerate(self.orders)]
+
+    def _packed_rows(self, rows):
+        return [self.store.filters[field][rows] for field in self.fields]
+
+    def signatures(self, packed_fields):
+        """
+        MinHash signatures of packed bloom filters
+        :param packed_fields: list of uint8 matrices, one per field in the order of self.fields
+        :return: int64 matrix of shape (number of records, num_bands * rows_per_band)
+        """
+        bits = np.concatenate([np.unpackbits(packed, axis=1, count=self.store.num_bits[field]).astype(bool)
+                               for field, packed in zip(self.fields, packed_fields)], axis=1)
+        # minimum rank over the set bits of each record, for all permutations at once
+        rows, positions = np.nonzero(bits)
+        signatures = np.full((len(bits), len(self.ranks)), self.num_positions, dtype=np.int64)
+        if len(rows) > 0:
+            nonempty, starts = np.unique(rows, return_index=True)
+            # an empty filter keeps the rank num_positions, it only collides with other empty filters
+            signatures[nonempty] = np.minimum.reduceat(self.ranks[:, positions], starts, axis=1).T
+        return signatures
+
+    def band_keys(self, signatures):
+        weights = (self.num_positions + 1) ** np.arange(self.rows_per_band, dtype=np.int64)
+        bands = signatures.reshape(len(signatures), self.num_bands, self.rows_per_band)
+        return (bands * weights).sum(axis=2)
+
+    def candidates(self, packed_fields):
+        """
+        candidate records of each query
+        :param packed_fields: packed bloom filters of the queries, one uint8 matrix per field
+        :return: (query positions, record rows) of the candidate pairs, without duplicates
+        """
+        band_keys = self.band_keys(self.signatures(packed_fields))
+        queries = []
+        rows = []
+        for band in range(self.num_bands):
+            left = np.searchsorted(self.sorted_keys[band], band_keys[:, band], side='left')
+            right = np.searchsorted(self.sorted_keys[band], band_keys[:, band], side='right')
+            counts = right - left
+            query_positions = np.repeat(np.arange(len(band_keys)), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            queries.append(query_positions)
+            rows.append(self.orders[band][np.repeat(left, counts) + offsets])
+        if len(queries) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        pairs = np.unique(np.stack([np.concatenate(queries), np.concatenate(rows)]), axis=1)
+        return pairs[0], pairs[1]
+
+    def search(self, packed_fields, threshold=0.8):
+        """
+        records with Dice-coefficient > threshold at every field, for a batch of queries
+        :param packed_fields: packed bloom filters of the queries, one uint8 matrix per field
+        :return: (query positions, record rows, dict of Dice-coefficients per field) of the matches
+        """
+        queries, rows = self.candidates(packed_fields)
+        return verify_candidates(self.store, self.fields, queries, rows, packed_fields, threshold)
+
+    def pack_queries(self, encoded_records):
+        """
+        :param encoded_records: list of dicts. keys are fields, values are bit strings
+        :return: packed bloom filters of the queries, one uint8 matrix per field
+        """
+        return [pack_bit_strings([record[field] for record in encoded_records]) for field in self.fields]
+
+
+class ExactIndex:
+    """
+    Compares every query with every record of a FilterStore. Slower than MinHashIndex, but finds all matches
+    """
+
+    def __init__(self, store, chunk_size=1000000):
+        """
+        :param store: FilterStore of the indexed data holder
+        :param chunk_size: number of (query, record) pairs compared at once
+        """
+        self.store = store
+        self.fields = list(store.fields)
+        self.chunk_size = chunk_size
+
+    def search(self, packed_fields, threshold=0.8):
+        """
+        records with Dice-coefficient > threshold at every field, for a batch of queries
+        :param packed_fields: packed bloom filters of the queries, one uint8 matrix per field
+        :return: (query positions, record rows, dict of Dice-coefficients per field) of the matches
+        """
+        num_queries = len(packed_fields[0]) if packed_fields else 0
+        rows_per_chunk = max(self.chunk_size // max(num_queries, 1), 1)
+        results = []
+        for start in range(0, len(self.store), rows_per_chunk):
+            rows = np.arange(start, min(start + rows_per_chunk, len(self.store)))
+            results.append(verify_candidates(self.store, self.fields, np.repeat(np.arange(num_queries), len(rows)),
+                                             np.tile(rows, num_queries), packed_fields, threshold))
+        if not results:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                    {field: np.zeros(0, dtype=np.float64) for field in self.fields})
+        return (np.concatenate([queries for queries, _, _ in results]),
+                np.concatenate([rows for _, rows, _ in results]),
+                {field: np.concatenate([similarities[field] for _, _, similarities in results])
+                 for field in self.fields})
+
+    def pack_queries(self, encoded_records):
+        """
+        :param encoded_records: list of dicts. keys are fields, values are bit strings
+        :return: packed bloom filters of the queries, one uint8 matrix per field
+        """
+        return [pack_bit_strings([record[field] for record in encoded_records]) for field in self.fields]
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+# Content-addressed cache of the artifacts of the protocol steps.
+# A step (e.g. the anonymization of a data holder) is keyed by the sha256 of its name, the contents of its input
+# files and its parameters. The output files of a computed step are copied into the cache under that key.
+# When the same step runs again with unchanged inputs and parameters, the outputs are restored from the cache
+# instead of being recomputed, so a rerun of run/main.py or of an evaluation sweep only recomputes the steps whose
+# inputs have changed.
+#
+# Layout of the cache directory:
+#   hashes.json: content hash of each input file by (path, size, modification time), so files are hashed once
+#   {key[:2]}/{key}/meta.json: step, output file names and size of the entry. The parameters are only part of the key,
+#       they are never written to the cache, e.g. the secret key of the bloom filter encoder
+#   {key[:2]}/{key}/{i}-{file name}: output file i of the step
+# The least recently used entries are evicted when the cache is larger than max_size_bytes.
+
+META_FILE_NAME = 'meta.json'
+HASHES_FILE_NAME = 'hashes.json'
+
+
+def hash_file(file_path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        while True:
+            block = file.read(block_size)
+            if not block:
+                return digest.hexdigest()
+            digest.update(block)
+
+
+class ArtifactCache:
+    """
+    Cache of step outputs keyed by the hash of the step inputs and parameters, with size-based eviction
+    """
+
+    def __init__(self, cache_dir, max_size_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _read_hashes(self):
+        try:
+            with open(os.path.join(self.cache_dir, HASHES_FILE_NAME), 'r', encoding='utf-8') as hashes_file:
+                return json.load(hashes_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_hashes(self, hashes):
+        tmp_path = os.path.join(self.cache_dir, f'{HASHES_FILE_NAME}.tmp-{uuid.uuid4().hex}')
+        with open(tmp_path, 'w', encoding='utf-8') as hashes_file:
+            json.dump(hashes, hashes_file)
+        os.replace(tmp_path, os.path.join(self.cache_dir, HASHES_FILE_NAME))
+
+    def content_hash(self, file_path):
+        """
+        sha256 of the contents of a file. Directories (e.g. the hierarchy files) are hashed file by file.
+        The hash is only computed again if the size or the modification time of the file has changed.
+        """
+        if os.path.isdir(file_path):
+            digest = hashlib.sha256()
+            for name in sorted(os.listdir(file_path)):
+                digest.update(name.encode('utf-8'))
+                digest.update(self.content_hash(os.path.join(file_path, name)).encode('utf-8'))
+            return digest.hexdigest()
+        stat = os.stat(file_path)
+        signature = f'{stat.st_size}:{stat.st_mtime_ns}'
+        hashes = self._read_hashes()
+        cached = hashes.get(os.path.abspath(file_path))
+        if cached is not None and cached['signature'] == signature:
+            return cached['sha256']
+        sha256 = hash_file(file_path)
+        hashes[os.path.abspath(file_path)] = {'signature': signature, 'sha256': sha256}
+        self._write_hashes(hashes)
+        return sha256
+
+    def key(self, step, input_paths, params):
+        """
+        :param step: name of the step, e.g. 'anonymize'
+        :param input_paths: input files (or directories) of the step
+        :param params: json serializable parameters of the step
+        :return: hex digest
+        """
+        description = {'step': step, 'inputs': [self.content_hash(path) for path in input_paths], 'params': params}
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def fetch(self, key, output_paths):
+        """
+        restore the outputs of a cached step at output_paths
+        :return: True if the step was in the cache
+        """
+        entry_dir = self.entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, META_FILE_NAME), 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            self.misses += 1
+            return False
+        if len(meta['files']) != len(output_paths):
+            self.misses += 1
+            return False
+        # all files are copied before any output is replaced. An entry that another process evicts or replaces
+        # meanwhile is a cache miss, and the outputs are left as they were
+        tmp_paths = [f'{output_path}.tmp-{uuid.uuid4().hex}' for output_path in output_paths]
+        try:
+            for file_name, tmp_path in zip(meta['files'], tmp_paths):
+                shutil.copyfile(os.path.join(entry_dir, file_name), tmp_path)
+            # the modification time of meta.json is the last use of the entry, for the eviction
+            os.utime(os.path.join(entry_dir, META_FILE_NAME))
+        except FileNotFoundError:
+            for tmp_path in tmp_paths:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self.misses += 1
+            return False
+        for tmp_path, output_path in zip(tmp_paths, output_paths):
+            os.replace(tmp_path, output_path)
+        self.hits += 1
+        return True
+
+    def store(self, key, output_paths, step=None):
+        """
+        copy the outputs of a computed step into the cache. The entry is written to a temporary directory first
+        and then renamed, so other processes never see a half written entry.
+        """
+        entry_dir = self.entry_dir(key)
+        tmp_dir = f'{entry_dir}.tmp-{uuid.uuid4().hex}'
+        os.makedirs(tmp_dir)
+        files = [f'{i}-{os.path.basename(path)}' for i, path in enumerate(output_paths)]
+        size = 0
+        for file_name, output_path in zip(files, output_paths):
+            shutil.copyfile(output_path, os.path.join(tmp_dir, file_name))
+            size += os.path.getsize(output_path)
+        with open(os.path.join(tmp_dir, META_FILE_NAME), 'w', encoding='utf-8') as meta_file:
+            json.dump({'step': step, 'files': files, 'size': size, 'created': time.time()}, meta_file)
+        if os.path.isdir(entry_dir):
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # another process has stored the same step at the same time
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """
+        :return: list of (last use, size, entry directory)
+        """
+        entries = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                meta_path = os.path.join(prefix_dir, key, META_FILE_NAME)
+                try:
+                    with open(meta_path, 'r', encoding='utf-8') as meta_file:
+                        size = json.load(meta_file)['size']
+                    entries.append((os.path.getmtime(meta_path), size, os.path.join(prefix_dir, key)))
+                except (OSError, ValueError, KeyError):
+                    continue  # an entry that is being written or removed
+        return entries
+
+    def size_bytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        remove the least recently used entries until the cache fits in max_size_bytes
+        """
+        entries = sorted(self.entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
+            print(f'Evicted {entry_dir} from the artifact cache ({size} bytes)')
+
+    def run_step(self, step, input_paths, params, output_paths, compute):
+        """
+        restore the outputs of a step from the cache, or compute them and cache them
+        :param compute: function without arguments that writes output_paths
+        :return: True if the outputs were restored from the cache
+        """
+        key = self.key(step, input_paths, params)
+        if self.fetch(key, output_paths):
+            print(f'Step {step} restored from the artifact cache ({key[:12]})')
+            return True
+        compute()
+        self.store(key, output_paths, step)
+        return False
@@ -0,0 +1,317 @@
+import argparse
+
+# Slim command line entry point for each participant role of the protocol.
+# Run from the root directory of the project, e.g.
+#   python -m run.cli holder-anonymize --name A --data dataset/dataset_A/dataset_A.csv --out-dir dataset/dataset_A/
+#   python -m run.cli classifier1 --anonymized-a ... --anonymized-b ... --out-dir dataset/classifier_data/
+#   python -m run.cli holder-encode --name A --data dataset/dataset_A/dataset_A.csv --out-dir dataset/dataset_A/
+#   python -m run.cli classifier2 --encoded-a ... --encoded-b ... --links ... --compared ... --matched ...
+#   python -m run.cli classifier1-multi --anonymized A=... --anonymized B=... --anonymized C=... --out-dir ...
+#   python -m run.cli classifier2-multi --encoded A=... --encoded B=... --links A:B=... --out-dir ...
+#   python -m run.cli classifier2-serve --encoded-b ... --port 8080
+# Over the network (run.transport), each participant on its own machine:
+#   python -m run.cli classifier2-net --listen 0.0.0.0:9002 --out-dir dataset/classifier2_data/
+#   python -m run.cli classifier1-net --listen 0.0.0.0:9001 --holder A=hostA:9010 --holder B=hostB:9010 \
+#       --classifier2 host2:9002 --out-dir dataset/classifier_data/
+#   python -m run.cli holder-anonymize --name A ... --send-to host1:9001
+#   python -m run.cli holder-encode --name A ... --listen 0.0.0.0:9010 --send-to host2:9002
+# Only argparse is imported here. Each role imports its own dependencies when it runs,
+# so e.g. holder-encode never loads recordlinkage or matplotlib.
+
+QUASI_IDENTIFIERS = ['sex', 'age', 'race', 'marital-status', 'education', 'native-country', 'workclass', 'occupation']
+SENSITIVE_ATTRIBUTES = ['salary-class']
+IDENTIFIER = ['given_name', 'surname', 'street_number', 'address_1', 'address_2', 'suburb', 'postcode', 'state',
+              'soc_sec_id']
+
+
+def build_data_holder(args):
+    from run import participant
+    bloom_config = None
+    if hasattr(args, 'hash_family'):
+        from record_linkage.bloom import BloomConfig
+        bloom_config = BloomConfig(size=args.num_bits, num_hash=args.num_hash, ngram_size=args.ngram_size,
+                                   hash_family=args.hash_family, fold=args.fold, sample_size=args.sample_size)
+    artifact_cache = None
+    if args.cache_dir is not None:
+        from run.artifact_cache import ArtifactCache
+        artifact_cache = ArtifactCache(args.cache_dir, args.cache_size_mb * 1024 ** 2)
+    encoding_cache = None
+    if getattr(args, 'encoding_cache_size', 0) > 0:
+        from record_linkage.bloom import EncodingCache
+        encoding_cache = EncodingCache(args.encoding_cache_size)
+    return participant.DataHolder(args.name, args.data, args.out_dir, args.hierarchy,
+                                  QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTES, IDENTIFIER, k=args.k,
+                                  encoding_mode=getattr(args, 'encoding', 'field'), bloom_config=bloom_config,
+                                  n_jobs=getattr(args, 'n_jobs', 1),
+                                  publish_class_table=getattr(args, 'publish_class_table', False),
+                                  artifact_cache=artifact_cache, encoding_cache=encoding_cache)
+
+
+def parse_address(value):
+    """
+    'HOST:PORT' -> ('HOST', PORT)
+    """
+    host, port = value.rsplit(':', 1)
+    return host, int(port)
+
+
+def run_holder_anonymize(args):
+    data_holder = build_data_holder(args)
+    if args.send_to:
+        data_holder.send_anonymized_data_to(parse_address(args.send_to))
+        return
+    print(data_holder.send_anonymized_data())
+
+
+def run_holder_encode(args):
+    data_holder = build_data_holder(args)
+    if args.send_to:
+        if args.listen:
+            from run.transport import ArtifactServer
+            with ArtifactServer(*parse_address(args.listen)) as server:
+                data_holder.receive_candidate_records(server, args.timeout)
+        data_holder.stream_encoded_batches_to(parse_address(args.send_to), args.batch_size)
+        return
+    print(data_holder.send_encode_identifiers_in_bloom_filter())
+
+
+def run_classifier1(args):
+    from run import participant
+    classifier1 = participant.Classifier1(args.anonymized_a, args.anonymized_b, args.out_dir, args.hierarchy,
+                                          QUASI_IDENTIFIERS, class_table_path_A=args.class_table_a,
+                                          class_table_path_B=args.class_table_b, blocking_mode=args.blocking_mode,
+                                          memory_budget_bytes=(None if args.memory_budget_mb is None
+                                                               else args.memory_budget_mb * 1024 ** 2))
+    if args.plan:
+        print(classifier1.plan_candidate_links().summary())
+        return
+    for path in classifier1.send_candidate_links():
+        print(path)
+
+
+def run_classifier1_net(args):
+    from run import participant
+    from run.transport import ArtifactServer
+    holder_addresses = {name: parse_address(address) for name, address in parse_named_paths(args.holder).items()}
+    with ArtifactServer(*parse_address(args.listen)) as server:
+        classifier1 = participant.Classifier1.receive_anonymized_data(
+            server, args.out_dir, num_holders=len(holder_addresses), timeout=args.timeout,
+            hierarchy_file_dir_path=args.hierarchy, qs_list=QUASI_IDENTIFIERS, blocking_mode=args.blocking_mode)
+    for path in classifier1.send_candidate_links_to(parse_address(args.classifier2), holder_addresses):
+        print(path)
+
+
+def run_classifier2_net(args):
+    from run import participant
+    from run.transport import ArtifactServer
+    classifier2 = participant.Classifier2(None, None, None, f'{args.out_dir}compared_links.zip',
+                                          f'{args.out_dir}matched_links.csv', threshold=args.threshold)
+    with ArtifactServer(*parse_address(args.listen)) as server:
+        classifier2.receive_candidate_links(server, args.timeout)
+        classifier2.compare_links_from_streams(server, args.timeout)
+    print(classifier2.identify_record_linkage())
+
+
+def run_classifier2(args):
+    from run import participant
+    # without --encoded-b the encoded identifiers of A are compared with themselves (deduplication)
+    classifier2 = participant.Classifier2(args.encoded_a, args.encoded_b or args.encoded_a, args.links, args.compared,
+                                          args.matched, threshold=args.threshold)
+    classifier2.compare_links()
+    print(classifier2.identify_record_linkage())
+    if args.clusters:
+        print(classifier2.identify_duplicate_clusters(args.clusters))
+
+
+def parse_named_paths(values):
+    """
+    ['A=path', ...] -> {'A': 'path', ...}. Names of holder pairs are 'A:B' -> ('A', 'B')
+    """
+    named_paths = {}
+    for value in values or []:
+        name, path = value.split('=', 1)
+        named_paths[tuple(name.split(':')) if ':' in name else name] = path
+    return named_paths
+
+
+def run_classifier1_multi(args):
+    from run import participant
+    classifier1 = participant.MultiPartyClassifier1(parse_named_paths(args.anonymized), args.out_dir, args.hierarchy,
+                                                    QUASI_IDENTIFIERS,
+                                                    class_table_paths=parse_named_paths(args.class_table),
+                                                    blocking_mode=args.blocking_mode)
+    candidate_links_file_paths, candidate_records_index_file_paths = classifier1.send_candidate_links()
+    for (name_A, name_B), path in candidate_links_file_paths.items():
+        print(f'{name_A}:{name_B}={path}')
+
+
+def run_classifier2_multi(args):
+    from run import participant
+    classifier2 = participant.MultiPartyClassifier2(parse_named_paths(args.encoded), parse_named_paths(args.links),
+                                                    args.out_dir, threshold=args.threshold)
+    for (name_A, name_B), path in classifier2.identify_record_linkage().items():
+        print(f'{name_A}:{name_B}={path}')
+
+
+def run_classifier2_serve(args):
+    import time
+    from run import service
+    linkage_service = service.LinkageService(args.encoded_b, threshold=args.threshold,
+                                             anonymized_data_path_B=args.anonymized_b,
+                                             class_table_path_B=args.class_table_b,
+                                             hierarchy_file_dir_path=args.hierarchy, qi_list=QUASI_IDENTIFIERS,
+                                             num_bands=args.num_bands, rows_per_band=args.rows_per_band,
+                                             exact=args.exact)
+    server = service.serve(linkage_service, args.host, args.port, args.max_batch_size, args.max_wait_ms / 1000)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Participants of the privacy-preserving record linkage protocol')
+    subparsers = parser.add_subparsers(dest='role', required=True)
+
+    for role, func, help_text in [('holder-anonymize', run_holder_anonymize,
+                                   'data holder: anonymize the original dataset for classifier 1'),
+                                  ('holder-encode', run_holder_encode,
+                                   'data holder: encode the identifiers of the candidate records for classifier 2')]:
+        holder_parser = subparsers.add_parser(role, help=help_text)
+        holder_parser.add_argument('--name', required=True, help='name of the data holder, e.g. A')
+        holder_parser.add_argument('--data', required=True, help='original dataset of the data holder')
+        holder_parser.add_argument('--out-dir', required=True, help='directory of the data holder, ends with /')
+        holder_parser.add_argument('--hierarchy', default='dataset/hierarchy/')
+        holder_parser.add_argument('--k', type=int, default=5)
+        holder_parser.add_argument('--cache-dir', help='artifact cache, steps with unchanged inputs are not recomputed')
+        holder_parser.add_argument('--cache-size-mb', type=int, default=2048)
+        holder_parser.add_argument('--timeout', type=float, help='seconds to wait for an incoming artifact')
+        if role == 'holder-anonymize':
+            holder_parser.add_argument('--n-jobs', type=int, default=1, help='number of cores for anonymization')
+            holder_parser.add_argument('--publish-class-table', action='store_true',
+                                       help='also publish the class table and a class_id column for classifier 1')
+            holder_parser.add_argument('--send-to', help='HOST:PORT of classifier1-net, send the anonymized data '
+                                                         'over the network')
+        if role == 'holder-encode':
+            holder_parser.add_argument('--encoding', choices=['field', 'clk'], default='field')
+            holder_parser.add_argument('--num-bits', type=int, default=500)
+            holder_parser.add_argument('--num-hash', type=int, default=10)
+            holder_parser.add_argument('--ngram-size', type=int, default=2)
+            holder_parser.add_argument('--hash-family', choices=['hmac', 'blake2b'], default='hmac')
+            holder_parser.add_argument('--fold', type=int, default=0,
+                                       help='XOR-fold the bloom filters in half this many times')
+            holder_parser.add_argument('--sample-size', type=int, default=None,
+                                       help='keep this many bits of each (folded) bloom filter, by keyed sampling')
+            holder_parser.add_argument('--encoding-cache-size', type=int, default=0,
+                                       help='number of bloom filters kept in an LRU cache shared by all columns and '
+                                            'batches, 0 disables it')
+            holder_parser.add_argument('--listen', help='HOST:PORT to receive the candidate records from '
+                                                        'classifier1-net, requires --send-to')
+            holder_parser.add_argument('--send-to', help='HOST:PORT of classifier2-net, stream the encoded batches '
+                                                         'over the network')
+            holder_parser.add_argument('--batch-size', type=int, default=500, help='number of records per batch')
+        holder_parser.set_defaults(func=func)
+
+    classifier1_parser = subparsers.add_parser('classifier1', help='classifier 1: find candidate links')
+    classifier1_parser.add_argument('--anonymized-a', required=True)
+    classifier1_parser.add_argument('--anonymized-b', help='without dataset B, dataset A is deduplicated')
+    classifier1_parser.add_argument('--out-dir', required=True, help='directory of classifier 1, ends with /')
+    classifier1_parser.add_argument('--hierarchy', default='dataset/hierarchy/')
+    classifier1_parser.add_argument('--class-table-a', help='class table published by data holder A')
+    classifier1_parser.add_argument('--class-table-b', help='class table published by data holder B')
+    classifier1_parser.add_argument('--blocking-mode', choices=['matrix', 'pairwise'], default='matrix')
+    classifier1_parser.add_argument('--memory-budget-mb', type=int,
+                                    help='memory for the candidate links, default is half of the free memory')
+    classifier1_parser.add_argument('--plan', action='store_true',
+                                    help='dry run: only count the candidate links and print the plan')
+    classifier1_parser.set_defaults(func=run_classifier1)
+
+    classifier2_parser = subparsers.add_parser('classifier2', help='classifier 2: identify record linkages')
+    classifier2_parser.add_argument('--encoded-a', required=True)
+    classifier2_parser.add_argument('--encoded-b', help='without data holder B, data holder A is deduplicated')
+    classifier2_parser.add_argument('--links', required=True, help='candidate links of classifier 1')
+    classifier2_parser.add_argument('--compared', required=True, help='output file of all compared links')
+    classifier2_parser.add_argument('--matched', required=True, help='output file of the matched links')
+    classifier2_parser.add_argument('--threshold', type=float, default=0.8)
+    classifier2_parser.add_argument('--clusters', help='output file of the clusters of duplicate records (deduplication)')
+    classifier2_parser.set_defaults(func=run_classifier2)
+
+    net1_parser = subparsers.add_parser('classifier1-net',
+                                        help='classifier 1 over the network: receive the anonymized data, send the '
+                                             'candidate links and candidate records')
+    net1_parser.add_argument('--listen', required=True, help='HOST:PORT for the data holders')
+    net1_parser.add_argument('--holder', action='append', required=True,
+                             help='NAME=HOST:PORT where a data holder receives its candidate records, once per holder')
+    net1_parser.add_argument('--classifier2', required=True, help='HOST:PORT of classifier2-net')
+    net1_parser.add_argument('--out-dir', required=True, help='directory of classifier 1, ends with /')
+    net1_parser.add_argument('--hierarchy', default='dataset/hierarchy/')
+    net1_parser.add_argument('--blocking-mode', choices=['matrix', 'pairwise'], default='matrix')
+    net1_parser.add_argument('--timeout', type=float, help='seconds to wait for an incoming artifact')
+    net1_parser.set_defaults(func=run_classifier1_net)
+
+    net2_parser = subparsers.add_parser('classifier2-net',
+                                        help='classifier 2 over the network: receive the candidate links and the '
+                                             'encoded batches, identify record linkages')
+    net2_parser.add_argument('--listen', required=True, help='HOST:PORT for classifier 1 and the data holders')
+    net2_parser.add_argument('--out-dir', required=True, help='directory of classifier 2, ends with /')
+    net2_parser.add_argument('--threshold', type=float, default=0.8)
+    net2_parser.add_argument('--timeout', type=float, help='seconds to wait for an incoming artifact')
+    net2_parser.set_defaults(func=run_classifier2_net)
+
+    multi1_parser = subparsers.add_parser('classifier1-multi',
+                                          help='classifier 1: candidate links for every pair of N data holders')
+    multi1_parser.add_argument('--anonymized', action='append', required=True,
+                               help='NAME=PATH of the anonymized data of a data holder, once per holder')
+    multi1_parser.add_argument('--class-table', action='append', help='NAME=PATH of a published class table')
+    multi1_parser.add_argument('--out-dir', required=True, help='directory of classifier 1, ends with /')
+    multi1_parser.add_argument('--hierarchy', default='dataset/hierarchy/')
+    multi1_parser.add_argument('--blocking-mode', choices=['matrix', 'pairwise'], default='matrix')
+    multi1_parser.set_defaults(func=run_classifier1_multi)
+
+    multi2_parser = subparsers.add_parser('classifier2-multi',
+                                          help='classifier 2: identify record linkages of every pair of N data holders')
+    multi2_parser.add_argument('--encoded', action='append', required=True,
+                               help='NAME=PATH of the encoded identifiers of a data holder, once per holder')
+    multi2_parser.add_argument('--links', action='append', required=True,
+                               help='NAME:NAME=PATH of the candidate links of a holder pair, as printed by classifier1-multi')
+    multi2_parser.add_argument('--out-dir', required=True, help='directory of classifier 2, ends with /')
+    multi2_parser.add_argument('--threshold', type=float, default=0.8)
+    multi2_parser.set_defaults(func=run_classifier2_multi)
+
+    serve_parser = subparsers.add_parser('classifier2-serve',
+                                         help='classifier 2: answer single-record match queries against data holder B')
+    serve_parser.add_argument('--encoded-b', required=True)
+    serve_parser.add_argument('--anonymized-b', help='anonymized data of B with class ids, to block the queries')
+    serve_parser.add_argument('--class-table-b', help='class table published by data holder B')
+    serve_parser.add_argument('--hierarchy', default='dataset/hierarchy/')
+    serve_parser.add_argument('--threshold', type=float, default=0.8)
+    serve_parser.add_argument('--num-bands', type=int, default=16,
+                              help='bands of the MinHash index. The default 16 bands of 4 rows find about 97%% of the '
+                                   'pairs with Dice-coefficient 0.8, more bands find more')
+    serve_parser.add_argument('--rows-per-band', type=int, default=4,
+                              help='rows per band of the MinHash index, fewer rows find more')
+    serve_parser.add_argument('--exact', action='store_true',
+                              help='compare every query with every record of B instead of the approximate MinHash '
+                                   'index. Finds the same matches as classifier2')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8080)
+    serve_parser.add_argument('--max-batch-size', type=int, default=64, help='1 disables request batching')
+    serve_parser.add_argument('--max-wait-ms', type=float, default=2.0,
+                              help='how long a batch waits for more queries')
+    serve_parser.set_defaults(func=run_classifier2_serve)
+    return parser
+
+
+def parse_args(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    # the received candidate records are only encoded for classifier2-net
+    if args.role == 'holder-encode' and args.listen and not args.send_to:
+        parser.error('holder-encode: --listen requires --send-to')
+    return args
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    arguments.func(arguments)
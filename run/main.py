@@ -4,6 +4,13 @@ if __name__ == '__main__':
 
     k = 5
     threshold = 0.8
+    # run independent participants at the same time, and compare links while the data holders are still encoding
+    pipelined = False
+    # run each participant behind its own network socket and send every artifact over run.transport
+    transport = False
+    # directory of an artifact cache, e.g. '../dataset/artifact_cache/'. Reruns then restore the anonymized data and
+    # the encoded identifiers from the cache if their inputs have not changed. None disables the cache
+    artifact_cache_dir = None
 
     # prepare dataset
     date_file_path_A = '../dataset/dataset_A/dataset_A.csv'
@@ -24,13 +31,39 @@ if __name__ == '__main__':
     sensitive_attributes = ['salary-class']
     identifier = ['given_name', 'surname', 'street_number', 'address_1', 'address_2', 'suburb', 'postcode', 'state', 'soc_sec_id']
 
+    if pipelined or transport:
+        import orchestrator
+        holder_kwargs = dict(hierarchy_file_dir_path=hierarchy_file_dir_path, quasi_identifiers=quasi_identifiers,
+                             sensitive_attributes=sensitive_attributes, identifier=identifier, k=k)
+        run_protocol = orchestrator.run_protocol_over_transport if transport else orchestrator.run_protocol
+        matched_links_file_path = run_protocol(
+            dict(holder_name='A', original_data_path=date_file_path_A,
+                 anonymized_data_dir_path=anonymized_file_dir_path_A, **holder_kwargs),
+            dict(holder_name='B', original_data_path=date_file_path_B,
+                 anonymized_data_dir_path=anonymized_file_dir_path_B, **holder_kwargs),
+            dict(classifier_data_dir_path=classifier_data_dir_path, hierarchy_file_dir_path=hierarchy_file_dir_path,
+                 qs_list=quasi_identifiers),
+            dict(encoded_identifiers_file_path_A=encoded_identifiers_file_path_A,
+                 encoded_identifiers_file_path_B=encoded_identifiers_file_path_B,
+                 compared_links_file_path=compared_links_file_path, matched_links_file_path=matched_links_file_path,
+                 threshold=threshold))
+        print(f'Matched links saved at {matched_links_file_path}')
+        raise SystemExit(0)
+
+    artifact_cache = None
+    if artifact_cache_dir is not None:
+        from artifact_cache import ArtifactCache
+        artifact_cache = ArtifactCache(artifact_cache_dir)
+
     # initialize two data holders
     data_holder_A = participant.DataHolder('A',
                                            date_file_path_A, anonymized_file_dir_path_A, hierarchy_file_dir_path,
-                                           quasi_identifiers, sensitive_attributes, identifier, k=k)
+                                           quasi_identifiers, sensitive_attributes, identifier, k=k,
+                                           artifact_cache=artifact_cache)
     data_holder_B = participant.DataHolder('B',
                                            date_file_path_B, anonymized_file_dir_path_B, hierarchy_file_dir_path,
-                                           quasi_identifiers, sensitive_attributes, identifier, k=k)
+                                           quasi_identifiers, sensitive_attributes, identifier, k=k,
+                                           artifact_cache=artifact_cache)
 
     # Two data holders anonymize their data. Remove sensitive attributes and identifiers.
     # Then send anonymized data to classifier1
@@ -40,7 +73,8 @@ if __name__ == '__main__':
 
     # Classifier1 receives anonymized data from two data holders, and find candidate links
     # Then send candidate records back to data holders
-    classifier1 = participant.Classifier1(anonymized_data_no_sa_ident_path_A, anonymized_data_no_sa_ident_path_B, classifier_data_dir_path, hierarchy_file_dir_path, quasi_identifiers)
+    classifier1 = participant.Classifier1(anonymized_data_no_sa_ident_path_A, anonymized_data_no_sa_ident_path_B, classifier_data_dir_path, hierarchy_file_dir_path, quasi_identifiers,
+                                          data_holder_A.equivalence_classes, data_holder_B.equivalence_classes)
     candidate_links_path, candidate_record_set_path_A, candidate_record_set_path_B = classifier1.send_candidate_links()
     print("=====================================")
 
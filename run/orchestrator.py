@@ -0,0 +1,256 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# Pipelined execution of the three-party protocol.
+# The protocol is a DAG of participant steps. Each step runs in its own process as soon as its dependencies are done,
+# so the independent data holders anonymize and encode at the same time. Classifier 2 does not wait for the
+# encoding to finish: the data holders publish their encoded identifiers batch by batch, and classifier 2 compares
+# each candidate link as soon as both of its records have arrived.
+#
+#   anonymize_A ---+                 +--- encode_A ---+
+#                  +--- classifier1 -+                +~~~ classifier2 (compares while the batches arrive)
+#   anonymize_B ---+                 +--- encode_B ---+
+#
+# run_protocol_over_transport runs the same protocol with every artifact sent over run.transport instead of the
+# shared file system, as with the participants on separate machines (see also the *-net roles of run.cli).
+
+
+def terminate_executor(executor, futures):
+    """
+    cancel the futures that have not started and terminate the worker processes of the running ones
+    """
+    for future in futures:
+        future.cancel()
+    processes = list((executor._processes or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join()
+
+
+class ProtocolDAG:
+    """
+    Steps with dependencies. The result of each dependency is passed to the step function, after its own arguments.
+    """
+
+    def __init__(self):
+        self.steps = {}  # keys are step names, values are (function, arguments, dependencies)
+        self.start_times = {}
+        self.end_times = {}
+
+    def add_step(self, name, func, args=(), dependencies=()):
+        for dependency in dependencies:
+            if dependency not in self.steps:
+                raise Exception(f'Step {name} depends on unknown step {dependency}')
+        self.steps[name] = (func, args, tuple(dependencies))
+
+    def run(self, max_workers=None):
+        """
+        run each step in a worker process as soon as all its dependencies are done
+        :param max_workers: number of worker processes. Default is the number of steps
+        :return: dict. keys are step names, values are the results of the steps
+        """
+        results = {}
+        running = {}  # future -> step name
+        waiting = dict(self.steps)
+        start_time = time.time()
+        executor = ProcessPoolExecutor(max_workers=max_workers or len(self.steps))
+        try:
+            while waiting or running:
+                for name, (func, args, dependencies) in list(waiting.items()):
+                    if all(dependency in results for dependency in dependencies):
+                        self.start_times[name] = time.time() - start_time
+                        future = executor.submit(func, *args, *[results[dependency] for dependency in dependencies])
+                        running[future] = name
+                        del waiting[name]
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        print(f'Step {name} failed after {time.time() - start_time:.2f} seconds: '
+                              f'{future.exception()!r}')
+                    # raises the exception of the step, if any
+                    results[name] = future.result()
+                    self.end_times[name] = time.time() - start_time
+                    print(f'Step {name} done after {self.end_times[name]:.2f} seconds')
+        except BaseException:
+            # a failed step: the running steps may wait for its outputs forever (e.g. classifier 2 for the batches
+            # of a data holder), so they are stopped instead of waited for
+            terminate_executor(executor, running)
+            raise
+        executor.shutdown()
+        return results
+
+    def durations(self):
+        return {name: self.end_times[name] - self.start_times[name] for name in self.end_times}
+
+    def critical_path_seconds(self):
+        """
+        longest chain of step durations through the DAG, the lower bound of the end-to-end latency
+        """
+        durations = self.durations()
+        finish = {}
+        for name in self.steps:  # steps are added after their dependencies
+            dependencies = self.steps[name][2]
+            finish[name] = durations.get(name, 0.0) + max([finish[dependency] for dependency in dependencies],
+                                                           default=0.0)
+        return max(finish.values(), default=0.0)
+
+    def report(self):
+        durations = self.durations()
+        for name, duration in durations.items():
+            print(f'{name}: {self.start_times[name]:.2f} - {self.end_times[name]:.2f} seconds ({duration:.2f} seconds)')
+        print(f'End-to-end: {max(self.end_times.values(), default=0.0):.2f} seconds, '
+              f'sum of all steps: {sum(durations.values()):.2f} seconds, '
+              f'critical path: {self.critical_path_seconds():.2f} seconds')
+
+
+def anonymize_step(holder_kwargs):
+    from run import participant
+    data_holder = participant.DataHolder(**holder_kwargs)
+    anonymized_data_path = data_holder.send_anonymized_data()
+    return anonymized_data_path, data_holder.equivalence_classes
+
+
+def classifier1_step(classifier1_kwargs, anonymized_A, anonymized_B):
+    from run import participant
+    classifier1 = participant.Classifier1(anonymized_A[0], anonymized_B[0], classes_A=anonymized_A[1],
+                                          classes_B=anonymized_B[1], **classifier1_kwargs)
+    return classifier1.send_candidate_links()
+
+
+def encode_step(holder_kwargs, batch_size, candidate_links):
+    from run import participant
+    data_holder = participant.DataHolder(**holder_kwargs)
+    # classifier 1 has saved the candidate records of the data holder at its candidate records index file
+    if os.path.abspath(data_holder.candidate_records_index_file_path) not in map(os.path.abspath, candidate_links[1:]):
+        raise Exception(f'No candidate records for dataholder {data_holder.holder_name} '
+                        f'at {data_holder.candidate_records_index_file_path}')
+    return data_holder.send_encoded_batches(batch_size)
+
+
+def classifier2_step(classifier2_kwargs, encoded_batch_dir_A, encoded_batch_dir_B, batch_timeout, candidate_links):
+    from run import participant
+    classifier2 = participant.Classifier2(candidate_links_file_path=candidate_links[0], **classifier2_kwargs)
+    classifier2.compare_links_as_batches_arrive(encoded_batch_dir_A, encoded_batch_dir_B, timeout=batch_timeout)
+    return classifier2.identify_record_linkage()
+
+
+def run_protocol(holder_kwargs_A, holder_kwargs_B, classifier1_kwargs, classifier2_kwargs, batch_size=500,
+                 batch_timeout=None):
+    """
+    Run the whole protocol as a DAG of processes.
+    :param holder_kwargs_A: arguments of DataHolder A
+    :param holder_kwargs_B: arguments of DataHolder B
+    :param classifier1_kwargs: arguments of Classifier1, except the anonymized data and the classes
+    :param classifier2_kwargs: arguments of Classifier2, except the encoded identifiers and the candidate links
+    :param batch_size: number of records per encoded batch
+    :param batch_timeout: seconds classifier 2 waits for a new encoded batch before it gives up, None waits forever
+    :return: path of the matched links
+    """
+    from run import participant
+    from record_linkage.filter_store import EncodedBatches
+    # the batch directories are known in advance, so classifier 2 can watch them while the data holders encode.
+    # Batches of an earlier run are removed first, classifier 2 must not read them.
+    batch_dir_A = participant.DataHolder(**holder_kwargs_A).encoded_batch_dir_path
+    batch_dir_B = participant.DataHolder(**holder_kwargs_B).encoded_batch_dir_path
+    EncodedBatches(batch_dir_A).clear()
+    EncodedBatches(batch_dir_B).clear()
+
+    dag = ProtocolDAG()
+    dag.add_step('anonymize_A', anonymize_step, (holder_kwargs_A,))
+    dag.add_step('anonymize_B', anonymize_step, (holder_kwargs_B,))
+    dag.add_step('classifier1', classifier1_step, (classifier1_kwargs,), ['anonymize_A', 'anonymize_B'])
+    dag.add_step('encode_A', encode_step, (holder_kwargs_A, batch_size), ['classifier1'])
+    dag.add_step('encode_B', encode_step, (holder_kwargs_B, batch_size), ['classifier1'])
+    # classifier 2 only depends on classifier 1. It reads the encoded batches while encode_A and encode_B run.
+    dag.add_step('classifier2', classifier2_step, (classifier2_kwargs, batch_dir_A, batch_dir_B, batch_timeout),
+                 ['classifier1'])
+    results = dag.run()
+    dag.report()
+    return results['classifier2']
+
+
+def holder_over_transport(holder_kwargs, server, classifier1_address, classifier2_address, batch_size, timeout):
+    from run import participant
+    data_holder = participant.DataHolder(**holder_kwargs)
+    data_holder.send_anonymized_data_to(classifier1_address)
+    data_holder.receive_candidate_records(server, timeout)
+    return data_holder.stream_encoded_batches_to(classifier2_address, batch_size)
+
+
+def classifier1_over_transport(classifier1_kwargs, server, classifier2_address, holder_addresses, timeout):
+    from run import participant
+    classifier1 = participant.Classifier1.receive_anonymized_data(server, num_holders=len(holder_addresses),
+                                                                  timeout=timeout, **classifier1_kwargs)
+    return classifier1.send_candidate_links_to(classifier2_address, holder_addresses)
+
+
+def classifier2_over_transport(classifier2_kwargs, server, timeout):
+    from run import participant
+    classifier2 = participant.Classifier2(candidate_links_file_path=None, **classifier2_kwargs)
+    classifier2.receive_candidate_links(server, timeout)
+    classifier2.compare_links_from_streams(server, timeout)
+    return classifier2.identify_record_linkage()
+
+
+def run_protocol_over_transport(holder_kwargs_A, holder_kwargs_B, classifier1_kwargs, classifier2_kwargs,
+                                batch_size=500, timeout=600, host='127.0.0.1'):
+    """
+    Run the whole protocol with every artifact sent over the network (run.transport): each participant listens on
+    its own ArtifactServer and runs in its own thread, as it would on its own machine.
+    :param holder_kwargs_A: arguments of DataHolder A
+    :param holder_kwargs_B: arguments of DataHolder B
+    :param classifier1_kwargs: arguments of Classifier1, except the anonymized data and the classes
+    :param classifier2_kwargs: arguments of Classifier2, except the candidate links
+    :param batch_size: number of records per encoded batch
+    :param timeout: seconds each participant waits for an incoming artifact
+    :return: path of the matched links
+    """
+    import threading
+    from run.transport import ArtifactServer
+    servers = {name: ArtifactServer(host) for name in ['classifier1', 'classifier2', 'A', 'B']}
+    holder_addresses = {holder_kwargs['holder_name']: servers[name].address
+                        for name, holder_kwargs in [('A', holder_kwargs_A), ('B', holder_kwargs_B)]}
+    steps = {
+        'A': (holder_over_transport, (holder_kwargs_A, servers['A'], servers['classifier1'].address,
+                                      servers['classifier2'].address, batch_size, timeout)),
+        'B': (holder_over_transport, (holder_kwargs_B, servers['B'], servers['classifier1'].address,
+                                      servers['classifier2'].address, batch_size, timeout)),
+        'classifier1': (classifier1_over_transport, (classifier1_kwargs, servers['classifier1'],
+                                                     servers['classifier2'].address, holder_addresses, timeout)),
+        'classifier2': (classifier2_over_transport, (classifier2_kwargs, servers['classifier2'], timeout)),
+    }
+    results = {}
+    errors = []
+    done = threading.Condition()
+
+    def run_step(name, fn, args):
+        try:
+            result = fn(*args)
+        except BaseException as error:
+            result = error
+            errors.append((name, error))
+        with done:
+            results[name] = result
+            done.notify()
+
+    # daemon threads: a participant blocked on the network must not keep the process alive after a failure
+    threads = [threading.Thread(target=run_step, args=(name, fn, args), name=name, daemon=True)
+               for name, (fn, args) in steps.items()]
+    try:
+        for thread in threads:
+            thread.start()
+        with done:
+            done.wait_for(lambda: errors or len(results) == len(steps))
+        if errors:
+            name, error = errors[0]
+            print(f'Participant {name} failed: {error!r}')
+            raise error
+    finally:
+        for server in servers.values():
+            server.close()
+    return results['classifier2']
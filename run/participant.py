@@ -1,29 +1,68 @@
-import csv
 import os
-import numpy as np
-import pandas as pd
-import recordlinkage
-from recordlinkage.base import BaseCompareFeature
-from k_anonymize import mondrian
-from record_linkage.block_links import block_data
-from record_linkage.bloom import encode_bloom
+
+# Heavy dependencies (pandas, numpy, recordlinkage, the anonymizer and the blocking code) are imported
+# inside the methods that use them, so each participant only loads what its own protocol steps need.
+# e.g. a data holder that only encodes its identifiers never loads recordlinkage or matplotlib.
+
+# number of hash functions per identifier field in the record-level bloom filter (CLK).
+# names are more discriminating than address parts, so they get more hash functions.
+CLK_NUM_HASH_DICT = {'given_name': 10, 'surname': 10, 'address_1_num': 5, 'address_2': 5, 'suburb': 5,
+                     'state_postcode': 5}
+# columns of the original dataset read to encode the identifiers
+IDENTIFIER_FIELDS = ['index', 'given_name', 'surname', 'street_number', 'address_1', 'address_2', 'suburb', 'postcode',
+                     'state']
 
 
 class DataHolder:
     def __init__(self, holder_name, original_data_path, anonymized_data_dir_path, hierarchy_file_dir_path,
-                 quasi_identifiers, sensitive_attributes, identifier, k=5):
+                 quasi_identifiers, sensitive_attributes, identifier, k=5, encoding_mode='field', clk_size=1000,
+                 clk_num_hash_dict=None, bloom_config=None, n_jobs=1, publish_class_table=False, artifact_cache=None,
+                 encoding_cache=None):
         self.holder_name = holder_name
         self.original_data_path = original_data_path
         self.anonymized_data_dir_path = anonymized_data_dir_path
         self.anonymized_data_path = f'{self.anonymized_data_dir_path}k_{k}_anonymized_dataset_{self.holder_name}.csv'
         self.anonymized_data_no_sa_ident_path = f'{self.anonymized_data_dir_path}k_{k}_anonymized_dataset_{self.holder_name}_no_sa_ident.csv'
+        self.class_table_path = f'{self.anonymized_data_dir_path}k_{k}_class_table_{self.holder_name}.csv'
         self.candidate_records_index_file_path = f'{self.anonymized_data_dir_path}candidate_records_index_{self.holder_name}.csv'
         self.encoded_identifiers_file_path = f'{self.anonymized_data_dir_path}encoded_identifiers_{self.holder_name}.zip'
+        self.encoded_batch_dir_path = f'{self.anonymized_data_dir_path}encoded_batches_{self.holder_name}'
         self.hierarchy_file_dir_path = hierarchy_file_dir_path
         self.quasi_identifiers = quasi_identifiers
         self.sensitive_attributes = sensitive_attributes
         self.identifier = identifier
         self.k = k
+        # 'field': one bloom filter per identifier field. 'clk': one record-level bloom filter for all fields.
+        if encoding_mode not in ('field', 'clk'):
+            raise Exception(f"Unknown encoding mode {encoding_mode}. Use 'field' or 'clk'")
+        self.encoding_mode = encoding_mode
+        self.clk_size = clk_size
+        self.clk_num_hash_dict = clk_num_hash_dict if clk_num_hash_dict is not None else CLK_NUM_HASH_DICT
+        # ngram size, filter length, number of hash functions and hash family of the bloom filter encoder
+        if bloom_config is None:
+            from record_linkage.bloom import BloomConfig
+            bloom_config = BloomConfig(size=500, num_hash=10)
+        self.bloom_config = bloom_config
+        self.n_jobs = n_jobs  # number of cores for anonymization, see mondrian.mondrian_parallel
+        self.equivalence_classes = None  # EquivalenceClasses of the anonymized data, emitted by the anonymizer
+        # publish a class table and a per-record class_id column with the anonymized data,
+        # so classifier 1 can block on n/k classes without grouping the records again
+        self.publish_class_table = publish_class_table
+        # run.artifact_cache.ArtifactCache (optional). Steps with unchanged inputs and parameters are restored from it.
+        self.artifact_cache = artifact_cache
+        # record_linkage.bloom.EncodingCache (optional). Bloom filters of values seen before, also in earlier batches
+        # or other columns, are taken from it instead of being encoded again.
+        self.encoding_cache = encoding_cache
+
+    def run_cached_step(self, step, input_paths, params, output_paths, compute):
+        """
+        run compute, or restore its output files from the artifact cache if the step has run before with the same
+        input file contents and parameters
+        """
+        if self.artifact_cache is None:
+            compute()
+            return False
+        return self.artifact_cache.run_step(step, input_paths, params, output_paths, compute)
 
     def get_original_data(self):
         return self.original_data_path
@@ -34,92 +73,431 @@ class DataHolder:
     def get_anonymized_data_no_sa_ident(self):
         return self.anonymized_data_no_sa_ident_path
 
+    def get_class_table_path(self):
+        return self.class_table_path if self.publish_class_table else None
+
     def get_encoded_identifiers_file_path(self):
         return self.encoded_identifiers_file_path
 
     def anonymize_data_and_save(self):
+        from k_anonymize import mondrian
         print(f'Anonymizing data for dataholder {self.holder_name}...')
-        df = mondrian.run_anonymize(self.quasi_identifiers, self.sensitive_attributes, self.identifier,
-                                    self.original_data_path, self.hierarchy_file_dir_path, self.k)
+        df, self.equivalence_classes = mondrian.run_anonymize(self.quasi_identifiers, self.sensitive_attributes,
+                                                              self.identifier, self.original_data_path,
+                                                              self.hierarchy_file_dir_path, self.k, self.n_jobs,
+                                                              return_classes=True)
         df.to_csv(self.anonymized_data_path, index=False)
+        print(f'Equivalence classes of dataholder {self.holder_name}: {self.equivalence_classes.summary()}')
         print(f'Anonymize data for dataholder {self.holder_name} successfully! Saved at {self.anonymized_data_path}')
 
     def remove_sensitive_attributes_and_identifiers(self):
-        df = pd.read_csv(self.anonymized_data_path)
+        from helper.dataset_reader import read_holder_dataset
+        df = read_holder_dataset(self.anonymized_data_path)
         df.drop(columns=self.identifier, inplace=True)
         df.drop(columns=self.sensitive_attributes, inplace=True)
         df.drop(columns=['ID'], inplace=True)
+        if self.publish_class_table and self.equivalence_classes is not None:
+            from k_anonymize.equivalence_class import CLASS_ID_COLUMN
+            # the rows are in the same order as the anonymized data the classes were computed on
+            df.insert(1, CLASS_ID_COLUMN, self.equivalence_classes.class_ids)
+            self.equivalence_classes.class_table(df).to_csv(self.class_table_path, index=False)
+            print(f'Class table for dataholder {self.holder_name} saved at {self.class_table_path}')
         df.to_csv(self.anonymized_data_no_sa_ident_path, index=False)
         print(f'Remove sensitive attributes and identifiers for dataholder {self.holder_name} successfully! '
               f'Saved at {self.anonymized_data_no_sa_ident_path}')
 
-    def send_anonymized_data(self):
-        self.anonymize_data_and_save()
-        self.remove_sensitive_attributes_and_identifiers()
+    def send_anonymized_data(self, progress=None):
+        """
+        anonymize the original data. With an artifact cache, equivalence_classes stays None if the anonymized data is
+        restored from the cache. Classifier 1 then groups the records again, or reads the class table if published.
+        :param progress: progress(fraction) is called after each phase of the computation, e.g. by the GUI
+        """
+        def compute():
+            self.anonymize_data_and_save()
+            if progress is not None:
+                progress(0.8)
+            self.remove_sensitive_attributes_and_identifiers()
+        output_paths = [self.anonymized_data_path, self.anonymized_data_no_sa_ident_path]
+        if self.publish_class_table:
+            output_paths.append(self.class_table_path)
+        # n_jobs only changes the speed: mondrian.run_anonymize gives the same result for any number of cores
+        params = {'k': self.k, 'quasi_identifiers': self.quasi_identifiers,
+                  'sensitive_attributes': self.sensitive_attributes, 'identifier': self.identifier,
+                  'publish_class_table': self.publish_class_table}
+        self.run_cached_step('anonymize', [self.original_data_path, self.hierarchy_file_dir_path], params,
+                             output_paths, compute)
         return self.anonymized_data_no_sa_ident_path
 
-    def send_encode_identifiers_in_bloom_filter(self):
+    def prepare_identifiers(self):
+        """
+        identifier fields of the candidate records, before encoding
+        """
+        import pandas as pd
+        from helper.dataset_reader import read_holder_dataset
         df_r_index = pd.read_csv(self.candidate_records_index_file_path, header=None, names=['index'])
-        df_dataset = pd.read_csv(self.original_data_path)
+        df_dataset = read_holder_dataset(self.original_data_path, columns=IDENTIFIER_FIELDS)
         # find the intersection of df_r_index and df_dataset using index
         df_merge = pd.merge(df_r_index, df_dataset, on='index', how='left')
-        df_merge = df_merge[['index', 'given_name', 'surname', 'street_number', 'address_1', 'address_2', 'suburb', 'postcode', 'state']]
+        df_merge = df_merge[IDENTIFIER_FIELDS]
         df_merge['address_1_num'] = df_merge['address_1'] + df_merge['street_number'].astype(str)
         df_merge['state_postcode'] = df_merge['state'] + df_merge['postcode'].astype(str)
         df_merge = df_merge.drop(['street_number', 'address_1', 'postcode', 'state'], axis=1)
+        # a missing Arrow string is <NA> and astype(str) turns it into '<NA>', a missing Python string into 'nan'.
+        # Missing values are filled after the concatenation (a missing part still makes the whole value missing),
+        # so the encodings are the same with and without pyarrow
+        string_columns = df_merge.select_dtypes('string').columns
+        df_merge[string_columns] = df_merge[string_columns].fillna('nan')
+        return df_merge
 
-        # encode identifiers into bloom filters
-        for i, col in enumerate(df_merge.columns[1:]):
-            df_merge[col] = df_merge[col].astype(str).apply(lambda x: encode_bloom(x, 500, 10))
-            # print(f'Encoding {i}th column {col} successfully!')
-        # save encoded identifiers to compressed csv file using zip
-        df_merge.to_csv(self.encoded_identifiers_file_path, index=False, compression='zip')
-        print(f'Encode identifiers for dataholder {self.holder_name} successfully! Saved at {self.encoded_identifiers_file_path}')
+    def encode_identifiers(self, df_merge):
+        """
+        encode identifiers into bloom filters
+        :param df_merge: identifier fields of candidate records, from prepare_identifiers
+        :return: DataFrame with the index and one bit string per field (or a single 'clk' column)
+        """
+        from record_linkage.bloom import encode_bloom_column, encode_clk
+        df_merge = df_merge.copy()
+        if self.encoding_mode == 'clk':
+            # all identifier fields of a record are hashed into one record-level bloom filter
+            identifier_cols = df_merge.columns[1:]
+            df_identifiers = df_merge[identifier_cols].astype(str)
+            df_merge = df_merge[['index']].copy()
+            records = list(df_identifiers.itertuples(index=False, name=None))
+            # duplicated records are encoded once
+            clks = {values: encode_clk(dict(zip(identifier_cols, values)), self.clk_size, self.clk_num_hash_dict,
+                                       config=self.bloom_config)
+                    for values in dict.fromkeys(records)}
+            df_merge['clk'] = [clks[values] for values in records]
+        else:
+            for i, col in enumerate(df_merge.columns[1:]):
+                # only the distinct values of the column are encoded
+                df_merge[col] = encode_bloom_column(df_merge[col].astype(str), self.bloom_config, self.encoding_cache)
+                # print(f'Encoding {i}th column {col} successfully!')
+        return df_merge
+
+    def send_encode_identifiers_in_bloom_filter(self, progress=None, batch_size=50000):
+        """
+        :param progress: progress(fraction) is called after each encoded batch, e.g. by the GUI
+        :param batch_size: number of records encoded at once
+        """
+        def compute():
+            import pandas as pd
+            df_merge = self.prepare_identifiers()
+            encoded_batches = []
+            for start in range(0, len(df_merge), batch_size):
+                encoded_batches.append(self.encode_identifiers(df_merge.iloc[start:start + batch_size]))
+                if progress is not None:
+                    progress(min(start + batch_size, len(df_merge)) / len(df_merge))
+            df_merge = pd.concat(encoded_batches) if encoded_batches else self.encode_identifiers(df_merge)
+            # save encoded identifiers to compressed csv file using zip
+            df_merge.to_csv(self.encoded_identifiers_file_path, index=False, compression='zip')
+            print(f'Encode identifiers for dataholder {self.holder_name} successfully! Saved at {self.encoded_identifiers_file_path}')
+        # only the digest of the secret key is part of the parameters, the key itself never reaches the cache
+        params = {'encoding_mode': self.encoding_mode, 'clk_size': self.clk_size,
+                  'clk_num_hash_dict': self.clk_num_hash_dict, 'bloom_config': self.bloom_config.public_params()}
+        self.run_cached_step('encode', [self.original_data_path, self.candidate_records_index_file_path], params,
+                             [self.encoded_identifiers_file_path], compute)
         return self.encoded_identifiers_file_path
 
+    def send_encoded_batches(self, batch_size=500):
+        """
+        Encode the identifiers batch by batch and publish each batch as soon as it is encoded,
+        so classifier 2 can start comparing before all records are encoded.
+        Each batch is a zipped csv like encoded_identifiers_{name}.zip, see record_linkage.filter_store.EncodedBatches
+        :param batch_size: number of records per batch
+        :return: directory of the batches
+        """
+        from record_linkage.filter_store import EncodedBatches
+        batches = EncodedBatches(self.encoded_batch_dir_path)
+        batches.clear()
+        try:
+            df_merge = self.prepare_identifiers()
+            for start in range(0, len(df_merge), batch_size):
+                batches.publish(self.encode_identifiers(df_merge.iloc[start:start + batch_size]))
+        except BaseException as error:
+            # classifier 2 stops waiting for the batches of a failed data holder
+            batches.fail(error)
+            raise
+        batches.finish()
+        print(f'Encode identifiers for dataholder {self.holder_name} in {batches.num_published} batches successfully! '
+              f'Saved at {self.encoded_batch_dir_path}')
+        return self.encoded_batch_dir_path
+
+    def send_anonymized_data_to(self, address):
+        """
+        anonymize and stream the anonymized data (and the class table, if published) to classifier 1 over the
+        network, see run.transport and Classifier1.receive_anonymized_data
+        :param address: (host, port) of the ArtifactServer of classifier 1
+        """
+        from run.transport import send_file
+        send_file(address, f'anonymized_data_{self.holder_name}', self.send_anonymized_data(),
+                  meta={'holder': self.holder_name, 'class_table': self.publish_class_table})
+        if self.publish_class_table:
+            send_file(address, f'class_table_{self.holder_name}', self.class_table_path,
+                      meta={'holder': self.holder_name})
+
+    def receive_candidate_records(self, server, timeout=None):
+        """
+        receive the candidate records index sent by classifier 1 (Classifier1.send_candidate_links_to)
+        :param server: run.transport.ArtifactServer of the data holder
+        :param timeout: seconds to wait for classifier 1 to connect
+        :return: candidate records index file of the data holder
+        """
+        stream = server.accept(timeout)
+        if stream.meta.get('holder') != self.holder_name:
+            raise Exception(f'Dataholder {self.holder_name} received {stream.name} of dataholder '
+                            f'{stream.meta.get("holder")}')
+        stream.save(self.candidate_records_index_file_path)
+        print(f'Candidate records for dataholder {self.holder_name} received at '
+              f'{self.candidate_records_index_file_path}')
+        return self.candidate_records_index_file_path
+
+    def stream_encoded_batches_to(self, address, batch_size=500):
+        """
+        Encode the identifiers batch by batch and stream each batch to classifier 2 as soon as it is encoded
+        :param address: (host, port) of the ArtifactServer of classifier 2
+        :param batch_size: number of records per batch
+        :return: (number of batches, bytes before compression, bytes sent)
+        """
+        from run.transport import send_artifact
+        df_merge = self.prepare_identifiers()
+        batches = (self.encode_identifiers(df_merge.iloc[start:start + batch_size]).to_csv(index=False).encode('utf-8')
+                   for start in range(0, len(df_merge), batch_size))
+        result = send_artifact(address, f'encoded_identifiers_{self.holder_name}', batches,
+                               meta={'holder': self.holder_name})
+        print(f'Encoded identifiers of dataholder {self.holder_name} streamed to {address}: {result[0]} batches, '
+              f'{result[1]} bytes, {result[2]} bytes compressed')
+        return result
+
 
 class Classifier1:
-    def __init__(self, anonymized_data_path_A, anonymized_data_path_B, classifier_data_dir_path, hierarchy_file_dir_path, qs_list):
+    def __init__(self, anonymized_data_path_A, anonymized_data_path_B, classifier_data_dir_path, hierarchy_file_dir_path, qs_list,
+                 classes_A=None, classes_B=None, class_table_path_A=None, class_table_path_B=None,
+                 blocking_mode='matrix', memory_budget_bytes=None):
         self.anonymized_data_path_A = anonymized_data_path_A
         self.anonymized_data_path_B = anonymized_data_path_B
         self.classifier_data_dir_path = classifier_data_dir_path
         self.hierarchy_file_dir_path = hierarchy_file_dir_path
         self.qs_list = qs_list
+        # equivalence classes emitted by the anonymizers of the data holders, so they are not grouped again
+        self.classes_A = classes_A
+        self.classes_B = classes_B
+        # class tables published by the data holders. Blocking then reads only the class ids of the records.
+        self.class_table_path_A = class_table_path_A
+        self.class_table_path_B = class_table_path_B
+        self.blocking_mode = blocking_mode  # 'matrix' or 'pairwise'
+        # memory for the candidate links. More links are written to disk in chunks. Default is half of the free memory
+        self.memory_budget_bytes = memory_budget_bytes
+        # without dataset B, dataset A is deduplicated: only the pairs of records i < j of A are candidate links
+        self.dedup = anonymized_data_path_B is None
+        # names of the data holders A and B, if their data was received over the network
+        self.holder_names = None
 
-    def send_candidate_links(self):
-        (candidate_links,
-         candidate_record_set_A,
-         candidate_record_set_B) = block_data(self.anonymized_data_path_A,
-                                              self.anonymized_data_path_B,
+    @classmethod
+    def receive_anonymized_data(cls, server, classifier_data_dir_path, num_holders=2, timeout=None, **kwargs):
+        """
+        Receive the anonymized data (and the class tables, if published) of the data holders over the network,
+        see DataHolder.send_anonymized_data_to. The holder names in sorted order are A and B. One holder is
+        deduplicated.
+        :param server: run.transport.ArtifactServer of classifier 1
+        :param classifier_data_dir_path: directory of classifier 1, the received files are saved in it
+        :param timeout: seconds to wait for each artifact
+        :param kwargs: the other arguments of Classifier1
+        :return: Classifier1
+        """
+        anonymized_data_paths = {}
+        class_table_paths = {}
+        publishes_class_table = {}
+        while (len(anonymized_data_paths) < num_holders or
+               any(published and holder not in class_table_paths
+                   for holder, published in publishes_class_table.items())):
+            stream = server.accept(timeout)
+            holder = stream.meta['holder']
+            path = stream.save_in(classifier_data_dir_path)
+            if stream.name.startswith('class_table_'):
+                class_table_paths[holder] = path
+            else:
+                anonymized_data_paths[holder] = path
+                publishes_class_table[holder] = stream.meta.get('class_table', False)
+            print(f'Classifier 1 received {stream.name} at {path}')
+        holder_names = sorted(anonymized_data_paths)
+        name_B = holder_names[1] if len(holder_names) > 1 else None
+        classifier1 = cls(anonymized_data_paths[holder_names[0]], anonymized_data_paths.get(name_B),
+                          classifier_data_dir_path, class_table_path_A=class_table_paths.get(holder_names[0]),
+                          class_table_path_B=class_table_paths.get(name_B), **kwargs)
+        classifier1.holder_names = holder_names
+        return classifier1
+
+    def send_candidate_links_to(self, classifier2_address, holder_addresses):
+        """
+        Find the candidate links and send them to classifier 2, and the candidate records index of each data holder
+        to the data holder, over the network (see Classifier2.receive_candidate_links and
+        DataHolder.receive_candidate_records)
+        :param classifier2_address: (host, port) of the ArtifactServer of classifier 2
+        :param holder_addresses: dict. keys are holder names, values are (host, port) of their ArtifactServers
+        :return: the paths of send_candidate_links
+        """
+        from run.transport import send_file, send_path
+        paths = self.send_candidate_links()
+        holder_names = self.holder_names or sorted(holder_addresses)
+        # the candidate links first: classifier 2 receives them before the encoded batches of the data holders
+        send_path(classifier2_address, 'candidate_links', paths[0])
+        for holder_name, candidate_records_index_file_path in zip(holder_names, paths[1:]):
+            send_file(holder_addresses[holder_name], f'candidate_records_index_{holder_name}',
+                      candidate_records_index_file_path, meta={'holder': holder_name})
+        return paths
+
+    def find_class_pair_links(self):
+        from record_linkage.block_links import find_class_pair_links, find_self_class_pair_links
+        if self.dedup:
+            return find_self_class_pair_links(self.anonymized_data_path_A,
                                               self.hierarchy_file_dir_path,
-                                              self.qs_list)
+                                              self.qs_list,
+                                              self.classes_A,
+                                              self.class_table_path_A,
+                                              self.blocking_mode)
+        return find_class_pair_links(self.anonymized_data_path_A,
+                                     self.anonymized_data_path_B,
+                                     self.hierarchy_file_dir_path,
+                                     self.qs_list,
+                                     self.classes_A,
+                                     self.classes_B,
+                                     self.class_table_path_A,
+                                     self.class_table_path_B,
+                                     self.blocking_mode)
+
+    def plan_candidate_links(self, num_fields=6):
+        """
+        Dry run: the exact number of candidate links, the estimated memory and classifier 2 runtime,
+        and the strategy send_candidate_links would use. No link is materialized or saved.
+        :param num_fields: number of compared fields in classifier 2, 1 for the record-level bloom filter (clk)
+        :return: CandidatePlan
+        """
+        from record_linkage.planner import plan_candidate_links
+        return plan_candidate_links(self.find_class_pair_links(), num_fields, self.memory_budget_bytes)
+
+    def send_candidate_links(self, progress=None):
+        """
+        :param progress: progress(fraction) is called after each phase, e.g. by the GUI
+        :return: (candidate links, candidate records index file of A, candidate records index file of B).
+                 In deduplication mode only (candidate links, candidate records index file of A)
+        """
+        import pandas as pd
+        if self.dedup:
+            print(f'Start finding duplicate candidate links for {self.anonymized_data_path_A}')
+        else:
+            print(f'Start finding candidate links for {self.anonymized_data_path_A} and {self.anonymized_data_path_B}')
+        class_pair_links = self.find_class_pair_links()
+        if progress is not None:
+            progress(0.5)
+        candidate_links_file_path, candidate_records_A, candidate_records_B = save_class_pair_links(
+            class_pair_links, self.classifier_data_dir_path, self.memory_budget_bytes)
         candidate_records_index_file_path_A = f'{os.path.dirname(self.anonymized_data_path_A)}/candidate_records_index_A.csv'
-        candidate_records_index_file_path_B = f'{os.path.dirname(self.anonymized_data_path_B)}/candidate_records_index_B.csv'
-        # save candidate links to csv file at classifier_data_dir_path
-        all_index = pd.MultiIndex.from_tuples(candidate_links)
-        df = pd.DataFrame(index=all_index).reset_index()
-        candidate_links_file_path = f'{self.classifier_data_dir_path}candidate_links.zip'
-        # set the header as index_A and index_B
-        df.columns = ['index_A', 'index_B']
-        df.to_csv(candidate_links_file_path, index=False, compression='zip')
-        print(f'Find candidate links to successfully! Saved at {candidate_links_file_path}')
+        candidate_records_index_file_path_B = (None if self.dedup else
+                                               f'{os.path.dirname(self.anonymized_data_path_B)}/candidate_records_index_B.csv')
         # save candidate record set A to csv file at dataset_A
-        with open(candidate_records_index_file_path_A, 'w', newline='', encoding='utf-8') as csv_file:
-            csv_writer = csv.writer(csv_file)
-            # csv_writer.writerow(['index'])
-            for element in candidate_record_set_A:
-                csv_writer.writerow([element])
+        pd.Series(candidate_records_A).to_csv(candidate_records_index_file_path_A, index=False, header=False)
         print(f'Candidate records for A saved at {candidate_records_index_file_path_A}')
+        if self.dedup:
+            # both records of each link are records of A
+            return candidate_links_file_path, candidate_records_index_file_path_A
         # save candidate record set B to csv file at dataset_B
-        with open(candidate_records_index_file_path_B, 'w', newline='', encoding='utf-8') as csv_file:
-            csv_writer = csv.writer(csv_file)
-            # csv_writer.writerow(['index'])
-            for element in candidate_record_set_B:
-                csv_writer.writerow([element])
+        pd.Series(candidate_records_B).to_csv(candidate_records_index_file_path_B, index=False, header=False)
         print(f'Candidate records for B saved at {candidate_records_index_file_path_B}')
         return candidate_links_file_path, candidate_records_index_file_path_A, candidate_records_index_file_path_B
 
 
+def save_class_pair_links(class_pair_links, classifier_data_dir_path, memory_budget_bytes=None,
+                          name='candidate_links'):
+    """
+    Count the candidate links before expanding them, pick a strategy and save the links of classifier 1:
+    {name}.zip if they fit in memory, otherwise the link store {name}_store.
+    :return: (path of the candidate links, candidate records of A, candidate records of B)
+    """
+    import pandas as pd
+    from record_linkage.link_store import LinkStore, write_link_store
+    from record_linkage.planner import plan_candidate_links, chunk_size_for_budget
+    # count the candidate links before expanding them, and pick a strategy
+    plan = plan_candidate_links(class_pair_links, memory_budget_bytes=memory_budget_bytes)
+    print(plan)
+    if plan.strategy == 'refuse':
+        raise Exception(f'Too many candidate links: {plan.advice}')
+    if plan.strategy == 'in_memory':
+        # save candidate links to csv file at classifier_data_dir_path
+        candidate_links_file_path = f'{classifier_data_dir_path}{name}.zip'
+        links_A, links_B = class_pair_links.expand()
+        # set the header as index_A and index_B
+        df = pd.DataFrame({'index_A': links_A, 'index_B': links_B})
+        df.to_csv(candidate_links_file_path, index=False, compression='zip')
+        candidate_records_A = class_pair_links.candidate_records('A')
+        candidate_records_B = class_pair_links.candidate_records('B')
+    else:
+        # spill the links to a partitioned binary link store in bounded batches. Classifier 2 reads it part by part.
+        print(plan.advice)
+        candidate_links_file_path = f'{classifier_data_dir_path}{name}_store'
+        write_link_store(class_pair_links, candidate_links_file_path, chunk_size_for_budget(memory_budget_bytes))
+        link_store = LinkStore(candidate_links_file_path)
+        candidate_records_A = link_store.candidate_records('A')
+        candidate_records_B = link_store.candidate_records('B')
+    print(f'Find {plan.num_links} candidate links to successfully! Saved at {candidate_links_file_path}')
+    return candidate_links_file_path, candidate_records_A, candidate_records_B
+
+
+class MultiPartyClassifier1:
+    """
+    Classifier 1 for N data holders: candidate links for every pair of holders from one shared class index
+    """
+
+    def __init__(self, anonymized_data_paths, classifier_data_dir_path, hierarchy_file_dir_path, qs_list,
+                 classes=None, class_table_paths=None, blocking_mode='matrix', memory_budget_bytes=None):
+        """
+        :param anonymized_data_paths: dict. keys are holder names, values are the anonymized datasets
+        :param classes: dict of EquivalenceClasses per holder name (optional)
+        :param class_table_paths: dict of class tables per holder name (optional)
+        """
+        self.anonymized_data_paths = anonymized_data_paths
+        self.classifier_data_dir_path = classifier_data_dir_path
+        self.hierarchy_file_dir_path = hierarchy_file_dir_path
+        self.qs_list = qs_list
+        self.classes = classes
+        self.class_table_paths = class_table_paths
+        self.blocking_mode = blocking_mode
+        self.memory_budget_bytes = memory_budget_bytes
+
+    def send_candidate_links(self):
+        """
+        :return: (dict of the candidate links per holder pair, dict of the candidate records index file per holder).
+                 The candidate records of a holder are its records in any candidate link, with any other holder.
+        """
+        import numpy as np
+        import pandas as pd
+        from record_linkage.block_links import find_multi_party_class_pair_links
+        print(f'Start finding candidate links for {len(self.anonymized_data_paths)} data holders')
+        all_class_pair_links = find_multi_party_class_pair_links(self.anonymized_data_paths,
+                                                                 self.hierarchy_file_dir_path,
+                                                                 self.qs_list,
+                                                                 self.classes,
+                                                                 self.class_table_paths,
+                                                                 self.blocking_mode)
+        candidate_links_file_paths = {}
+        candidate_records = {name: [] for name in self.anonymized_data_paths}
+        for (name_A, name_B), class_pair_links in all_class_pair_links.items():
+            (candidate_links_file_paths[(name_A, name_B)], candidate_records_A,
+             candidate_records_B) = save_class_pair_links(class_pair_links, self.classifier_data_dir_path,
+                                                          self.memory_budget_bytes,
+                                                          f'candidate_links_{name_A}_{name_B}')
+            candidate_records[name_A].append(candidate_records_A)
+            candidate_records[name_B].append(candidate_records_B)
+        candidate_records_index_file_paths = {}
+        for name, records in candidate_records.items():
+            path = f'{os.path.dirname(self.anonymized_data_paths[name])}/candidate_records_index_{name}.csv'
+            records = np.unique(np.concatenate(records).astype(str)) if records else np.array([], dtype=str)
+            pd.Series(records).to_csv(path, index=False, header=False)
+            print(f'{len(records)} candidate records for {name} saved at {path}')
+            candidate_records_index_file_paths[name] = path
+        return candidate_links_file_paths, candidate_records_index_file_paths
+
+
 class Classifier2:
     def __init__(self, encoded_identifiers_file_path_A, encoded_identifiers_file_path_B, candidate_links_file_path, compared_links_file_path, matched_links_file_path, threshold=0.8):
         self.encoded_identifiers_file_path_A = encoded_identifiers_file_path_A
@@ -136,60 +514,238 @@ class Classifier2:
         :param bit_seq_B: bit sequence of bloom filter B
         :return: True if two bloom filters have at least one bit in common, False otherwise
         """
+        import numpy as np
         bit_seq_A = np.array(list(bit_seq_A))
         bit_seq_B = np.array(list(bit_seq_B))
         return 2 * np.sum(bit_seq_A & bit_seq_B) / (np.sum(bit_seq_A) + np.sum(bit_seq_B))
 
-    def compare_links(self):
-        df_a = pd.read_csv(self.encoded_identifiers_file_path_A, index_col="index")
-        df_b = pd.read_csv(self.encoded_identifiers_file_path_B, index_col="index")
-        df_links = pd.read_csv(self.candidate_links_file_path)
-        candidate_links = pd.MultiIndex.from_frame(df_links, names=['index', 'index'])
-        print(type(candidate_links))
-        print(candidate_links)
-        comparer = recordlinkage.Compare()
-        # comp.exact('given_name', 'given_name', label='given_name')
-        # comp.exact('surname', 'surname', label='surname')
-        # comp.exact('address_1_num', 'address_1_num', label='address_1_num')
-        # comp.exact('address_2', 'address_2', label='address_2')
-        # comp.exact('suburb', 'suburb', label='suburb')
-        # comp.exact('state_postcode', 'state_postcode', label='state_postcode')
-        comparer.add(CompareBitarray('given_name', 'given_name', label='given_name'))
-        comparer.add(CompareBitarray('surname', 'surname', label='surname'))
-        comparer.add(CompareBitarray('address_1_num', 'address_1_num', label='address_1_num'))
-        comparer.add(CompareBitarray('address_2', 'address_2', label='address_2'))
-        comparer.add(CompareBitarray('suburb', 'suburb', label='suburb'))
-        comparer.add(CompareBitarray('state_postcode', 'state_postcode', label='state_postcode'))
-        df_compare = comparer.compute(candidate_links, df_a, df_b)
-        print(df_compare)
-        print(type(df_compare))
-        # Save all compared links
-        df_compare.to_csv(self.compared_links_file_path, compression='zip')
+    def compare_links(self, chunk_size=1000000, resume=True, progress=None):
+        """
+        Compare the candidate links chunk by chunk. The candidate links are either candidate_links.zip or
+        the link store that classifier 1 writes when the links do not fit in memory.
+        Each scored chunk is committed to a checkpoint directory next to the compared links file, and the compared
+        links file is assembled from the chunk files at the end. A restarted run resumes after the last committed
+        chunk, unless the candidate links, the encoded identifiers or the chunk size have changed.
+        :param chunk_size: number of links per chunk of candidate_links.zip
+        :param resume: False to discard the committed chunks of an earlier run
+        :param progress: progress(fraction) is called after each committed chunk, e.g. by the GUI
+        """
+        import pandas as pd
+        from record_linkage.checkpoint import ChunkCheckpoint
+        from record_linkage.filter_store import open_filter_store, compare_with_stores, compared_fields, file_signature
+        from record_linkage.link_store import (META_FILE_NAME, count_links, is_link_store, iter_link_chunks,
+                                               open_zip_csv)
+        # the encoded identifiers are decoded once into memory-mapped filter stores,
+        # later runs with other thresholds or other candidate links attach to the same stores.
+        store_a = open_filter_store(self.encoded_identifiers_file_path_A)
+        store_b = open_filter_store(self.encoded_identifiers_file_path_B)
+        links_path = self.candidate_links_file_path
+        signature = {'candidate_links': file_signature(os.path.join(links_path, META_FILE_NAME)
+                                                       if is_link_store(links_path) else links_path),
+                     'encoded_identifiers_A': file_signature(self.encoded_identifiers_file_path_A),
+                     'encoded_identifiers_B': file_signature(self.encoded_identifiers_file_path_B),
+                     'chunk_size': chunk_size}
+        checkpoint = ChunkCheckpoint(f'{os.path.splitext(self.compared_links_file_path)[0]}_checkpoint', signature)
+        if not resume:
+            checkpoint.clear()
+            checkpoint = ChunkCheckpoint(checkpoint.checkpoint_dir, signature)
+        if checkpoint.num_committed > 0:
+            print(f'Resuming after {checkpoint.num_committed} committed chunks '
+                  f'({checkpoint.num_committed_links} compared links)')
+        total_links = count_links(links_path, chunk_size) if progress is not None else 0
+        done_links = 0
+        for chunk, (links_A, links_B) in enumerate(iter_link_chunks(links_path, chunk_size)):
+            done_links += len(links_A)
+            if chunk < checkpoint.num_committed:
+                continue
+            candidate_links = pd.MultiIndex.from_arrays([links_A, links_B], names=['index', 'index'])
+            # one comparison per identifier field, or a single comparison if the record-level bloom filter (clk) is used.
+            # e.g. given_name, surname, address_1_num, address_2, suburb, state_postcode
+            similarities = compare_with_stores(store_a, store_b, links_A, links_B)
+            checkpoint.commit(chunk, pd.DataFrame(similarities, index=candidate_links))
+            if progress is not None:
+                progress(done_links / total_links)
+        # Save all compared links, assembled from the committed chunks
+        with open_zip_csv(self.compared_links_file_path, os.path.basename(self.compared_links_file_path)[:-4]) as csv_file:
+            checkpoint.assemble(csv_file)
+            if checkpoint.num_committed == 0:
+                fields = compared_fields(store_a, store_b)
+                pd.DataFrame(columns=['index', 'index'] + fields).to_csv(csv_file, index=False)
+        num_links = checkpoint.num_committed_links
+        checkpoint.clear()
+        print(f'{num_links} candidate links compared. Saved at {self.compared_links_file_path}')
         return self.compared_links_file_path
 
+    def compare_links_as_batches_arrive(self, encoded_batch_dir_A, encoded_batch_dir_B, poll_interval=0.1,
+                                        timeout=None):
+        """
+        Compare the candidate links while the data holders are still encoding: a link is compared as soon as
+        both of its records have arrived in the encoded batches (DataHolder.send_encoded_batches).
+        The compared links are saved in order of comparison, in the same format as compare_links.
+        :param encoded_batch_dir_A: batch directory of data holder A
+        :param encoded_batch_dir_B: batch directory of data holder B
+        :param poll_interval: seconds to wait for new batches
+        :param timeout: seconds without a new batch after which the comparison fails, None waits forever
+        """
+        from record_linkage.filter_store import EncodedBatches
+        return self.compare_links_from_batches(EncodedBatches(encoded_batch_dir_A), EncodedBatches(encoded_batch_dir_B),
+                                               poll_interval, timeout)
+
+    def receive_candidate_links(self, server, timeout=None):
+        """
+        receive the candidate links sent by classifier 1 (Classifier1.send_candidate_links_to) and save them next to
+        the compared links file
+        :param server: run.transport.ArtifactServer of classifier 2
+        :param timeout: seconds to wait for classifier 1 to connect
+        :return: candidate links file (or link store directory)
+        """
+        stream = server.accept(timeout)
+        if stream.name != 'candidate_links':
+            raise Exception(f'Classifier 2 expected the candidate links, received {stream.name}')
+        self.candidate_links_file_path = stream.save_in(os.path.dirname(self.compared_links_file_path) or '.')
+        print(f'Classifier 2 received the candidate links at {self.candidate_links_file_path}')
+        return self.candidate_links_file_path
+
+    def compare_links_from_streams(self, server, timeout=None, poll_interval=0.05):
+        """
+        Receive the encoded batches of both data holders over the network (DataHolder.stream_encoded_batches_to)
+        and compare the links while the streams are still running.
+        :param server: run.transport.ArtifactServer of classifier 2
+        :param timeout: seconds to wait for each data holder to connect
+        """
+        from run.transport import StreamedBatches
+        batches = {}
+        for _ in range(2):
+            stream = server.accept(timeout)
+            batches[stream.meta['holder']] = StreamedBatches(stream)
+            print(f'Receiving {stream.name} with {stream.codec} compression')
+        holder_A, holder_B = sorted(batches)
+        return self.compare_links_from_batches(batches[holder_A], batches[holder_B], poll_interval)
+
+    def compare_links_from_batches(self, batches_A, batches_B, poll_interval=0.1, timeout=None):
+        """
+        :param batches_A: encoded batches of data holder A, e.g. EncodedBatches or run.transport.StreamedBatches
+        :param batches_B: encoded batches of data holder B
+        :param poll_interval: seconds to wait for new batches
+        :param timeout: seconds without a new batch after which the comparison fails, None waits forever
+        """
+        import numpy as np
+        import pandas as pd
+        from record_linkage.filter_store import compare_as_batches_arrive
+        from record_linkage.link_store import iter_link_chunks, open_zip_csv
+        chunks = list(iter_link_chunks(self.candidate_links_file_path))
+        keys_A = np.concatenate([links_A for links_A, _ in chunks]) if chunks else np.array([], dtype=object)
+        keys_B = np.concatenate([links_B for _, links_B in chunks]) if chunks else np.array([], dtype=object)
+        num_links = 0
+        with open_zip_csv(self.compared_links_file_path, os.path.basename(self.compared_links_file_path)[:-4]) as csv_file:
+            for compared, similarities in compare_as_batches_arrive(keys_A, keys_B, batches_A, batches_B,
+                                                                    poll_interval, timeout):
+                candidate_links = pd.MultiIndex.from_arrays([keys_A[compared], keys_B[compared]],
+                                                            names=['index', 'index'])
+                pd.DataFrame(similarities, index=candidate_links).to_csv(csv_file, header=num_links == 0)
+                num_links += len(compared)
+                print(f'{num_links} of {len(keys_A)} candidate links compared')
+            if num_links == 0:
+                pd.DataFrame(columns=['index', 'index']).to_csv(csv_file, index=False)
+        print(f'{num_links} candidate links compared. Saved at {self.compared_links_file_path}')
+        return self.compared_links_file_path
+
+    def identify_all_pairs(self, tile_size=2048):
+        """
+        No-blocking baseline: compare every record of A with every record of B with the tiled all-pairs engine and
+        save the matched links directly. No candidate links file is needed.
+        """
+        from record_linkage.all_pairs import all_pairs_dice
+        from record_linkage.filter_store import open_filter_store
+        store_a = open_filter_store(self.encoded_identifiers_file_path_A)
+        store_b = open_filter_store(self.encoded_identifiers_file_path_B)
+        df_matched = all_pairs_dice(store_a, store_b, self.threshold, tile_size)
+        df_matched.to_csv(self.matched_links_file_path)
+        return self.matched_links_file_path
+
     def identify_record_linkage(self):
+        import pandas as pd
         df_compare = pd.read_csv(self.compared_links_file_path, index_col=[0, 1])
         df_matched = df_compare[(df_compare.T > self.threshold).all()]
         df_matched.to_csv(self.matched_links_file_path)
         return self.matched_links_file_path
 
+    def identify_duplicate_clusters(self, clusters_file_path):
+        """
+        Deduplication: group the matched links of a dataset with itself into clusters of duplicate records.
+        Run identify_record_linkage first.
+        :param clusters_file_path: output csv with the columns 'index' and 'cluster_id'
+        """
+        import pandas as pd
+        from record_linkage.clusters import cluster_matches
+        df_matched = pd.read_csv(self.matched_links_file_path, dtype=str)
+        df_clusters = cluster_matches(df_matched.iloc[:, 0].values, df_matched.iloc[:, 1].values)
+        df_clusters.to_csv(clusters_file_path, index=False)
+        print(f'{len(df_clusters)} duplicate records in {df_clusters["cluster_id"].nunique()} clusters. '
+              f'Saved at {clusters_file_path}')
+        return clusters_file_path
 
-class CompareBitarray(BaseCompareFeature):
-    def __init__(self, left_on, right_on, threshold=0.7, *args, **kwargs):
-        super(CompareBitarray, self).__init__(left_on, right_on, *args, **kwargs)
-        self.threshold = threshold
 
-    def _compute_vectorized(self, s1, s2):
-        # sim = (s1 == s2).astype(float)
-        # return sim
-        a_counts = s1.apply(lambda x: x.count('1')).values
-        b_counts = s2.apply(lambda x: x.count('1')).values
+class MultiPartyClassifier2:
+    """
+    Classifier 2 for N data holders: scores the candidate links of all holder pairs. The encoded identifiers of each
+    holder are opened once as a filter store and shared by all pairs the holder is in.
+    """
 
-        intersections = [sum(1 for a, b in zip(list(s1_val), list(s2_val)) if a == '1' and b == '1') for s1_val, s2_val
-                         in zip(s1, s2)]
+    def __init__(self, encoded_identifiers_file_paths, candidate_links_file_paths, classifier_data_dir_path,
+                 threshold=0.8):
+        """
+        :param encoded_identifiers_file_paths: dict. keys are holder names, values are encoded identifiers
+        :param candidate_links_file_paths: dict. keys are (holder name, holder name), values are the candidate links
+                                           of MultiPartyClassifier1
+        :param classifier_data_dir_path: directory of the compared and matched links, ends with /
+        """
+        self.encoded_identifiers_file_paths = encoded_identifiers_file_paths
+        self.candidate_links_file_paths = candidate_links_file_paths
+        self.classifier_data_dir_path = classifier_data_dir_path
+        self.threshold = threshold
+
+    def identify_record_linkage(self, chunk_size=1000000):
+        """
+        Compare the candidate links of every holder pair chunk by chunk and keep the matches in the same pass.
+        Saves compared_links_{A}_{B}.zip and matched_links_{A}_{B}.csv per holder pair.
+        :return: dict of the matched links file per holder pair
+        """
+        import pandas as pd
+        from record_linkage.filter_store import open_filter_store, compare_with_stores
+        from record_linkage.link_store import iter_link_chunks, open_zip_csv
+        stores = {}
+        matched_links_file_paths = {}
+        for (name_A, name_B), candidate_links_file_path in self.candidate_links_file_paths.items():
+            for name in (name_A, name_B):
+                if name not in stores:
+                    stores[name] = open_filter_store(self.encoded_identifiers_file_paths[name])
+            compared_links_file_path = f'{self.classifier_data_dir_path}compared_links_{name_A}_{name_B}.zip'
+            matched = []
+            num_links = 0
+            with open_zip_csv(compared_links_file_path, os.path.basename(compared_links_file_path)[:-4]) as csv_file:
+                for links_A, links_B in iter_link_chunks(candidate_links_file_path, chunk_size):
+                    candidate_links = pd.MultiIndex.from_arrays([links_A, links_B], names=['index', 'index'])
+                    df_compare = pd.DataFrame(compare_with_stores(stores[name_A], stores[name_B], links_A, links_B),
+                                              index=candidate_links)
+                    df_compare.to_csv(csv_file, header=num_links == 0)
+                    num_links += len(df_compare)
+                    matched.append(df_compare[(df_compare.T > self.threshold).all()])
+                if num_links == 0:
+                    pd.DataFrame(columns=['index', 'index']).to_csv(csv_file, index=False)
+            matched_links_file_path = f'{self.classifier_data_dir_path}matched_links_{name_A}_{name_B}.csv'
+            df_matched = pd.concat(matched) if matched else pd.DataFrame(
+                index=pd.MultiIndex.from_arrays([[], []], names=['index', 'index']))
+            df_matched.to_csv(matched_links_file_path)
+            print(f'{name_A}-{name_B}: {num_links} candidate links compared, {len(df_matched)} matched. '
+                  f'Saved at {matched_links_file_path}')
+            matched_links_file_paths[(name_A, name_B)] = matched_links_file_path
+        return matched_links_file_paths
 
-        dice_coefficients = [2 * intersection / (a + b) if (a + b) > 0 else 0 for intersection, a, b in
-                             zip(intersections, a_counts, b_counts)]
-        print(1)
-        return pd.Series(dice_coefficients)
 
+def __getattr__(name):
+    # CompareBitarray subclasses a recordlinkage class. It is only imported when it is used.
+    if name == 'CompareBitarray':
+        from record_linkage.compare import CompareBitarray
+        return CompareBitarray
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
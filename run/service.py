@@ -0,0 +1,272 @@
+import json
+import queue
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Online single-record linkage.
+# Classifier 2 runs as a long-running service that loads the encoded identifiers (and optionally the anonymized
+# class table) of data holder B once and indexes them in memory, see record_linkage.similarity_index.
+# A data holder encodes a new record with its own bloom filter configuration and sends only the bloom filters
+# (and the generalized quasi-identifiers of its class, if any) to the service, which answers with the matched
+# records of B. A local HTTP server stands in for the deployment endpoint:
+#   POST /match  {"records": [{"encoded": {field: bit string}, "quasi_identifiers": {attribute: value}}, ...]}
+#             -> {"matches": [[{"index": record index of B, field: Dice-coefficient, ...}, ...], ...]}
+#   GET /stats   number of queries, batches and the mean latency
+# Concurrent requests are grouped into batches (RequestBatcher), so one index search answers many queries.
+# The default MinHash LSH index is approximate: with 16 bands of 4 rows it finds about 97% of the pairs with
+# Dice-coefficient 0.8, so some matches of Classifier2.compare_links are missing from the answers. num_bands and
+# rows_per_band trade recall against speed, exact=True compares every query with every record of B and loses none.
+
+
+class LinkageService:
+    """
+    In-memory index of the encoded identifiers of data holder B, answering match queries
+    """
+
+    def __init__(self, encoded_identifiers_file_path_B, threshold=0.8, anonymized_data_path_B=None,
+                 class_table_path_B=None, hierarchy_file_dir_path=None, qi_list=None, num_bands=16, rows_per_band=4, exact=False):
+        """
+        :param encoded_identifiers_file_path_B: encoded identifiers of data holder B
+        :param threshold: matches have Dice-coefficient > threshold at every field
+        :param anonymized_data_path_B: anonymized data of B with the class_id column (optional). With the class table
+                                       and the hierarchies, queries with quasi-identifiers are only matched with
+                                       records of compatible classes, like the blocking of classifier 1.
+        :param class_table_path_B: class table published by data holder B (optional)
+        :param hierarchy_file_dir_path: hierarchy files of the quasi-identifiers (optional)
+        :param qi_list: the quasi-identifiers of the class table (optional)
+        :param num_bands: see record_linkage.similarity_index.MinHashIndex. More bands find more matches
+        :param rows_per_band: see record_linkage.similarity_index.MinHashIndex. Fewer rows find more matches
+        :param exact: compare every query with every record (ExactIndex) instead of the approximate MinHash index
+        """
+        import numpy as np
+        import pandas as pd
+        from record_linkage.filter_store import open_filter_store
+        from record_linkage.similarity_index import ExactIndex, MinHashIndex
+        start_time = time.time()
+        self.threshold = threshold
+        self.store = open_filter_store(encoded_identifiers_file_path_B)
+        self.index = ExactIndex(self.store) if exact else MinHashIndex(self.store, num_bands, rows_per_band)
+        self.qi_list = qi_list
+        self.compatibility_cache = None
+        if class_table_path_B is not None:
+            from record_linkage.block_links import get_compatibility_cache, load_classes
+            representatives, members = load_classes(anonymized_data_path_B, qi_list, class_table_path=class_table_path_B)
+            self.compatibility_cache = get_compatibility_cache(hierarchy_file_dir_path, qi_list)
+            self.class_node_ids = self.compatibility_cache.encode(representatives)
+            # class position of each record of the store, -1 if the record is not in the anonymized data
+            class_of_record = np.repeat(np.arange(len(members)), [len(records) for records in members])
+            positions = pd.Index(np.concatenate(members)).get_indexer(self.store.keys)
+            self.row_classes = np.where(positions >= 0, class_of_record[positions], -1)
+        self.lock = threading.Lock()
+        self.num_queries = 0
+        self.num_batches = 0
+        self.total_seconds = 0.0
+        print(f'Indexed {len(self.store)} records in {time.time() - start_time:.2f} seconds')
+
+    def validate_query(self, query):
+        """
+        check a query before it is batched with the queries of other requests
+        :raises ValueError: if a field is missing, is not a bit string or has another length than the bloom filters
+                            of B, or if a quasi-identifier value is not in its hierarchy
+        """
+        if not isinstance(query, dict) or not isinstance(query.get('encoded'), dict):
+            raise ValueError("A query must be an object with the bloom filters of the record in 'encoded'")
+        for field in self.store.fields:
+            bit_string = query['encoded'].get(field)
+            if not isinstance(bit_string, str):
+                raise ValueError(f'Bloom filter of field {field} is missing')
+            if len(bit_string) != self.store.num_bits[field] or bit_string.strip('01'):
+                raise ValueError(f'Bloom filter of field {field} must be a bit string of length '
+                                 f'{self.store.num_bits[field]}')
+        quasi_identifiers = query.get('quasi_identifiers')
+        if quasi_identifiers and self.compatibility_cache is not None:
+            if not isinstance(quasi_identifiers, dict):
+                raise ValueError("'quasi_identifiers' must be an object")
+            for j, attribute in enumerate(self.qi_list):
+                if attribute not in quasi_identifiers:
+                    raise ValueError(f'Quasi-identifier {attribute} is missing')
+                if str(quasi_identifiers[attribute]) not in self.compatibility_cache.node_ids[j]:
+                    raise ValueError(f'Value {quasi_identifiers[attribute]!r} of {attribute} is not in its hierarchy')
+
+    def compatible_classes(self, queries):
+        """
+        :return: boolean matrix (number of queries, number of classes of B). Queries without quasi-identifiers are
+                 compatible with every class.
+        """
+        import numpy as np
+        allowed = np.ones((len(queries), len(self.class_node_ids)), dtype=bool)
+        with_qi = [i for i, query in enumerate(queries) if query.get('quasi_identifiers')]
+        if with_qi:
+            node_ids = self.compatibility_cache.encode([queries[i]['quasi_identifiers'] for i in with_qi])
+            pairs_query, pairs_class = self.compatibility_cache.compatible_class_pairs(node_ids, self.class_node_ids)
+            allowed[with_qi] = False
+            allowed[np.asarray(with_qi)[pairs_query], pairs_class] = True
+        return allowed
+
+    def match(self, queries):
+        """
+        :param queries: list of dicts with the bloom filters of a record ('encoded') and optionally the generalized
+                        quasi-identifiers of its class ('quasi_identifiers')
+        :return: list of the matches of each query, best match first
+        """
+        start_time = time.time()
+        matches = [[] for _ in queries]
+        if queries:
+            query_positions, rows, similarities = self.index.search(
+                self.index.pack_queries([query['encoded'] for query in queries]), self.threshold)
+            if self.compatibility_cache is not None:
+                keep = self.compatible_classes(queries)[query_positions, self.row_classes[rows]] & (self.row_classes[rows] >= 0)
+                query_positions, rows = query_positions[keep], rows[keep]
+                similarities = {field: values[keep] for field, values in similarities.items()}
+            for i, (query_position, row) in enumerate(zip(query_positions, rows)):
+                match = {'index': str(self.store.keys[row])}
+                match.update({field: float(values[i]) for field, values in similarities.items()})
+                matches[query_position].append(match)
+            for query_matches in matches:
+                query_matches.sort(key=lambda match: -sum(match[field] for field in similarities))
+        with self.lock:
+            self.num_queries += len(queries)
+            self.num_batches += 1
+            self.total_seconds += time.time() - start_time
+        return matches
+
+    def stats(self):
+        with self.lock:
+            return {'num_records': len(self.store), 'num_queries': self.num_queries, 'num_batches': self.num_batches,
+                    'mean_batch_ms': 1000 * self.total_seconds / max(self.num_batches, 1)}
+
+
+class RequestBatcher:
+    """
+    Groups the queries of concurrent requests into batches for LinkageService.match. A batch is closed when it has
+    max_batch_size queries or max_wait_seconds after its first query arrived.
+    """
+
+    def __init__(self, service, max_batch_size=64, max_wait_seconds=0.002):
+        self.service = service
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, queries):
+        """
+        :return: the matches of the queries, after the batch they are in has been searched
+        """
+        future = Future()
+        self.requests.put((queries, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            num_queries = len(batch[0][0])
+            deadline = time.time() + self.max_wait_seconds
+            while num_queries < self.max_batch_size:
+                try:
+                    batch.append(self.requests.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+                num_queries += len(batch[-1][0])
+            queries = [query for request_queries, _ in batch for query in request_queries]
+            try:
+                matches = self.service.match(queries)
+            except Exception:
+                # search each request alone, so only the requests that fail get the error
+                for request_queries, future in batch:
+                    try:
+                        future.set_result(self.service.match(request_queries))
+                    except Exception as error:  # re-raised in the thread of the request
+                        future.set_exception(error)
+                continue
+            start = 0
+            for request_queries, future in batch:
+                future.set_result(matches[start:start + len(request_queries)])
+                start += len(request_queries)
+
+
+def make_handler(service, batcher=None):
+    match = batcher.submit if batcher is not None else service.match
+
+    class LinkageRequestHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._reply(200, service.stats())
+            else:
+                self._reply(404, {'error': f'Unknown path {self.path}'})
+
+        def do_POST(self):
+            if self.path != '/match':
+                self._reply(404, {'error': f'Unknown path {self.path}'})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                if not isinstance(request, dict) or not isinstance(request.get('records'), list):
+                    raise ValueError("The request must be an object with a list of 'records'")
+                for query in request['records']:
+                    service.validate_query(query)
+            except ValueError as error:
+                self._reply(400, {'error': str(error)})
+                return
+            try:
+                self._reply(200, {'matches': match(request['records'])})
+            except Exception as error:
+                self._reply(500, {'error': repr(error)})
+
+        def log_message(self, format, *args):
+            pass  # one line per query would dominate the output
+
+    return LinkageRequestHandler
+
+
+def serve(service, host='127.0.0.1', port=8080, max_batch_size=64, max_wait_seconds=0.002):
+    """
+    Start the HTTP server of the service in a background thread.
+    :param max_batch_size: maximum number of queries per batch. 1 disables batching
+    :return: ThreadingHTTPServer, call shutdown() to stop it. server_address is the bound (host, port)
+    """
+    batcher = RequestBatcher(service, max_batch_size, max_wait_seconds) if max_batch_size > 1 else None
+    server = ThreadingHTTPServer((host, port), make_handler(service, batcher))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'Linkage service listening on http://{server.server_address[0]}:{server.server_address[1]}')
+    return server
+
+
+def encode_query(identifiers, bloom_config, quasi_identifiers=None):
+    """
+    Encode a record on the side of the data holder, with the same bloom filter configuration as data holder B
+    :param identifiers: dict of identifier fields, e.g. the columns of DataHolder.prepare_identifiers
+    :param quasi_identifiers: generalized quasi-identifiers of the class of the record (optional)
+    :return: query for LinkageService.match
+    """
+    from record_linkage.bloom import encode_bloom
+    query = {'encoded': {field: encode_bloom(str(value), config=bloom_config) for field, value in identifiers.items()}}
+    if quasi_identifiers:
+        query['quasi_identifiers'] = quasi_identifiers
+    return query
+
+
+def query_service(address, queries, timeout=10):
+    """
+    send queries to a running service
+    :param address: (host, port) of the service
+    :param queries: list of queries, see encode_query
+    :return: list of the matches of each query
+    """
+    request = urllib.request.Request(f'http://{address[0]}:{address[1]}/match',
+                                     data=json.dumps({'records': queries}).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())['matches']
@@ -0,0 +1,293 @@
+import json
+import lzma
+import os
+import queue
+import shutil
+import socket
+import struct
+import threading
+import uuid
+import zlib
+
+# Local network transport between participants.
+# Participants on separate hosts exchange artifacts (anonymized data, candidate links, encoded identifiers) as
+# chunked binary streams over TCP instead of file paths on a shared disk. A plain socket on localhost stands in
+# for the deployment network.
+#
+# Each artifact is one connection. Frames are (type: 1 byte, length: 4 bytes, payload):
+#   HELLO  sender -> receiver: json with the artifact name, metadata and the offered compression codecs
+#   ACCEPT receiver -> sender: json with the chosen codec and the window (number of chunks in flight)
+#   DATA   sender -> receiver: one compressed chunk
+#   ACK    receiver -> sender: number of chunks the receiver has consumed. Credits for the next chunks
+#   END    sender -> receiver: json with the number of chunks sent
+# The sender never has more than window unconsumed chunks in flight, so a slow receiver slows the sender down
+# (backpressure) instead of buffering the whole payload. The receiver gets each chunk as soon as it arrives.
+
+HELLO, ACCEPT, DATA, ACK, END = range(5)
+HEADER = struct.Struct('!BI')
+CHUNK_SIZE = 1024 * 1024
+
+# codecs in order of preference of the receiver. 'none' is always supported.
+CODECS = {'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+          'lzma': (lzma.compress, lzma.decompress),
+          'none': (lambda data: data, lambda data: data)}
+DEFAULT_CODECS = ('zlib', 'lzma', 'none')
+
+
+def send_frame(connection, frame_type, payload=b''):
+    connection.sendall(HEADER.pack(frame_type, len(payload)) + payload)
+
+
+def receive_exactly(connection, num_bytes):
+    data = bytearray()
+    while len(data) < num_bytes:
+        part = connection.recv(num_bytes - len(data))
+        if not part:
+            raise ConnectionError('Connection closed in the middle of a frame')
+        data.extend(part)
+    return bytes(data)
+
+
+def receive_frame(connection):
+    frame_type, length = HEADER.unpack(receive_exactly(connection, HEADER.size))
+    return frame_type, receive_exactly(connection, length)
+
+
+def negotiate_codec(offered_codecs, supported_codecs=DEFAULT_CODECS):
+    """
+    the first codec of the receiver's preference that the sender offers
+    """
+    for codec in supported_codecs:
+        if codec in offered_codecs and codec in CODECS:
+            return codec
+    return 'none'
+
+
+def send_artifact(address, name, chunks, meta=None, codecs=DEFAULT_CODECS):
+    """
+    Stream an artifact to a receiving participant.
+    :param address: (host, port) of the ArtifactServer of the receiver
+    :param name: name of the artifact, e.g. 'encoded_identifiers_A'
+    :param chunks: iterable of bytes. Each chunk arrives at the receiver as one chunk
+    :param meta: json serializable metadata, e.g. {'holder': 'A'}
+    :param codecs: compression codecs offered to the receiver
+    :return: (number of chunks, number of bytes before compression, number of bytes sent)
+    """
+    with socket.create_connection(address) as connection:
+        hello = {'name': name, 'meta': meta or {}, 'codecs': [codec for codec in codecs if codec in CODECS]}
+        send_frame(connection, HELLO, json.dumps(hello).encode('utf-8'))
+        frame_type, payload = receive_frame(connection)
+        if frame_type != ACCEPT:
+            raise ConnectionError(f'Expected ACCEPT, got frame type {frame_type}')
+        accept = json.loads(payload)
+        compress = CODECS[accept['codec']][0]
+        credits = accept['window']
+        num_chunks = raw_bytes = sent_bytes = 0
+        for chunk in chunks:
+            # wait for the receiver to consume chunks before sending more than the window
+            while credits == 0:
+                frame_type, payload = receive_frame(connection)
+                if frame_type != ACK:
+                    raise ConnectionError(f'Expected ACK, got frame type {frame_type}')
+                credits += struct.unpack('!I', payload)[0]
+            data = compress(chunk)
+            send_frame(connection, DATA, data)
+            credits -= 1
+            num_chunks += 1
+            raw_bytes += len(chunk)
+            sent_bytes += len(data)
+        send_frame(connection, END, json.dumps({'num_chunks': num_chunks}).encode('utf-8'))
+        # wait until the receiver has consumed everything, so the artifact is complete when this returns
+        while True:
+            frame_type, payload = receive_frame(connection)
+            if frame_type == END:
+                break
+    return num_chunks, raw_bytes, sent_bytes
+
+
+def iter_file_chunks(file_path, chunk_size=CHUNK_SIZE):
+    with open(file_path, 'rb') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def send_file(address, name, file_path, meta=None, codecs=DEFAULT_CODECS, chunk_size=CHUNK_SIZE):
+    """
+    stream a file, e.g. the anonymized data of a data holder to classifier 1
+    """
+    meta = dict(meta or {})
+    meta['file_name'] = os.path.basename(file_path)
+    return send_artifact(address, name, iter_file_chunks(file_path, chunk_size), meta, codecs)
+
+
+def send_path(address, name, path, meta=None, codecs=DEFAULT_CODECS):
+    """
+    stream a file or a directory (e.g. the link store of classifier 1). A directory is sent as a zip archive
+    and unpacked by ArtifactStream.save_in
+    """
+    if not os.path.isdir(path):
+        return send_file(address, name, path, meta, codecs)
+    meta = dict(meta or {})
+    meta['directory'] = os.path.basename(os.path.normpath(path))
+    archive_base = f'{os.path.normpath(path)}.send-{uuid.uuid4().hex}'
+    archive_path = shutil.make_archive(archive_base, 'zip', path)
+    try:
+        return send_file(address, name, archive_path, meta, codecs)
+    finally:
+        os.remove(archive_path)
+
+
+class ArtifactStream:
+    """
+    An incoming artifact. Iterating over it yields the decompressed chunks as they arrive.
+    """
+
+    def __init__(self, connection, supported_codecs=DEFAULT_CODECS, window=8):
+        self.connection = connection
+        frame_type, payload = receive_frame(connection)
+        if frame_type != HELLO:
+            raise ConnectionError(f'Expected HELLO, got frame type {frame_type}')
+        hello = json.loads(payload)
+        self.name = hello['name']
+        self.meta = hello['meta']
+        self.codec = negotiate_codec(hello['codecs'], supported_codecs)
+        self.decompress = CODECS[self.codec][1]
+        send_frame(connection, ACCEPT, json.dumps({'codec': self.codec, 'window': window}).encode('utf-8'))
+        self.num_chunks = 0
+        self.received_bytes = 0
+
+    def __iter__(self):
+        try:
+            while True:
+                frame_type, payload = receive_frame(self.connection)
+                if frame_type == END:
+                    num_chunks = json.loads(payload)['num_chunks']
+                    if num_chunks != self.num_chunks:
+                        raise ConnectionError(f'{self.name}: {num_chunks} chunks sent, {self.num_chunks} received')
+                    send_frame(self.connection, END)
+                    return
+                if frame_type != DATA:
+                    raise ConnectionError(f'Expected DATA, got frame type {frame_type}')
+                self.num_chunks += 1
+                self.received_bytes += len(payload)
+                yield self.decompress(payload)
+                # the chunk is consumed, the sender may send one more
+                send_frame(self.connection, ACK, struct.pack('!I', 1))
+        finally:
+            self.connection.close()
+
+    def save(self, file_path):
+        """
+        write the chunks to a file as they arrive
+        :return: file_path
+        """
+        with open(f'{file_path}.tmp', 'wb') as file:
+            for chunk in self:
+                file.write(chunk)
+        os.replace(f'{file_path}.tmp', file_path)
+        return file_path
+
+    def save_in(self, directory):
+        """
+        save a file sent with send_file or send_path in directory, under its original name
+        :return: path of the saved file or directory
+        """
+        if 'directory' not in self.meta:
+            return self.save(os.path.join(directory, self.meta['file_name']))
+        target_dir = os.path.join(directory, self.meta['directory'])
+        archive_path = self.save(os.path.join(directory, f'{self.meta["directory"]}.receive-{uuid.uuid4().hex}.zip'))
+        try:
+            shutil.rmtree(target_dir, ignore_errors=True)
+            shutil.unpack_archive(archive_path, target_dir, 'zip')
+        finally:
+            os.remove(archive_path)
+        return target_dir
+
+
+class ArtifactServer:
+    """
+    Listening socket of a receiving participant. Each accepted connection is one incoming artifact.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, supported_codecs=DEFAULT_CODECS, window=8):
+        self.supported_codecs = supported_codecs
+        self.window = window
+        self.socket = socket.create_server((host, port))
+        self.address = self.socket.getsockname()[:2]
+
+    def accept(self, timeout=None):
+        """
+        wait for the next artifact
+        :return: ArtifactStream
+        """
+        self.socket.settimeout(timeout)
+        connection, _ = self.socket.accept()
+        connection.settimeout(None)
+        return ArtifactStream(connection, self.supported_codecs, self.window)
+
+    def close(self):
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def receive_files(server, directory, num_files, timeout=None):
+    """
+    receive files sent with send_file and save them in directory, each one while it arrives
+    :return: dict. keys are artifact names, values are the saved file paths
+    """
+    paths = {}
+    for _ in range(num_files):
+        stream = server.accept(timeout)
+        paths[stream.name] = stream.save_in(directory)
+    return paths
+
+
+class StreamedBatches:
+    """
+    Encoded batches of a data holder that arrive over an ArtifactStream, with the interface of
+    record_linkage.filter_store.EncodedBatches, so classifier 2 compares links while the stream is still running.
+    Each chunk of the stream is one batch (a csv). The stream is read by a background thread.
+    """
+
+    def __init__(self, stream, max_buffered_batches=8):
+        self.stream = stream
+        # bounded, so the sender is slowed down if classifier 2 does not keep up
+        self.batches = queue.Queue(maxsize=max_buffered_batches)
+        self.num_received = 0
+        self.finished = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._receive, daemon=True)
+        self.thread.start()
+
+    def _receive(self):
+        try:
+            for chunk in self.stream:
+                self.batches.put(chunk)
+                self.num_received += 1
+        except Exception as error:  # re-raised in the thread of classifier 2
+            self.error = error
+        self.finished.set()
+
+    def num_batches(self):
+        if self.error is not None:
+            raise self.error
+        return self.num_received if self.finished.is_set() else None
+
+    def read_new(self):
+        import io
+        import pandas as pd
+        batches = []
+        while True:
+            try:
+                chunk = self.batches.get_nowait()
+            except queue.Empty:
+                return batches
+            batches.append(pd.read_csv(io.BytesIO(chunk), dtype=str))
@@ -0,0 +1,17 @@
+import os
+import sys
+
+# the packages of the project (k_anonymize, record_linkage, run, ...) are imported from the root directory
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+DATASET_DIR = os.path.join(ROOT_DIR, 'dataset')
+HIERARCHY_DIR = os.path.join(DATASET_DIR, 'hierarchy') + '/'
+QUASI_IDENTIFIERS = ['sex', 'age', 'race', 'marital-status', 'education', 'native-country', 'workclass', 'occupation']
+SENSITIVE_ATTRIBUTES = ['salary-class']
+IDENTIFIER = ['given_name', 'surname', 'street_number', 'address_1', 'address_2', 'suburb', 'postcode', 'state',
+              'soc_sec_id']
+
+
+def dataset_path(holder_name):
+    return os.path.join(DATASET_DIR, f'dataset_{holder_name}', f'dataset_{holder_name}.csv')
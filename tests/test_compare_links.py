@@ -0,0 +1,85 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import zipfile
+import numpy as np
+import pandas as pd
+from conftest import ROOT_DIR
+from record_linkage import filter_store
+from record_linkage.checkpoint import MANIFEST_FILE_NAME
+from run.participant import Classifier2
+
+NUM_RECORDS = 200
+NUM_LINKS = 2000
+CHUNK_SIZE = 250
+
+# run in a separate process, which kills itself with SIGKILL after half of the chunks are committed
+KILLED_RUN = '''
+import os, signal, sys
+from run.participant import Classifier2
+
+def progress(fraction):
+    if fraction >= 0.5:
+        os.kill(os.getpid(), signal.SIGKILL)
+
+Classifier2(*sys.argv[1:6]).compare_links(chunk_size=int(sys.argv[6]), progress=progress)
+'''
+
+
+def write_encoded_identifiers(file_path, suffix, rng):
+    df = pd.DataFrame({'index': [f'{i}_{suffix}' for i in range(NUM_RECORDS)]})
+    for field in ['given_name', 'surname', 'address_2']:
+        bits = rng.random((NUM_RECORDS, 64)) < 0.2
+        df[field] = [''.join('1' if bit else '0' for bit in row) for row in bits]
+    df.to_csv(file_path, index=False, compression='zip')
+
+
+def write_inputs(directory):
+    rng = np.random.default_rng(0)
+    encoded_A = os.path.join(directory, 'encoded_identifiers_A.zip')
+    encoded_B = os.path.join(directory, 'encoded_identifiers_B.zip')
+    write_encoded_identifiers(encoded_A, 'a', rng)
+    write_encoded_identifiers(encoded_B, 'b', rng)
+    links = os.path.join(directory, 'candidate_links.zip')
+    pd.DataFrame({'index_A': [f'{i}_a' for i in rng.integers(NUM_RECORDS, size=NUM_LINKS)],
+                  'index_B': [f'{i}_b' for i in rng.integers(NUM_RECORDS, size=NUM_LINKS)]}).to_csv(
+        links, index=False, compression='zip')
+    return encoded_A, encoded_B, links
+
+
+def read_compared_links(file_path):
+    with zipfile.ZipFile(file_path) as zip_file:
+        return zip_file.read(zip_file.namelist()[0])
+
+
+def test_resumed_compare_links_matches_uninterrupted_run(tmp_path, monkeypatch):
+    encoded_A, encoded_B, links = write_inputs(str(tmp_path))
+    uninterrupted = str(tmp_path / 'compared_links.zip')
+    Classifier2(encoded_A, encoded_B, links, uninterrupted, str(tmp_path / 'matched_links.csv')).compare_links(
+        chunk_size=CHUNK_SIZE)
+
+    compared = str(tmp_path / 'compared_links_killed.zip')
+    matched = str(tmp_path / 'matched_links_killed.csv')
+    killed = subprocess.run([sys.executable, '-c', KILLED_RUN, encoded_A, encoded_B, links, compared, matched,
+                             str(CHUNK_SIZE)], cwd=ROOT_DIR)
+    assert killed.returncode == -signal.SIGKILL
+    assert not os.path.exists(compared)
+    with open(os.path.join(str(tmp_path / 'compared_links_killed_checkpoint'), MANIFEST_FILE_NAME)) as manifest_file:
+        num_committed = len(json.load(manifest_file)['chunks'])
+    num_chunks = NUM_LINKS // CHUNK_SIZE
+    assert 0 < num_committed < num_chunks
+
+    # the resumed run only scores the chunks that were not committed before the kill
+    compare_with_stores = filter_store.compare_with_stores
+    scored_chunks = []
+
+    def counting_compare_with_stores(*args, **kwargs):
+        scored_chunks.append(len(args[2]))
+        return compare_with_stores(*args, **kwargs)
+
+    monkeypatch.setattr(filter_store, 'compare_with_stores', counting_compare_with_stores)
+    Classifier2(encoded_A, encoded_B, links, compared, matched).compare_links(chunk_size=CHUNK_SIZE)
+    assert len(scored_chunks) == num_chunks - num_committed
+    assert read_compared_links(compared) == read_compared_links(uninterrupted)
@@ -0,0 +1,12 @@
+from conftest import HIERARCHY_DIR, IDENTIFIER, QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTES, dataset_path
+from k_anonymize import mondrian
+
+
+def test_multi_k_matches_run_anonymize():
+    k_list = [5, 10]
+    multi_k = mondrian.run_anonymize_multi_k(QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTES, IDENTIFIER, dataset_path('A'),
+                                             HIERARCHY_DIR, k_list)
+    for k in k_list:
+        serial = mondrian.run_anonymize(QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTES, IDENTIFIER, dataset_path('A'),
+                                        HIERARCHY_DIR, k)
+        assert multi_k[k].to_csv() == serial.to_csv()
@@ -0,0 +1,48 @@
+import os
+import threading
+import pytest
+from run.transport import ArtifactServer, send_file, send_path
+
+
+def send_in_thread(send, *args, **kwargs):
+    thread = threading.Thread(target=send, args=args, kwargs=kwargs)
+    thread.start()
+    return thread
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'lzma', 'none'])
+def test_file_round_trip_is_byte_identical(tmp_path, codec):
+    # random bytes do not compress, repeated text does. 4 KiB chunks make many chunks and fill the window
+    payload = os.urandom(100000) + b'index,given_name,surname\n' * 10000 + os.urandom(123)
+    file_path = tmp_path / 'anonymized.csv'
+    file_path.write_bytes(payload)
+    received_dir = tmp_path / 'received'
+    received_dir.mkdir()
+    with ArtifactServer() as server:
+        sender = send_in_thread(send_file, server.address, 'anonymized', str(file_path), codecs=(codec,),
+                                chunk_size=4096)
+        stream = server.accept(timeout=10)
+        saved_path = stream.save_in(str(received_dir))
+        sender.join()
+    assert stream.codec == codec
+    assert os.path.basename(saved_path) == 'anonymized.csv'
+    with open(saved_path, 'rb') as saved_file:
+        assert saved_file.read() == payload
+
+
+def test_directory_round_trip_is_byte_identical(tmp_path):
+    store_dir = tmp_path / 'link_store'
+    store_dir.mkdir()
+    files = {'meta.json': b'{"num_links": 3}', 'part-00000.npy': os.urandom(50000), 'part-00001.npy': b''}
+    for name, content in files.items():
+        (store_dir / name).write_bytes(content)
+    received_dir = tmp_path / 'received'
+    received_dir.mkdir()
+    with ArtifactServer() as server:
+        sender = send_in_thread(send_path, server.address, 'candidate_links', str(store_dir))
+        saved_dir = server.accept(timeout=10).save_in(str(received_dir))
+        sender.join()
+    assert sorted(os.listdir(saved_dir)) == sorted(files)
+    for name, content in files.items():
+        with open(os.path.join(saved_dir, name), 'rb') as saved_file:
+            assert saved_file.read() == content